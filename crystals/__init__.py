@@ -1 +1,3 @@
-__all__ = ['api', 'engine',  'game', 'gui', 'loader', 'world']
+__all__ = ['api', 'bench', 'engine', 'game', 'gui', 'loader', 'path',
+           'quads', 'replay', 'save', 'schedule', 'session', 'stats',
+           'texture', 'trace', 'view', 'world']
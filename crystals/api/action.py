@@ -4,14 +4,38 @@ import abc
 from itertools import *
 
 
+def _state(action):
+    """Return the state of `action`, which may be any callable."""
+    state = getattr(action, 'state', None)
+    return state() if state is not None else None
+
+
+def _restore(action, state):
+    """Restore `action` to `state`, as returned by `_state`."""
+    if state is not None:
+        action.restore(state)
+
+
 class Action(object):
     """Abstract entity action class.
     
-    All entity action classes should derive from this class.
+    All entity action classes should derive from this class. Actions
+    that change as they are called, such as ActionIter, report how far
+    they have got with `state` and pick up from there with `restore`,
+    so that saved games can resume them.
     """
 
     __metaclass__ = abc.ABCMeta
 
+    def state(self):
+        """Return how far the action has got, in a form that can be
+        pickled, or None if it's as it started.
+        """
+        return None
+
+    def restore(self, state):
+        """Pick up from `state`, as returned by `state`."""
+
     @abc.abstractmethod
     def __call__(self, wmode, entity):
         """Execute the action, given WorldMode object `wmode` and
@@ -33,20 +57,58 @@ class ActionIter(Action):
 
     def __init__(self, *actions):
         assert actions
-        self.actions = chain(actions[:-1], repeat(actions[-1]))
+        self.sequence = actions
+        self.calls = 0
+        self.actions = self._start()
+
+    def _start(self):
+        return chain(self.sequence[:-1], repeat(self.sequence[-1]))
+
+    def _position(self):
+        return min(self.calls, len(self.sequence) - 1)
 
     def __call__(self, wmode, entity):
+        self.calls += 1
         next(self.actions)(wmode, entity)
 
+    def state(self):
+        children = tuple(_state(action) for action in self.sequence)
+        position = self._position()
+        if not position and not any(children):
+            return None
+        return (position, children)
+
+    def restore(self, state):
+        position, children = state
+        self.actions = self._start()
+        for i in xrange(position):
+            next(self.actions)
+        self.calls = position
+        for action, child in zip(self.sequence, children):
+            _restore(action, child)
+
+    def __getstate__(self):
+        # Iterators can't be pickled, so leave out the iterator and
+        # start a new one from the position when unpickled
+        state = dict(self.__dict__)
+        del state['actions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restore((self._position(), ()))
+
 
 class ActionLoop(ActionIter):
     """On call, calls the next action in sequence, starting over at the
     beginning once the end of the sequence is reached.
     """
 
-    def __init__(self, *actions):
-        assert actions
-        self.actions = cycle(actions)
+    def _start(self):
+        return cycle(self.sequence)
+
+    def _position(self):
+        return self.calls % len(self.sequence)
 
 
 class ActionCycle(Action):
@@ -63,10 +125,14 @@ class ActionCycle(Action):
         """
         assert type(n) is int and n > 1
         assert actions
+        self.n = n
+        self.sequence = actions
+        self.calls = 0
         self.actions = chain(*repeat(actions, n))
         self._final_action = actions[-1]
 
     def __call__(self, wmode, entity):
+        self.calls += 1
         try:
             action = next(self.actions)
         except StopIteration:
@@ -75,6 +141,31 @@ class ActionCycle(Action):
         finally:
             action(wmode, entity)
 
+    def state(self):
+        children = tuple(_state(action) for action in self.sequence)
+        position = min(self.calls, self.n * len(self.sequence))
+        if not position and not any(children):
+            return None
+        return (position, children)
+
+    def restore(self, state):
+        position, children = state
+        self.actions = chain(*repeat(self.sequence, self.n))
+        for i in xrange(position):
+            next(self.actions)
+        self.calls = position
+        for action, child in zip(self.sequence, children):
+            _restore(action, child)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['actions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restore((min(self.calls, self.n * len(self.sequence)), ()))
+
 
 class ActionSequence(Action):
     """On call, calls each given action in sequence."""
@@ -86,6 +177,14 @@ class ActionSequence(Action):
         for action in self.actions:
             action(wmode, entity)
 
+    def state(self):
+        children = tuple(_state(action) for action in self.actions)
+        return children if any(children) else None
+
+    def restore(self, state):
+        for action, child in zip(self.actions, state):
+            _restore(action, child)
+
 
 class ResetAction(Action):
     """On call, overwrites the entity's action with the given action."""
@@ -97,15 +196,65 @@ class ResetAction(Action):
         entity.action = self.action
         self.action(wmode, entity)
 
+    def state(self):
+        return _state(self.action)
+
+    def restore(self, state):
+        _restore(self.action, state)
+
+
+class Pursue(Action):
+    """On call, move the entity one step along the shortest way to the
+    unique entity with the given id, or to the player if `id` is None,
+    if it's in the same room.
+
+    All entities pursuing the same target share one distance field (see
+    `crystals.path.Pathfinder`), so any number can give chase at once.
+    """
+
+    def __init__(self, id=None):
+        self.id = id
+
+    def __call__(self, wmode, entity):
+        if self.id is None:
+            target = wmode.player
+        else:
+            target = wmode.world.focus.uniques.get(self.id)
+        step = wmode.paths.step_toward(entity, target)
+        if step:
+            wmode.world.step_entity(entity, *step)
+
+
+class Schedule(Action):
+    """On call, makes the entity perform the given action on its own
+    every `interval` ticks (see `crystals.schedule.Scheduler`).
+    """
+
+    def __init__(self, action, interval=1):
+        self.action = action
+        self.interval = interval
+
+    def __call__(self, wmode, entity):
+        wmode.scheduler.add(entity, self.action, self.interval)
+
+
+class Unschedule(Action):
+    """On call, stops the entity performing its scheduled action."""
+
+    def __call__(self, wmode, entity):
+        wmode.scheduler.remove(entity)
+
 
 class UpdatePlot(Action):
-    """On call, sends updates to the plot generator."""
+    """On call, queues updates to be sent to the plot generator at the
+    end of the tick.
+    """
 
     def __init__(self, updates):
         self.updates = updates
 
     def __call__(self, wmode, entity):
-        wmode.plot.send(self.updates)
+        wmode.update_plot(self.updates)
 
 
 class Alert(Action):
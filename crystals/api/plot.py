@@ -1,12 +1,261 @@
 """implementation of plot mechanics"""
+from collections import namedtuple
+
 
 class GameOver(BaseException):
     """Raised when the game is over."""
 
 
-def _format_triggers(triggers):
-    return dict((frozenset(k), (v[0], _format_triggers(v[1])))
-                for k, v in triggers.iteritems())
+class Count(namedtuple('Count', 'state n')):
+    """Plot condition met once plot state `state` has been updated at
+    least `n` times.
+    """
+    __slots__ = ()
+
+
+class Not(namedtuple('Not', 'state')):
+    """Plot condition met for as long as plot state `state` is absent."""
+    __slots__ = ()
+
+
+class Any(namedtuple('Any', 'room predicate')):
+    """Plot condition met while any unique entity in the room named
+    `room` satisfies `predicate`, a callable taking the entity.
+    """
+    __slots__ = ()
+
+
+class EntityUpdate(namedtuple('EntityUpdate', 'room entity present')):
+    """Plot update telling `Any` conditions that a unique entity was put
+    in the room named `room`, or changed there, if `present` is True,
+    or that it left the room if not.
+    """
+    __slots__ = ()
+
+
+class Progress(namedtuple('Progress', 'active counts')):
+    """How far a plot has got, in a form that can be pickled: `active`
+    is a list of the paths of the active triggers, and `counts` maps
+    each plot state identifier added so far to the number of times it
+    has been added.
+
+    A trigger's path is the list of its requirements and those of the
+    triggers it is nested in, so it stays the same from one run of the
+    game to the next. Sending `Progress` itself to a plot returns how
+    far it has got, and sending a Progress puts the plot back there.
+    """
+    __slots__ = ()
+
+
+def _stable(requirement, index):
+    """Return a form of the requirement at `index` in a trigger's key
+    that is the same in every run of the game, so that it can be saved.
+
+    Predicates such as lambdas share one name, so `Any` conditions are
+    known by their place in the key and the line their predicate is
+    defined on instead.
+    """
+    if isinstance(requirement, Any):
+        code = getattr(requirement.predicate, '__code__', None)
+        return ('Any', requirement.room, index,
+                code.co_firstlineno if code else None)
+    return requirement
+
+
+class _Trigger(object):
+    """A plot trigger with its required states compiled to a bitset."""
+
+    __slots__ = ('order', 'path', 'atoms', 'mask', 'func', 'branch')
+
+    def __init__(self, order, path, atoms, func, branch):
+        self.order = order
+        self.path = path
+        self.atoms = atoms
+        self.mask = sum(1 << atom for atom in atoms)
+        self.func = func
+        self.branch = branch
+
+
+class _TriggerSet(object):
+    """The active triggers of a plot, compiled from a `triggers` dict
+    (see `plot`).
+
+    Plot state identifiers are interned as small integers, or atoms, so
+    that state and trigger requirements can be stored as bitsets. Each
+    atom is indexed to the active triggers that require it, so an update
+    only checks the triggers that mention the states it adds.
+
+    Conditions (`Count`, `Not` and `Any`) are atoms too, whose bits are
+    set for as long as they are met. Each condition remembers what it
+    has matched so far, and is only tested again when the state or room
+    it watches is updated.
+    """
+
+    def __init__(self, state, triggers):
+        self.atoms = {}
+        self.mask = 0
+        self.active = {}  # Maps requirement bitsets to active triggers
+        self.index = {}   # Maps atoms to active triggers that require them
+        self.pending = [] # Triggers met as soon as they became active
+
+        self.counts = {}  # Maps atoms to the number of times updated
+        self.state_conditions = {} # Maps atoms to conditions watching them
+        self.room_conditions = {}  # Maps room names to Any conditions
+        self.matches = {} # Maps Any conditions to ids of matching entities
+
+        for s in state:
+            atom = self.intern(s)
+            self.mask |= 1 << atom
+            self.counts[atom] = 1
+
+        self._count = 0
+        self.roots = self._compile(triggers)
+        for trigger in self.roots:
+            self.activate(trigger)
+
+    def __len__(self):
+        return len(self.active)
+
+    def _compile(self, triggers, path=()):
+        compiled = []
+        for req_state, (func, nextbranch) in triggers.iteritems():
+            atoms = tuple(set(self.intern(s) for s in req_state))
+            self._count += 1
+            trigger_path = path + (tuple(sorted(
+                _stable(s, i) for i, s in enumerate(req_state))),)
+            compiled.append(_Trigger(
+                self._count, trigger_path, atoms, func,
+                self._compile(nextbranch, trigger_path)))
+        return compiled
+
+    def intern(self, state):
+        """Return the atom of a plot state identifier or condition."""
+        atom = self.atoms.get(state)
+        if atom is None:
+            atom = self.atoms[state] = len(self.atoms)
+            if isinstance(state, (Count, Not)):
+                watched = self.intern(state.state)
+                self.state_conditions.setdefault(watched, []).append(state)
+                if self.test(state):
+                    self.mask |= 1 << atom
+            elif isinstance(state, Any):
+                self.room_conditions.setdefault(state.room, []).append(state)
+                self.matches[state] = set()
+        return atom
+
+    def test(self, condition):
+        """Return True if `condition` is met."""
+        if isinstance(condition, Count):
+            atom = self.atoms[condition.state]
+            return self.counts.get(atom, 0) >= condition.n
+        if isinstance(condition, Not):
+            return not self.mask & (1 << self.atoms[condition.state])
+        return bool(self.matches[condition])
+
+    def _retest(self, condition, candidates):
+        bit = 1 << self.atoms[condition]
+        if not self.test(condition):
+            self.mask &= ~bit
+        elif not self.mask & bit:
+            self.mask |= bit
+            candidates.update(self.index.get(self.atoms[condition], ()))
+
+    def add(self, states, entities=()):
+        """Add each state in `states` and apply each EntityUpdate in
+        `entities`, returning the list of triggers met as a result, or
+        that were met when they became active since the last call.
+        """
+        candidates = set(self.pending)
+        del self.pending[:]
+        watched = []
+        for state in states:
+            atom = self.intern(state)
+            self.counts[atom] = self.counts.get(atom, 0) + 1
+            bit = 1 << atom
+            if not self.mask & bit:
+                self.mask |= bit
+                candidates.update(self.index.get(atom, ()))
+            if atom in self.state_conditions:
+                watched.append(atom)
+
+        for atom in watched:
+            for condition in self.state_conditions[atom]:
+                self._retest(condition, candidates)
+
+        for room, entity, present in entities:
+            for condition in self.room_conditions.get(room, ()):
+                matches = self.matches[condition]
+                if present and condition.predicate(entity):
+                    matches.add(entity.id)
+                else:
+                    matches.discard(entity.id)
+                self._retest(condition, candidates)
+
+        return sorted((t for t in candidates if t.mask & self.mask == t.mask),
+                      key=lambda t: t.order)
+
+    def activate(self, trigger):
+        """Make `trigger` active, in place of any active trigger with the
+        same requirements.
+        """
+        old = self.active.get(trigger.mask)
+        if old is not None:
+            self.retire(old)
+        self.active[trigger.mask] = trigger
+        for atom in trigger.atoms:
+            self.index.setdefault(atom, set()).add(trigger)
+        if trigger.mask & self.mask == trigger.mask:
+            self.pending.append(trigger)
+
+    def retire(self, trigger):
+        """Make `trigger` inactive."""
+        del self.active[trigger.mask]
+        for atom in trigger.atoms:
+            self.index[atom].discard(trigger)
+        if trigger in self.pending:
+            self.pending.remove(trigger)
+
+    def progress(self):
+        """Return a Progress recording the active triggers and the
+        counts of the plot states added so far.
+        """
+        active = sorted(t.path for t in self.active.itervalues())
+        counts = dict(
+            (state, self.counts[atom])
+            for state, atom in self.atoms.iteritems()
+            if atom in self.counts and
+            not isinstance(state, (Count, Not, Any)))
+        return Progress(active, counts)
+
+    def restore(self, progress):
+        """Go back to the point recorded by Progress `progress`, and
+        return True. If it has active triggers that aren't among these,
+        as when the triggers have changed since, change nothing and
+        return False.
+        """
+        triggers = {}
+        branches = [self.roots]
+        while branches:
+            for trigger in branches.pop():
+                triggers[trigger.path] = trigger
+                branches.append(trigger.branch)
+        if not all(path in triggers for path in progress.active):
+            return False
+
+        for state, n in progress.counts.iteritems():
+            atom = self.intern(state)
+            self.counts[atom] = n
+            self.mask |= 1 << atom
+        candidates = set()
+        for conditions in self.state_conditions.itervalues():
+            for condition in conditions:
+                self._retest(condition, candidates)
+
+        for trigger in self.active.values():
+            self.retire(trigger)
+        for path in progress.active:
+            self.activate(triggers[path])
+        return True
 
 
 def _coroutine(func):
@@ -37,6 +286,11 @@ def plot(state, triggers):
             ('state5',): (func4, {}),
             ...})
 
+    Besides plot state identifiers, a key may hold conditions such as
+    ``Count('state6', 3)``, ``Not('state7')`` or ``Any('room', func)``.
+    `Any` conditions are kept up to date by EntityUpdate objects sent
+    along with the other updates.
+
     After creating a generator, its first iteration should be to send it 
     the controlling application object. Thereafter, any calls to `send`
     are treated as plot updates, and the triggers are checked to see if
@@ -46,31 +300,60 @@ def plot(state, triggers):
     For each trigger at the top level whose conditions have been met,
     the corresp. function is called with the controlling application
     as its sole argument. That entry is then deleted except for nested
-    entries, which are moved up a level. Once the triggers are exhausted,
-    GameOver is raised.
+    entries, which are moved up a level. Nested entries whose conditions
+    are already met are called in turn during the same update. Once the
+    triggers are exhausted, GameOver is raised.
+
+    Several updates may be sent at once as a list; see
+    `crystals.session.Session.update_plot`.
+
+    The triggers are compiled when the generator is created, so each
+    update only checks the triggers that require the states it adds.
+
+    Sending `Progress` returns how far the plot has got, and sending a
+    Progress object goes back there and returns True, so that games can
+    be saved. A Progress from other triggers is ignored, returning False.
     """
-    triggers = _format_triggers(triggers)
+    triggers = _TriggerSet(state, triggers)
 
     app = (yield)
     assert app
 
+    reply = None
     while triggers:
         # Get state updates
-        updates = (yield)
+        updates = (yield reply)
+        reply = None
         if updates is None:
             continue
+        if updates is Progress:
+            reply = triggers.progress()
+            continue
+        if isinstance(updates, Progress):
+            reply = triggers.restore(updates)
+            if reply:
+                state.update(updates.counts)
+            continue
 
         # Update state
-        if type(updates) in (tuple, set, frozenset, list):
-            state.update(updates)
-        else:
-            state.add(updates)
-
-        # Call trigger functions
-        for req_state, (func, nextbranch) in triggers.items():
-            if req_state <= state:
-                func(app)
-                del triggers[req_state]
-                triggers.update(nextbranch)
+        if type(updates) not in (tuple, set, frozenset, list):
+            updates = (updates,)
+        entities = [u for u in updates if isinstance(u, EntityUpdate)]
+        if entities:
+            updates = [u for u in updates if not isinstance(u, EntityUpdate)]
+        state.update(updates)
+
+        # Call trigger functions, then any nested triggers they make
+        # active that are already met, until no more are met
+        met = triggers.add(updates, entities)
+        while met:
+            for trigger in met:
+                if triggers.active.get(trigger.mask) is not trigger:
+                    continue # Replaced by a trigger called before it
+                trigger.func(app)
+                triggers.retire(trigger)
+                for nexttrigger in trigger.branch:
+                    triggers.activate(nexttrigger)
+            met = triggers.add(())
 
     raise GameOver()
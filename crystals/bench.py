@@ -0,0 +1,461 @@
+"""benchmarks of the game's hot paths on synthetic worlds
+
+Run with ``python2 -m crystals.bench`` (or ``./run.py bench``). Each
+benchmark is run at every requested scale and the results are written
+as JSON, so that runs can be compared with ``--compare``::
+
+    python2 -m crystals.bench -s tiny,small -o before.json
+    python2 -m crystals.bench -s tiny,small -o after.json -c before.json
+
+Benchmarks that draw to the screen are skipped when no display is
+available.
+"""
+import argparse
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple, OrderedDict
+from timeit import default_timer as clock
+
+from crystals import loader
+from crystals import save
+from crystals.api import action
+from crystals.api import plot
+from crystals.session import Session
+from crystals.world import Entity
+
+__all__ = ['Scale', 'SCALES', 'BENCHMARKS', 'write_world', 'make_triggers',
+           'run', 'compare']
+
+IMG_PATH = os.path.join(os.path.dirname(__file__), 'test', 'res', 'img')
+SEED = 1729 # random seed used to lay out synthetic worlds
+MAX_NPCS = 2000 # most wandering entities added to a room
+
+
+class Scale(namedtuple('Scale', 'rooms width height layers triggers')):
+    """Dimensions of a synthetic world and its plot."""
+    __slots__ = ()
+
+    @property
+    def tiles(self):
+        return self.rooms * self.width * self.height * self.layers
+
+
+SCALES = OrderedDict([
+    ('tiny', Scale(rooms=2, width=10, height=10, layers=2, triggers=10)),
+    ('small', Scale(rooms=10, width=40, height=30, layers=3, triggers=100)),
+    ('medium', Scale(rooms=100, width=60, height=60, layers=4,
+                     triggers=1000)),
+    ('large', Scale(rooms=300, width=60, height=60, layers=8,
+                    triggers=5000)),
+    ('huge', Scale(rooms=4, width=1000, height=1000, layers=3,
+                   triggers=10000)),
+    ])
+
+ENTITIES_SCRIPT = """\
+from functools import partial
+
+from crystals.world import Entity
+
+PLAYER = partial(Entity, 'player', False, 'human-peasant.png')
+
+
+class Room:
+
+    floor = partial(Entity, 'floor', True, 'floor-a-red.png')
+    wall = partial(Entity, 'wall', False, 'wall-vert-blue.png')
+    item = partial(Entity, 'sack', True, 'sack.png')
+    npc = partial(Entity, 'imp', False, 'imp.png', id='npc')
+
+for _i in xrange(%d):
+    globals()['Room%%d' %% _i] = Room
+"""
+
+KEY = {'_': 'floor', '#': 'wall', 'o': 'item', 'n': 'npc'}
+
+
+def room_layers(scale, rand):
+    """Return the map of a synthetic room as a list of layers, each a
+    list of row strings.
+    """
+    w, h = scale.width, scale.height
+    floor = ['_' * w] * h
+    walls = (['#' * w] + ['#n' + '.' * (w - 3) + '#'] +
+             ['#' + '.' * (w - 2) + '#'] * (h - 3) + ['#' * w])
+    layers = [floor, walls]
+    for z in xrange(2, scale.layers):
+        layers.append([
+            ''.join('o' if rand.random() < 0.02 else '.' for x in xrange(w))
+            for y in xrange(h)])
+    return layers[:scale.layers]
+
+
+def write_world(path, scale):
+    """Write 'atlas.py' and 'entities.py' scripts to directory `path`,
+    describing a world of the given Scale.
+
+    Rooms are linked in a ring by portals halfway up their left and
+    right sides. The player starts in the middle of the first room.
+    """
+    rand = random.Random(SEED)
+    names = ['Room%d' % i for i in xrange(scale.rooms)]
+    mid = scale.height // 2
+
+    with open(os.path.join(path, 'atlas.py'), 'w') as f:
+        f.write('ROOMS = %r\n' % names)
+        f.write('START = %r\n' % ((names[0], 1, mid, scale.width // 2),))
+        for i, name in enumerate(names):
+            portalkey = {}
+            if scale.rooms > 1:
+                portalkey['N'] = names[(i + 1) % scale.rooms]
+            if scale.rooms > 2:
+                portalkey['P'] = names[i - 1]
+            portalmap = ['.' * scale.width] * scale.height
+            portalmap[mid] = ('.' + ('P' if 'P' in portalkey else '.') +
+                              '.' * (scale.width - 4) +
+                              ('N' if 'N' in portalkey else '.') + '.')
+
+            f.write('\n\nclass %s:\n\n' % name)
+            f.write('    key = %r\n' % KEY)
+            f.write('    map = [\n')
+            for layer in room_layers(scale, rand):
+                f.write('        [\n')
+                for row in layer:
+                    f.write('        %r,\n' % row)
+                f.write('        ],\n')
+            f.write('        ]\n')
+            f.write('    portalkey = %r\n' % portalkey)
+            f.write('    portalmap = [\n')
+            for row in portalmap:
+                f.write('        %r,\n' % row)
+            f.write('        ]\n')
+
+    with open(os.path.join(path, 'entities.py'), 'w') as f:
+        f.write(ENTITIES_SCRIPT % scale.rooms)
+
+
+def make_triggers(n):
+    """Return a plot triggers dict holding `n` triggers, half of them
+    nested one level deep, and one that is never met.
+
+    Top level trigger i requires states 'beat<i>' and 'chapter<i % 10>';
+    the trigger nested under it requires 'beat<i>-done'.
+    """
+    noop = lambda app: None
+    triggers = {('never',): (noop, {})}
+    for i in xrange(n // 2):
+        triggers[('beat%d' % i, 'chapter%d' % (i % 10))] = (noop, {
+            ('beat%d-done' % i,): (noop, {})})
+    return triggers
+
+
+def forget_world_scripts():
+    """Remove imported world scripts from `sys.modules`, so that the
+    next load imports them again.
+    """
+    for name in ('atlas', 'entities'):
+        sys.modules.pop(name, None)
+
+
+_window = []
+
+
+def hidden_window():
+    """Return a hidden pyglet window, or None if there is no display."""
+    if not _window:
+        try:
+            import pyglet.window
+            _window.append(pyglet.window.Window(visible=False))
+        except Exception:
+            _window.append(None)
+    return _window[0]
+
+
+class Skip(Exception):
+    """Raised by a benchmark that can't run here."""
+
+
+# Benchmarks
+# ----------------------------------------------------------------------
+# Each benchmark is a function taking the Scale and world directory in
+# use and returning (setup, number). `setup` is called before each
+# repetition and returns a callable to be timed `number` times.
+
+def bench_load_world(scale, path):
+    def setup():
+        forget_world_scripts()
+        return lambda: loader.load_world(path, IMG_PATH)
+    return setup, 1
+
+
+def bench_load_world_cached(scale, path):
+    cache_path = os.path.join(path, 'world.cache')
+    def setup():
+        forget_world_scripts()
+        if not os.path.exists(cache_path):
+            loader.load_world(path, IMG_PATH, cache_path=cache_path)
+            forget_world_scripts()
+        return lambda: loader.load_world(path, IMG_PATH,
+                                         cache_path=cache_path)
+    return setup, 1
+
+
+def load(path, budget=None):
+    forget_world_scripts()
+    cache_path = os.path.join(path, 'world.cache')
+    return loader.load_world(path, IMG_PATH, budget, cache_path)
+
+
+def bench_step_entity(scale, path):
+    def setup():
+        world, player = load(path)
+        steps = [1, -1]
+        def step():
+            world.step_entity(player, steps[0], 0)
+            steps.reverse()
+        return step
+    return setup, 1000
+
+
+def bench_set_focus(scale, path):
+    if scale.rooms < 2:
+        raise Skip('needs two rooms')
+    def setup():
+        world, player = load(path)
+        names = [world.focus.name, 'Room1']
+        def set_focus():
+            world.set_focus(names[0])
+            names.reverse()
+        return set_focus
+    return setup, 1000
+
+
+def bench_set_focus_unloaded(scale, path):
+    if scale.rooms < 2:
+        raise Skip('needs two rooms')
+    def setup():
+        world, player = load(path, budget=1)
+        names = ['Room%d' % i for i in xrange(1, scale.rooms)]
+        return lambda: world.set_focus(names.pop())
+    return setup, min(scale.rooms - 1, 100)
+
+
+def bench_add_entity_deep(scale, path):
+    def setup():
+        world, player = load(path)
+        x, y, z = world.focus.get_coords(player)
+        x += 1
+        return lambda: world.add_entity(Entity('rock', True, 'sack.png'),
+                                        x, y, 0)
+    return setup, 500
+
+
+def bench_plot_send(scale, path):
+    number = min(scale.triggers // 2, 1000)
+    def setup():
+        plt = plot.plot(set(), make_triggers(scale.triggers))
+        plt.send(object())
+        plt.send(['chapter%d' % i for i in xrange(10)])
+        beats = ['beat%d' % i for i in reversed(xrange(number))]
+        return lambda: plt.send(beats.pop())
+    return setup, number
+
+
+def bench_npc_tick(scale, path):
+    def setup():
+        world, player = load(path)
+        plt = plot.plot(set(), {('never',): (lambda app: None, {})})
+        session = Session(world, player, plt, set())
+        cells = [(x, y) for y in xrange(2, scale.height - 2)
+                 for x in xrange(2, scale.width - 3, 2)]
+        for x, y in cells[:MAX_NPCS]:
+            npc = Entity('imp', False, 'imp.png')
+            world.add_entity(npc, x, y, 1)
+            session.scheduler.add(npc, action.ActionLoop(
+                action.Move(1, 0), action.Move(-1, 0)))
+        return session.tick
+    return setup, 100
+
+
+def bench_autosave_record(scale, path):
+    def setup():
+        world, player = load(path)
+        plt = plot.plot(set(), {('never',): (lambda app: None, {})})
+        session = Session(world, player, plt, set())
+        for name in world.keys():
+            room = world[name]
+            room.replace_entity(room[1][1][0], 2, 1, 0)
+        cache = {}
+        steps = [1, -1]
+        def autosave():
+            world.step_entity(player, steps[0], 0)
+            steps.reverse()
+            save.record(session, cache=cache)
+        return autosave
+    return setup, 100
+
+
+def bench_infobox_write(scale, path):
+    if hidden_window() is None:
+        raise Skip('no display')
+    import pyglet
+    from crystals import gui
+    def setup():
+        infobox = gui.InfoBox(0, 0, 400, 100, pyglet.graphics.Batch())
+        return lambda: infobox.write('The quick brown fox jumps over '
+                                     'the lazy dog.')
+    return setup, 200
+
+
+def bench_set_focus_drawn(scale, path):
+    if scale.rooms < 2:
+        raise Skip('needs two rooms')
+    if hidden_window() is None:
+        raise Skip('no display')
+    import pyglet
+    from crystals.view import WorldView
+    def setup():
+        world, player = load(path)
+        WorldView(world, pyglet.graphics.Batch())
+        names = [world.focus.name, 'Room1']
+        def set_focus():
+            world.set_focus(names[0])
+            names.reverse()
+        return set_focus
+    return setup, 20
+
+
+BENCHMARKS = OrderedDict([
+    ('load_world', bench_load_world),
+    ('load_world_cached', bench_load_world_cached),
+    ('step_entity', bench_step_entity),
+    ('set_focus', bench_set_focus),
+    ('set_focus_unloaded', bench_set_focus_unloaded),
+    ('add_entity_deep', bench_add_entity_deep),
+    ('plot_send', bench_plot_send),
+    ('npc_tick', bench_npc_tick),
+    ('autosave_record', bench_autosave_record),
+    ('infobox_write', bench_infobox_write),
+    ('set_focus_drawn', bench_set_focus_drawn),
+    ])
+# ----------------------------------------------------------------------
+
+
+def measure(setup, number, repeat):
+    """Return a list of the times taken, in seconds, by `repeat` runs of
+    `number` calls each to the callable returned by `setup`.
+    """
+    times = []
+    for i in xrange(repeat):
+        func = setup()
+        start = clock()
+        for j in xrange(number):
+            func()
+        times.append(clock() - start)
+    return times
+
+
+def run(scales, names=None, repeat=3, log=None):
+    """Run the benchmarks with the given names (default: all) at each
+    of the given scale names, and return a list of result dicts.
+
+    If `log` is given, it is a file that a line is written to as each
+    benchmark finishes.
+    """
+    names = names or list(BENCHMARKS)
+    results = []
+    for scale_name in scales:
+        scale = SCALES[scale_name]
+        path = tempfile.mkdtemp(prefix='crystals-bench-')
+        try:
+            write_world(path, scale)
+            for name in names:
+                result = dict(name=name, scale=scale_name)
+                try:
+                    setup, number = BENCHMARKS[name](scale, path)
+                except Skip as e:
+                    result['skipped'] = str(e)
+                else:
+                    times = measure(setup, number, repeat)
+                    result.update(
+                        number=number, repeat=repeat, times=times,
+                        best=min(times), per_call=min(times) / number)
+                results.append(result)
+                if log:
+                    log.write(format_result(result) + '\n')
+        finally:
+            forget_world_scripts()
+            shutil.rmtree(path)
+    return results
+
+
+def format_result(result):
+    """Return a line of text describing a result dict."""
+    label = '%-20s %-8s' % (result['name'], result['scale'])
+    if 'skipped' in result:
+        return '%s skipped (%s)' % (label, result['skipped'])
+    return '%s %12.3f us/call %10.4f s best of %d' % (
+        label, result['per_call'] * 1e6, result['best'], result['repeat'])
+
+
+def compare(old, new):
+    """Return a list of (name, scale, ratio) tuples for each benchmark
+    in both result lists `old` and `new`, where `ratio` is the new time
+    per call divided by the old.
+    """
+    old = dict(((r['name'], r['scale']), r) for r in old
+               if 'skipped' not in r)
+    ratios = []
+    for r in new:
+        key = (r['name'], r['scale'])
+        if 'skipped' in r or key not in old:
+            continue
+        ratios.append(key + (r['per_call'] / old[key]['per_call'],))
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='crystals.bench', description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '-s', '--scales', default='tiny,small,medium',
+        help='comma separated scales to run, from: ' + ', '.join(SCALES))
+    parser.add_argument(
+        '-b', '--benchmarks', default=','.join(BENCHMARKS),
+        help='comma separated benchmarks to run (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of times to repeat each benchmark')
+    parser.add_argument('-o', '--output',
+                        help='file to write JSON results to (default: stdout)')
+    parser.add_argument('-c', '--compare',
+                        help='JSON results of an earlier run to compare to')
+    args = parser.parse_args(argv)
+
+    results = run(args.scales.split(','), args.benchmarks.split(','),
+                  args.repeat, log=sys.stderr)
+    report = dict(python=platform.python_version(),
+                  platform=platform.platform(), time=time.time(),
+                  results=results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+        for name, scale, ratio in compare(old, results):
+            sys.stderr.write('%-20s %-8s %6.2fx\n' % (name, scale, ratio))
+
+
+if __name__ == '__main__':
+    main()
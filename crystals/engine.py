@@ -1,13 +1,26 @@
 """event handlers for all the different top-level game modes"""
+from timeit import default_timer as clock
+
 import pyglet
 from pyglet.window import key
 
 from crystals import gui
-from crystals.world import Entity
+from crystals.loader import Prefetcher
+from crystals.save import AUTOSAVE_INTERVAL, Autosaver
+from crystals.schedule import BUDGET
+from crystals.session import Session
+from crystals.view import WorldView
+
+OVERLAY_INTERVAL = 0.5 # seconds between updates of the stats overlay
 
 
 class GameMode(object):
-    """Abstract class for top-level game objects with event handlers."""
+    """Abstract class for top-level game objects with event handlers.
+
+    The window is only redrawn after something on it has changed, which
+    is signalled by calling `invalidate`; while nothing changes, no
+    frames are drawn at all.
+    """
 
     def __init__(self, window):
         self.window = window
@@ -20,62 +33,119 @@ class GameMode(object):
     def activate(self):
         """Push all event handlers onto the window."""
         self.window.push_handlers(self)
+        self.invalidate()
+
+    def deactivate(self):
+        """Remove all event handlers from the window."""
+        self.window.remove_handlers(self)
+
+    def invalidate(self):
+        """Redraw the window on the next frame."""
+        self.window.invalid = True
 
     def on_draw(self):
         """Clear the window and repaint the batch."""
         self.window.clear()
         self.batch.draw()
+        self.window.invalid = False
+
+    def on_expose(self):
+        """Redraw the window once it's uncovered."""
+        self.invalidate()
+
+    def on_resize(self, width, height):
+        """Redraw the window at its new size."""
+        self.invalidate()
 
 
 class MainMenu(GameMode, gui.Menu):
-    """Game mode that displays a menu. Greets the player."""
+    """Game mode that displays a menu. Greets the player.
 
-    def __init__(self, window, new_game):
+    If `load_game` is given, the menu offers to load a saved game.
+    """
+
+    def __init__(self, window, new_game, load_game=None):
         GameMode.__init__(self, window)
+        items = ['new game', 'quit']
+        funcs = [new_game, pyglet.app.exit]
+        if load_game is not None:
+            items.insert(1, 'load game')
+            funcs.insert(1, load_game)
         gui.Menu.__init__(
             self, 0, 0, window.width, window.height, self.batch,
-            ['new game', 'quit'],
-            [new_game, pyglet.app.exit],
-            show_box=True, bold=True)
+            items, funcs, show_box=True, bold=True)
+
 
+class WorldMode(GameMode, Session):
+    """Game mode where the player explores the game world.
 
-class WorldMode(GameMode):
-    """Game mode where the player explores the game world."""
+    Rooms reachable by portal from the focused room are built in the
+    background while the player explores.
 
+    Game logic runs in fixed ticks (see `crystals.session.Ticker`),
+    scheduled on `pyglet.clock`. Key presses are mapped to commands by
+    `inputdict`, then queued and handled one per tick. Between ticks,
+    moving entities are drawn part of the way to where they are going,
+    redrawing every frame until they get there.
 
-    def __init__(self, window, world, player, plot, plot_state):
+    If `save_path` is given, the game is saved there, tagged with hex
+    digest `digest` of the world scripts: every AUTOSAVE_INTERVAL
+    seconds, whenever the player goes through a portal, and when F5 is
+    pressed. Saves are written in the background (see
+    `crystals.save.Autosaver`), so they never hold up drawing.
+
+    If `stats` is given, it is a `crystals.stats.FrameStats` that the
+    time taken to draw each frame, run each tick, set the focus and
+    step the plot is added to, along with the latency from each key
+    press to the frame that shows its effect. F3 toggles an overlay of
+    the stats. Without `stats`, none of this is timed.
+    """
+
+    def __init__(self, window, world, player, plot, plot_state,
+                 buffered=False, save_path=None, digest=None, stats=None):
         GameMode.__init__(self, window)
-        self.world = world
-        self.player = player
-        self.plot = plot
-        self.plot_state = plot_state
-        self.plot.send(self)
 
         self.batch = pyglet.graphics.Batch()
-        self.world.batch = self.batch
-        self.world.set_focus()
-        
+        self.view = WorldView(world, self.batch, buffered=buffered,
+                              invalidate=self.invalidate)
+        self.view.follow(player)
+        self.prefetcher = Prefetcher(world)
+
         ib_padding = 10
         ib_x = ib_y = ib_padding
         ib_width = window.width - (ib_padding * 2)
         ib_height = 100
         ib_style = dict(font_size=10, line_spacing=20)
-        self.infobox = gui.InfoBox(
+        infobox = gui.InfoBox(
             ib_x, ib_y, ib_width, ib_height, self.batch, show_box=True,
-            style=ib_style)
+            style=ib_style, invalidate=self.invalidate)
+        Session.__init__(self, world, player, plot, plot_state, infobox,
+                         budget=BUDGET)
+        self.animating = False # True if stepped every frame
+        if save_path:
+            self.autosaver = Autosaver(self, save_path, digest)
 
-        # Define possible user inputs and their effects.
-        # Values are each a tuple of a callable followed optionally by 
-        # arguments.
+        # Define possible user inputs and the commands they give (see
+        # `Session.commands`).
+        self.commands['save'] = (self.save_game,)
         self.inputdict = {
-            key.MOTION_LEFT: (self.step_player, -1, 0),
-            key.MOTION_RIGHT: (self.step_player, 1, 0),
-            key.MOTION_DOWN: (self.step_player, 0, -1),
-            key.MOTION_UP: (self.step_player, 0, 1),
+            key.MOTION_LEFT: 'left',
+            key.MOTION_RIGHT: 'right',
+            key.MOTION_DOWN: 'down',
+            key.MOTION_UP: 'up',
 
-            key.SPACE: (self.interact,),
+            key.SPACE: 'interact',
+            key.F5: 'save',
         }
 
+        self.stats = stats
+        self.overlay = None
+        if stats is not None:
+            world.set_focus = stats.timed('set_focus', world.set_focus)
+            self.step_plot = stats.timed('plot', self.step_plot)
+            self.commands['overlay'] = (self.toggle_overlay,)
+            self.inputdict[key.F3] = 'overlay'
+
         # Define arguments for the execute method of each Action subclass.
         self.action_args = {
             'Alert': (self.infobox,),
@@ -83,45 +153,143 @@ class WorldMode(GameMode):
             'UpdatePlot': (self.plot,),
         }
 
-    def step_player(self, xstep, ystep):
-        """Step the player (`xstep`, `ystep`) tiles from her current
-        position.
+    def activate(self):
+        """Push all event handlers onto the window, start building rooms
+        in the background, send the plot the starting state of the world
+        and start ticking and autosaving.
+        """
+        GameMode.activate(self)
+        self.prefetch()
+        self.step_plot()
+        self._schedule(False)
+        if self.autosaver is not None:
+            pyglet.clock.schedule_interval(self.autosaver.save,
+                                           AUTOSAVE_INTERVAL)
+
+    def deactivate(self):
+        """Remove all event handlers from the window, stop ticking,
+        autosaving and building rooms, and stop the worker threads once
+        they've finished what's queued.
+        """
+        GameMode.deactivate(self)
+        pyglet.clock.unschedule(self.step)
+        pyglet.clock.unschedule(self.step_prefetcher)
+        self.prefetcher.stop()
+        if self.autosaver is not None:
+            pyglet.clock.unschedule(self.autosaver.save)
+            self.autosaver.stop()
+
+    def _schedule(self, animating):
+        """Step every frame if `animating`, else once per tick."""
+        pyglet.clock.unschedule(self.step)
+        if animating:
+            pyglet.clock.schedule(self.step)
+        else:
+            pyglet.clock.schedule_interval(self.step, self.ticker.period)
+        self.animating = animating
 
-        If successful and the new position hosts a portal, portal
-        the player.
+    def step(self, dt):
+        """Run the ticks that fell due in the last `dt` seconds, then
+        draw moving entities where they are between ticks.
         """
-        success = self.world.step_entity(self.player, xstep, ystep)
-        if not success:
+        self.advance(dt)
+        self.view.interpolate(self.ticker.alpha)
+        if self.view.moving != self.animating:
+            self._schedule(self.view.moving)
+
+    def tick(self):
+        """Settle moving entities where they were going, then run one
+        tick of game logic.
+
+        A key handled without invalidating the window has no frame to
+        show its effect, so its latency ends with the tick.
+        """
+        self.view.settle()
+        if self.stats is None:
+            Session.tick(self)
             return
+        inputs = len(self.inputs)
+        start = clock()
+        Session.tick(self)
+        self.stats.add('logic', clock() - start)
+        if len(self.inputs) < inputs:
+            self.stats.handle()
+            if not self.window.invalid:
+                self.stats.frame()
 
-        from_room = self.world.focus.name
-        x, y, z = self.world.focus.get_coords(self.player)
-        if self.world.portals_xy2dest[from_room].get((x, y)):
-            self.portal_player(x, y)
+    def on_draw(self):
+        """Clear the window and repaint the batch, timing it if there
+        are stats to keep.
+        """
+        if self.stats is None:
+            GameMode.on_draw(self)
+            return
+        start = clock()
+        GameMode.on_draw(self)
+        end = clock()
+        self.stats.add('draw', end - start)
+        self.stats.frame(end)
 
-    def portal_player(self, x, y):
-        """Transfer the player to the destination of the portal at
-        (x, y), then set that room as the focus.
+    def toggle_overlay(self):
+        """Show the stats over the game, updated every OVERLAY_INTERVAL
+        seconds, or hide them if shown.
+        """
+        if self.overlay is not None:
+            pyglet.clock.unschedule(self.update_overlay)
+            self.overlay.delete()
+            self.overlay = None
+            return
+        width, height = 260, 110
+        self.overlay = gui.InfoBox(
+            10, self.window.height - height - 10, width, height,
+            self.batch, show_box=True, padding=5,
+            style=dict(font_size=8, line_spacing=14, wrap=False),
+            invalidate=self.invalidate)
+        self.overlay.prefix = ''
+        self.update_overlay()
+        pyglet.clock.schedule_interval(self.update_overlay,
+                                       OVERLAY_INTERVAL)
+
+    def update_overlay(self, dt=None):
+        """Write the latest stats to the overlay."""
+        self.overlay.clear()
+        for line in reversed(self.stats.report()):
+            self.overlay.write(line)
+
+    def save_game(self):
+        """Save the game in the background, if it has a save path."""
+        if self.autosaver is not None:
+            self.autosaver.save()
+            self.infobox.write('Game saved.')
+
+    def prefetch(self):
+        """Start preparing the rooms that portals in the focused room
+        lead to, building them a few rows each frame until they're done.
         """
-        self.world.portal_entity(self.player, x, y)
-        from_room = self.world.focus.name
-        dest = self.world.portals_xy2dest[from_room][(x, y)]
-        self.world.set_focus(dest)
-
-    def interact(self):
-        """If an interactable entity is in front of the player, make
-        her interact with it. Else, do nothing.
+        self.prefetcher.prefetch()
+        if self.prefetcher.pending:
+            pyglet.clock.unschedule(self.step_prefetcher)
+            pyglet.clock.schedule(self.step_prefetcher)
+
+    def step_prefetcher(self, dt=None):
+        """Build the next rows of the rooms being prepared, and stop
+        once there are none left.
         """
-        x, y, z = self.world.focus.get_coords(self.player)
-        x += self.player.facing[0]
-        y += self.player.facing[1]
-        for entity in self.world.focus[y][x]:
-            if entity and entity.action:
-                entity.action(self, entity)
+        self.prefetcher.step()
+        if not self.prefetcher.pending:
+            pyglet.clock.unschedule(self.step_prefetcher)
 
+    def portal_player(self, x, y):
+        """Transfer the player to the destination of the portal at
+        (x, y), then set that room as the focus, start preparing the
+        rooms its portals lead to and autosave at the end of the tick.
+        """
+        Session.portal_player(self, x, y)
+        self.prefetch()
 
     def on_key_press(self, key, modifiers):
-        """Process user input."""
-        if key not in self.inputdict:
-            return
-        self.inputdict[key][0](*self.inputdict[key][1:])
+        """Queue user input to be handled on the next tick."""
+        if key in self.inputdict:
+            if self.stats is not None:
+                self.stats.press()
+            self.command(self.inputdict[key])
@@ -6,6 +6,10 @@ from pyglet.window import key
 
 from crystals import gui
 from crystals import loader
+from crystals import save
+from crystals import trace
+from crystals.replay import Recorder
+from crystals.stats import FrameStats
 from crystals.api.plot import GameOver
 from crystals.engine import *
 
@@ -13,6 +17,16 @@ RES_PATH = 'res' # default path to variable game resources
 WORLD_PATH = RES_PATH + '/world' # default path to variable world scripts
 PLOT_PATH = RES_PATH + '/plot' # default path to variable plot scripts
 IMG_PATH = RES_PATH + '/img' # default path to variable game images
+CACHE_PATH = RES_PATH + '/world.cache' # path to the compiled world cache
+SAVE_PATH = RES_PATH + '/save' # path to the saved game
+REPLAY_PATH = RES_PATH + '/last.replay' # path to the last game's replay log
+STATS_PATH = RES_PATH + '/stats.json' # path to the last game's frame stats
+TRACE_PATH = RES_PATH + '/trace.json' # path to the last game's span trace
+ROOM_BUDGET = 16 # max number of rooms kept loaded at once
+BUFFERED_SPRITES = False # draw entities from shared vertex lists
+MAX_FPS = 60 # max frames drawn per second while anything is animating
+FRAME_STATS = False # time frames and logic, with an overlay on F3
+TRACE = False # trace loading, rooms, plot and gui (see crystals.trace)
 
 if __debug__:
     from test.util import WORLD_PATH, PLOT_PATH, IMG_PATH
@@ -27,13 +41,19 @@ class Game(object):
         self.window = pyglet.window.Window(window_width, window_height)
         self.window.clear()
 
-        self.main_menu = MainMenu(self.window, self.new_game)
+        self.main_menu = MainMenu(
+            self.window, self.new_game,
+            self.load_game if os.path.exists(SAVE_PATH) else None)
         self.world = None
         self.player = None
+        self.wmode = None
 
     def run(self):
         """Run the game, activating the main menu."""
+        if TRACE:
+            trace.start()
         self.main_menu.activate()
+        pyglet.clock.set_fps_limit(MAX_FPS)
 
         try:
             pyglet.app.run()
@@ -41,12 +61,44 @@ class Game(object):
             print 'Game over: all plot conditions were met'
             pyglet.app.exit()
 
-    def new_game(self):
-        """Initialize and start a new game in world mode."""
+        if self.wmode is not None:
+            # Stop its workers, finishing any save still in progress
+            self.wmode.deactivate()
+            if self.wmode.autosaver is not None:
+                self.wmode.autosaver.flush()
+            self.wmode.recorder.write(REPLAY_PATH)
+            if self.wmode.stats is not None:
+                self.wmode.stats.dump(STATS_PATH)
+        if TRACE:
+            trace.write(TRACE_PATH, trace.stop())
+
+    def new_game(self, saved=False):
+        """Initialize and start a new game in world mode. If `saved`,
+        carry on the game saved at SAVE_PATH instead.
+        """
         self.window.pop_handlers()
         self.window.clear()
 
-        world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+        # Saves record the plot's progress too, so are tagged with both
+        digest = (loader.hash_world_scripts(WORLD_PATH) +
+                  loader.hash_world_scripts(PLOT_PATH))
+        saved = save.read_save(SAVE_PATH, digest) if saved else None
+
+        # Seed the random module before loading, as replays do
+        recorder = Recorder(WORLD_PATH, PLOT_PATH, IMG_PATH,
+                            SAVE_PATH if saved else None,
+                            budget=ROOM_BUDGET)
+        world, player = loader.load_world(
+            WORLD_PATH, IMG_PATH, ROOM_BUDGET, CACHE_PATH)
         plot, pstate = loader.load_plot(PLOT_PATH)
-        self.wmode = WorldMode(self.window, world, player, plot, pstate)
+        stats = FrameStats() if FRAME_STATS else None
+        self.wmode = WorldMode(self.window, world, player, plot, pstate,
+                               BUFFERED_SPRITES, SAVE_PATH, digest, stats)
+        if saved and not save.restore(self.wmode, saved):
+            print 'Saved game no longer fits the plot: starting afresh'
+        self.wmode.recorder = recorder
         self.wmode.activate()
+
+    def load_game(self):
+        """Carry on the game saved at SAVE_PATH in world mode."""
+        self.new_game(saved=True)
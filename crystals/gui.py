@@ -4,6 +4,8 @@ import textwrap
 import pyglet
 from pyglet.window import mouse
 
+from crystals import trace
+
 COLOR_WHITE = (255, 255, 255, 255)
 COLOR_RED = (255, 0, 0, 255)
 
@@ -54,6 +56,7 @@ class Menu(object):
     """A menu of vertically stacked text buttons.
 
     When a button is clicked, its corresponding function is called.
+    `invalidate` is called whenever the selection changes on screen.
     """
 
     def __init__(self, x, y, width, height, batch, text, functions,
@@ -113,15 +116,15 @@ class Menu(object):
         """
         if i == self.selection:
             return
-        if i is None:
-            self.deselect()
-            return
-        if i < 0:
+        if i is not None and i < 0:
             i = len(self.boxes) - i
 
-        self.deselect()
-        self.boxes[i].show()
+        if self.selection is not None:
+            self.boxes[self.selection].hide()
+        if i is not None:
+            self.boxes[i].show()
         self.selection = i
+        self.invalidate()
     
     def select_next(self):
         """Select the next menu item in sequence.
@@ -149,21 +152,25 @@ class Menu(object):
         """Deselect the current menu item if it is currently selected,
         else do nothing.
         """
-        if self.selection is not None and self.boxes[self.selection].visible:
-            self.boxes[self.selection].hide()
-            self.selection = None
+        self.select_item(None)
+
+    def invalidate(self):
+        """Called when the menu changes on screen. Does nothing unless
+        overridden, as by the game modes in `crystals.engine`.
+        """
 
     # event handlers ---------------------------------------------------
     def on_mouse_motion(self, x, y, dx, dy):
-        """Deselect the current menu item. Then, if the mouse is
-        positioned within the bounds of a menu item's box, select that
-        item.
+        """Select the menu item whose box the mouse is positioned
+        within, or deselect the current menu item if there is none.
+        Nothing changes while the mouse stays on the selected item.
         """
-        self.deselect()
-        for box in self.boxes:
+        hovered = None
+        for i, box in enumerate(self.boxes):
             if self.hit_test(x, y, box):
-                self.select_item(self.boxes.index(box))
-                break 
+                hovered = i
+                break
+        self.select_item(hovered)
 
     def on_mouse_release(self, x, y, button, modifiers):
         """On a left mouse release, if a button is currently selected,
@@ -174,14 +181,19 @@ class Menu(object):
 
 
 class InfoBox(object):
-    """A box that can output text in a scrolling manner."""
-    
+    """A box that can output text in a scrolling manner.
+
+    If `invalidate` is given, it is called whenever new text is written.
+    """
+
     style = dict(line_spacing=24, font_name='monospace', font_size=16,
                  color=COLOR_WHITE, wrap=True)
 
     def __init__(self, x, y, width, height, batch, show_box=False,
-                 padding=10, style={}):
+                 padding=10, style={}, invalidate=None):
         self.batch = batch
+        if invalidate is not None:
+            self.invalidate = invalidate
 
         self.style = self.style.copy()
         self.style.update(style)
@@ -202,6 +214,24 @@ class InfoBox(object):
 
         self.prefix = '> '
 
+    @trace.traced('InfoBox.write', 'gui')
     def write(self, text):
         self.document.insert_text(0, self.prefix + text + '\n')
         self.layout.ensure_line_visible(0)
+        self.invalidate()
+
+    def clear(self):
+        """Remove all text written so far."""
+        self.document.delete_text(0, len(self.document.text) - 1)
+        self.invalidate()
+
+    def delete(self):
+        """Remove the infobox from its batch."""
+        self.layout.delete()
+        self.box.hide()
+        self.invalidate()
+
+    def invalidate(self):
+        """Called when the infobox changes on screen. Does nothing
+        unless replaced by the `invalidate` argument.
+        """
@@ -1,48 +1,172 @@
 """tools for loading variable game data and resources"""
+import cPickle
+import hashlib
+import os
 import os.path
 import sys
+import threading
+import Queue
 
 import pyglet
-from pyglet.gl import *
 
+from crystals import trace
 from crystals.api import plot
-from crystals.world import Room, World, Entity, TILE_SIZE
+from crystals.world import Room, World, Entity, Tile
 
 PLAYER_CHAR = '@' # atlas char that represents the player
 IGNORE_CHAR = '.' # atlas char that represents empty space
+CACHE_VERSION = 1 # bump when the format of compiled worlds changes
 
-glEnable(GL_TEXTURE_2D)
 
+def load_entity(room, char, atlas, entities, prototypes):
+    """Return the entity for atlas character `char` in the room named
+    `room`, given objects `atlas` and `entities` describing the room.
 
-def prepare_sprite(sprite):
-    """Prepare a sprite for the game."""
-    texture = sprite.image
-    glBindTexture(GL_TEXTURE_2D, texture.id)
-    texture.width = TILE_SIZE
-    texture.height = TILE_SIZE
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    Entities with no `id` or `action` are static, so only one is made
+    for each room and character; it is registered in dict `prototypes`
+    under key (room, char) and shared as a `Tile`.
+    """
+    tile = prototypes.get((room, char))
+    if tile is not None:
+        return tile
 
+    entity = getattr(entities, atlas.key[char])()
+    if entity.id is None and not entity.action:
+        entity = prototypes[(room, char)] = Tile.from_entity(entity)
+    return entity
 
-def load_room(name, atlas, entities):
-    """Return a Room instance, given its name, object `atlas` describing
-    its layout and object `entities` describing its entities.
+
+def parse_room(atlas):
+    """Return a [y][x][z] grid of the atlas characters in a room, given
+    object `atlas` describing its layout.
     """
-    grid = []
     # Read rows in reverse so that maps displayed in symbol form
     # in the atlas mirror the actual appearance of the room
-    for rows in reversed(zip(*atlas.map)):
-        grid.append([])
-        for cell in zip(*rows):
-            grid[-1].append([])
-            for z, char in enumerate(cell):
-                if char == IGNORE_CHAR:
-                    entity = None
-                else:
-                    entity = getattr(entities, atlas.key[char])()
-                    prepare_sprite(entity)
-                grid[-1][-1].append(entity)
+    return [[list(cell) for cell in zip(*rows)]
+            for rows in reversed(zip(*atlas.map))]
+
+
+class RoomBuilder(object):
+    """A room factory that can build its room a few rows at a time, so
+    that building can be spread over several frames.
+
+    Calling the builder finishes building the room and returns it.
+    If `layout` is given, it is used in place of parsing `atlas.map`.
+    """
+
+    def __init__(self, name, atlas, entities, prototypes=None, layout=None):
+        self.name = name
+        self.atlas = atlas
+        self.entities = entities
+        self.prototypes = {} if prototypes is None else prototypes
+        self.layout = layout
+        self.grid = []
+        self.room = None
+
+    def parse(self):
+        """Parse the room's atlas into self.layout, if not done yet.
+
+        Parsing doesn't touch GL, so this may be called from any thread.
+        """
+        if self.layout is None:
+            with trace.span('parse_room', 'loader', room=self.name):
+                self.layout = parse_room(self.atlas)
+
+    def step(self, rows=1):
+        """Build up to `rows` more rows of the room. Return True if the
+        room is complete, else False.
+        """
+        if self.room is not None:
+            return True
+        self.parse()
+
+        for chars in self.layout[len(self.grid):len(self.grid) + rows]:
+            self.grid.append([
+                [None if char == IGNORE_CHAR else load_entity(
+                    self.name, char, self.atlas, self.entities,
+                    self.prototypes) for char in cell]
+                for cell in chars])
+
+        if len(self.grid) == len(self.layout):
+            self.room = Room(self.name, self.grid)
+            for entity, (x, y, z) in self.room.coords.iteritems():
+                entity.origin = (self.name, x, y, z)
+        return self.room is not None
+
+    def __call__(self):
+        with trace.span('build_room', 'loader', room=self.name):
+            self.parse()
+            self.step(len(self.layout))
+        return self.room
+
 
-    return Room(name, grid)
+@trace.traced(cat='loader')
+def load_room(name, atlas, entities, prototypes=None):
+    """Return a Room instance, given its name, object `atlas` describing
+    its layout and object `entities` describing its entities.
+
+    Static entities are shared through the prototype registry
+    `prototypes` (see `load_entity`), which is private to the room if
+    not given.
+    """
+    return RoomBuilder(name, atlas, entities, prototypes)()
+
+
+class Prefetcher(object):
+    """Prepares the rooms that portals in the focused room lead to,
+    before the player gets there.
+
+    Atlases are parsed on a worker thread, until `stop` is called.
+    Entities need GL, so they are built on the main thread, `rows` rows
+    per call to `step`. Each room built is handed to the world, so it
+    counts against the world's budget (see `crystals.world.World`).
+    """
+
+    def __init__(self, world, rows=4):
+        self.world = world
+        self.rows = rows
+        self.pending = []
+        self.queue = Queue.Queue()
+
+        self.worker = threading.Thread(target=self._parse_queued)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _parse_queued(self):
+        while True:
+            builder = self.queue.get()
+            if builder is None:
+                return
+            builder.parse()
+
+    def stop(self):
+        """Stop the worker once it has parsed the atlases queued."""
+        self.queue.put(None)
+
+    def prefetch(self, room=''):
+        """Queue the unbuilt rooms that portals in the room with name
+        `room` lead to. If `room` tests False, use the focused room.
+        """
+        room = room or self.world.focus.name
+        for dest in self.world.portals_dest2xy[room]:
+            builder = self.world.factory(dest)
+            if (isinstance(builder, RoomBuilder) and
+                    builder not in self.pending):
+                self.pending.append(builder)
+                self.queue.put(builder)
+
+    def step(self, dt=None):
+        """Build the next few rows of the first queued room whose atlas
+        has been parsed. Suitable for scheduling with `pyglet.clock`.
+        """
+        for builder in list(self.pending):
+            if builder.layout is None:
+                continue
+            if builder.step(self.rows):
+                self.pending.remove(builder)
+                if self.world.factory(builder.name) is builder:
+                    self.world[builder.name]
+            return
 
 
 def load_portals(atlas):
@@ -61,22 +185,113 @@ def load_portals(atlas):
     return portals
 
 
+def load_script(world_path, name):
+    """Return the module object of script `name` in directory
+    `world_path`.
+    """
+    world_path = os.path.normpath(world_path)
+    sys.path.insert(0, world_path)
+    try:
+        return __import__(name)
+    finally:
+        sys.path.remove(world_path)
+
+
 def load_world_scripts(world_path):
     """Return 'atlas.py' and 'entities.py' module objects, given a
     directory that contains those modules.
     """
-    world_path = os.path.normpath(world_path)
-    sys.path.insert(0, world_path)
-    atlas = __import__('atlas')
-    entities = __import__('entities')
-    sys.path.remove(world_path)
+    atlas = load_script(world_path, 'atlas')
+    entities = load_script(world_path, 'entities')
     return atlas, entities
 
 
-def load_world(world_path, img_path):
+def hash_world_scripts(world_path):
+    """Return a hex digest of the contents of every script in
+    directory `world_path`.
+    """
+    digest = hashlib.sha1(str(CACHE_VERSION))
+    for name in sorted(os.listdir(world_path)):
+        if name.endswith('.py'):
+            digest.update(name)
+            with open(os.path.join(world_path, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class CachedAtlas(object):
+    """Stands in for a room's atlas in a compiled world."""
+
+    def __init__(self, key):
+        self.key = key
+
+
+def compile_world(atlas, parse=True):
+    """Return a dict of everything needed to build the world described
+    by module object `atlas`, in a form that can be pickled.
+
+    If `parse` is False, the room layouts are left out, to be parsed as
+    each room is built.
+    """
+    world = dict(rooms=list(atlas.ROOMS), start=tuple(atlas.START), keys={},
+                 layouts={}, portals={})
+    for rname in atlas.ROOMS:
+        ratlas = getattr(atlas, rname)
+        world['keys'][rname] = dict(ratlas.key)
+        if parse:
+            world['layouts'][rname] = parse_room(ratlas)
+        world['portals'][rname] = load_portals(ratlas)
+    return world
+
+
+def load_compiled_world(cache_path, digest):
+    """Return the compiled world stored at `cache_path`, or None if there
+    is none or it wasn't compiled from scripts with hex digest `digest`.
+
+    The cache only saves time, so a cache that can't be read for any
+    reason is treated as missing.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_digest, world = cPickle.load(f)
+    except Exception:
+        return None
+    return world if cached_digest == digest else None
+
+
+def save_compiled_world(cache_path, digest, world):
+    """Store compiled world `world` at `cache_path`, tagged with the hex
+    digest `digest` of the scripts it was compiled from. Return True if
+    it was stored, or False if it couldn't be written there, such as if
+    the location is read-only or full.
+    """
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump((digest, world), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+@trace.traced(cat='loader')
+def load_world(world_path, img_path, budget=None, cache_path=None):
     """Return a World instance and a player Entity instance, compiled
     from information found in modules 'atlas.py' and 'entities.py' at
     `world_path`, and using images at `img_path`.
+
+    Rooms are not built until they are first needed, and if `budget` is
+    given, at most that many are kept loaded at once (see `World`).
+
+    If `cache_path` is given, the compiled atlas is stored there, and
+    as long as the world scripts are unchanged, later loads read it
+    instead of importing and parsing 'atlas.py'. If the cache can't be
+    written, the world is loaded uncached.
     """
     # Prepare images
     pyglet.resource.path = [
@@ -86,25 +301,38 @@ def load_world(world_path, img_path):
     pyglet.resource.reindex()
     assert pyglet.resource._default_loader._script_home == '.'
 
-    # Load world scripts
-    atlas, entities = load_world_scripts(world_path)
+    # Load world scripts, or the compiled atlas if it's up to date
+    # Layouts are only parsed up front to be cached; otherwise each is
+    # parsed when its room is built
+    atlas = compiled = None
+    if cache_path:
+        digest = hash_world_scripts(world_path)
+        compiled = load_compiled_world(cache_path, digest)
+    if compiled is None:
+        atlas = load_script(world_path, 'atlas')
+        compiled = compile_world(atlas, parse=bool(cache_path))
+        if cache_path:
+            save_compiled_world(cache_path, digest, compiled)
+    entities = load_script(world_path, 'entities')
 
-    # Make rooms and portals
+    # Make rooms
     rooms = {}
-    portals = {}
-    for rname in atlas.ROOMS:
-        ratlas = getattr(atlas, rname)
-        rentities = getattr(entities, rname)
-        rooms[rname] = load_room(rname, ratlas, rentities)
-        portals[rname] = load_portals(ratlas)
+    prototypes = {}
+    for rname in compiled['rooms']:
+        layout = compiled['layouts'].get(rname)
+        if layout is None:
+            ratlas = getattr(atlas, rname)
+        else:
+            ratlas = CachedAtlas(compiled['keys'][rname])
+        rooms[rname] = RoomBuilder(rname, ratlas, getattr(entities, rname),
+                                   prototypes, layout)
 
     # Make world
-    world = World(rooms, portals, atlas.START[0])
+    world = World(rooms, compiled['portals'], compiled['start'][0], budget)
 
     # Add player character to world
     player = entities.PLAYER()
-    prepare_sprite(player)
-    rname, rz, ry, rx = atlas.START
+    rname, rz, ry, rx = compiled['start']
     world.add_entity(player, rx, ry, rz, rname)
 
     return world, player
@@ -0,0 +1,206 @@
+"""pathfinding within rooms and between them"""
+import heapq
+from array import array
+from collections import deque, OrderedDict
+
+__all__ = ['DistanceField', 'Pathfinder', 'find_path']
+
+STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1)) # Moves between neighbouring cells
+FIELDS = 32 # Max number of distance fields kept at once
+
+
+def find_path(room, start, goal):
+    """Return the shortest list of (x, y) cells leading from `start` to
+    `goal` in `room`, not including `start`, or None if there is none.
+
+    Every cell on the way but `goal` must be walkable, so a path can
+    lead up to an entity standing in the way. This is an A* search.
+    """
+    if start == goal:
+        return []
+    gx, gy = goal
+    came_from = {start: None}
+    cost = {start: 0}
+    frontier = [(0, start)]
+    while frontier:
+        cell = heapq.heappop(frontier)[1]
+        if cell == goal:
+            path = []
+            while cell != start:
+                path.append(cell)
+                cell = came_from[cell]
+            path.reverse()
+            return path
+        x, y = cell
+        for dx, dy in STEPS:
+            nx, ny = x + dx, y + dy
+            if (nx, ny) != goal and not room.iswalkable(nx, ny):
+                continue
+            new_cost = cost[cell] + 1
+            if new_cost < cost.get((nx, ny), new_cost + 1):
+                cost[(nx, ny)] = new_cost
+                came_from[(nx, ny)] = cell
+                heapq.heappush(frontier, (
+                    new_cost + abs(gx - nx) + abs(gy - ny), (nx, ny)))
+    return None
+
+
+class DistanceField(object):
+    """The number of steps from each cell of `room` to target cell
+    (`x`, `y`), going around the room's fixed obstacles (see `Room`).
+
+    Other unwalkable entities move about, so they are left out of the
+    distances and avoided one step at a time instead: any number of
+    entities can follow one field to the same target.
+    """
+
+    def __init__(self, room, x, y):
+        self.room = room
+        self.target = (x, y)
+        self.distances = array('i', [-1]) * (room.width * room.height)
+        self._fill()
+
+    def _fill(self):
+        """Spread distances outward from the target, breadth first."""
+        room = self.room
+        width, height = room.width, room.height
+        distances = self.distances
+        x, y = self.target
+        distances[y * width + x] = 0
+        queue = deque([self.target])
+        while queue:
+            x, y = queue.popleft()
+            distance = distances[y * width + x] + 1
+            for dx, dy in STEPS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                i = ny * width + nx
+                if room.walls[i] or distances[i] >= 0:
+                    continue
+                distances[i] = distance
+                queue.append((nx, ny))
+
+    def distance(self, x, y):
+        """Return the number of steps from (x, y) to the target, or None
+        if it's out of the room or the target can't be reached from it.
+        """
+        if not (0 <= x < self.room.width and 0 <= y < self.room.height):
+            return None
+        distance = self.distances[y * self.room.width + x]
+        return None if distance < 0 else distance
+
+    def affected_by(self, x, y):
+        """Return True if a fixed obstacle being added to or removed
+        from (x, y) could change the distances: that is, if the cell or
+        one of its neighbours can reach the target.
+        """
+        return any(self.distance(x + dx, y + dy) is not None
+                   for dx, dy in ((0, 0),) + STEPS)
+
+    def step(self, x, y):
+        """Return the (xstep, ystep) that brings an entity at (x, y) one
+        step closer to the target, or None if the way is blocked or it
+        is already there.
+        """
+        here = self.distance(x, y)
+        if not here:
+            return None
+        best = None
+        for dx, dy in STEPS:
+            nx, ny = x + dx, y + dy
+            distance = self.distance(nx, ny)
+            if (distance is not None and distance < here and
+                    self.room.iswalkable(nx, ny)):
+                if best is None or distance < best[0]:
+                    best = (distance, (dx, dy))
+        return best and best[1]
+
+
+class Pathfinder(object):
+    """Finds ways around a World, keeping what it finds for reuse.
+
+    Distance fields are kept for the `size` targets most recently asked
+    for, so that entities heading for the same place share one field.
+    A field is dropped when a fixed obstacle that could change its
+    distances is added to or removed from its room. Routes between rooms
+    are planned over the world's portals, which never change, so they
+    are kept for good.
+    """
+
+    def __init__(self, world, size=FIELDS):
+        self.world = world
+        self.size = size
+        self.fields = OrderedDict() # Maps (room name, x, y) to fields
+        self.routes = {} # Maps (from room name, to room name) to routes
+
+    def _invalidate(self, room):
+        """Drop the fields of `room` that its changed walls affect."""
+        changes = room.wall_changes
+        if not changes:
+            return
+        for key, field in self.fields.items():
+            if field.room is room and any(
+                    field.affected_by(x, y) for x, y in changes):
+                del self.fields[key]
+        del changes[:]
+
+    def field(self, x, y, room=''):
+        """Return the DistanceField toward (x, y) in the room with the
+        given name. If `room` tests False, use the focused room.
+        """
+        room = self.world[room] if room else self.world.focus
+        if room.wall_changes is None:
+            room.wall_changes = []
+        self._invalidate(room)
+
+        key = (room.name, x, y)
+        field = self.fields.pop(key, None)
+        if field is None or field.room is not room:
+            field = DistanceField(room, x, y)
+        self.fields[key] = field
+        if len(self.fields) > self.size:
+            self.fields.popitem(last=False)
+        return field
+
+    def step_toward(self, entity, target):
+        """Return the (xstep, ystep) that brings `entity` one step
+        closer to entity `target` in the focused room, or None if it
+        can't get closer.
+        """
+        coords = self.world.focus.coords
+        if entity not in coords or target not in coords:
+            return None
+        x, y = coords[target][:2]
+        return self.field(x, y).step(*coords[entity][:2])
+
+    def route(self, from_room, to_room):
+        """Return the fewest portals to pass through to go from the room
+        named `from_room` to the one named `to_room`, as a list of
+        (room name, (x, y) of portal) pairs, or None if there is no way.
+        """
+        key = (from_room, to_room)
+        if key in self.routes:
+            return self.routes[key]
+
+        portals = self.world.portals_dest2xy
+        came_from = {from_room: None}
+        queue = deque([from_room])
+        while queue and to_room not in came_from:
+            name = queue.popleft()
+            for dest in portals.get(name, ()):
+                if dest not in came_from:
+                    came_from[dest] = name
+                    queue.append(dest)
+
+        route = None
+        if to_room in came_from:
+            route = []
+            name = to_room
+            while came_from[name] is not None:
+                prev = came_from[name]
+                route.append((prev, portals[prev][name]))
+                name = prev
+            route.reverse()
+        self.routes[key] = route
+        return route
@@ -0,0 +1,237 @@
+"""drawing of many same-sized quads from shared vertex lists
+
+This is a lighter alternative to `pyglet.sprite.Sprite` for the tiles of
+a room: every quad of a given group and texture lives in one vertex
+list, and changes are copied to the vertex list in bulk, once per
+update. NumPy is used for the copies if it is installed.
+"""
+from array import array
+
+import pyglet
+from pyglet.gl import *
+
+try:
+    import numpy
+    from numpy.ctypeslib import as_array
+except ImportError:
+    numpy = None
+
+__all__ = ['QuadBuffer', 'BufferedSprite', 'SpriteBuffers']
+
+INITIAL_CAPACITY = 64 # Number of quads each buffer has room for at first
+
+
+def _zeros(typecode, n):
+    if numpy is not None:
+        return numpy.zeros(n, dict(i='int32', f='float32')[typecode])
+    return array(typecode, [0]) * n
+
+
+def _grow(values, n):
+    if numpy is not None:
+        return numpy.concatenate((values, numpy.zeros(n, values.dtype)))
+    return values + array(values.typecode, [0]) * n
+
+
+def _values(values, typecode):
+    if numpy is not None:
+        return values
+    return array(typecode, values)
+
+
+class QuadBuffer(object):
+    """A vertex list of `size` by `size` quads sharing a group and a
+    texture.
+
+    Quads are referred to by index. Removed quads are collapsed to a
+    point and their indices reused. Positions and texture coordinates
+    are kept in local arrays, and the range of quads changed since the
+    last call to `flush` is copied to the vertex list when it is called.
+    """
+
+    def __init__(self, batch, group, size, capacity=INITIAL_CAPACITY):
+        self.batch = batch
+        self.group = group
+        self.size = size
+        self.capacity = capacity
+        self.free = range(capacity - 1, -1, -1) # Unused indices, last first
+        self.vertices = _zeros('i', capacity * 8)
+        self.tex_coords = _zeros('f', capacity * 12)
+        self.lo = self.hi = 0 # Range of indices changed since last flush
+        self.vertex_list = batch.add(
+            capacity * 4, GL_QUADS, group, 'v2i/stream', 't3f/dynamic',
+            ('c4B/static', (255,) * (capacity * 16)))
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def _touch(self, i):
+        if self.lo == self.hi:
+            self.lo, self.hi = i, i + 1
+        else:
+            self.lo = min(self.lo, i)
+            self.hi = max(self.hi, i + 1)
+
+    def _resize(self, capacity):
+        added = capacity - self.capacity
+        self.vertices = _grow(self.vertices, added * 8)
+        self.tex_coords = _grow(self.tex_coords, added * 12)
+        self.vertex_list.resize(capacity * 4)
+        self.vertex_list.colors[self.capacity * 16:] = (
+            (255,) * (added * 16))
+        self.free[:0] = range(capacity - 1, self.capacity - 1, -1)
+        self.lo, self.hi = 0, capacity
+        self.capacity = capacity
+
+    def add(self, x, y, tex_coords):
+        """Add a quad at (x, y) with the given 12 texture coordinates,
+        returning its index.
+        """
+        if not self.free:
+            self._resize(self.capacity * 2)
+        i = self.free.pop()
+        self.tex_coords[i * 12:i * 12 + 12] = _values(tex_coords, 'f')
+        self.set_position(i, x, y)
+        return i
+
+    def set_position(self, i, x, y):
+        """Move quad `i` to (x, y)."""
+        x2 = x + self.size
+        y2 = y + self.size
+        self.vertices[i * 8:i * 8 + 8] = _values(
+            (x, y, x2, y, x2, y2, x, y2), 'i')
+        self._touch(i)
+
+    def set_tex_coords(self, i, tex_coords):
+        """Give quad `i` the given 12 texture coordinates."""
+        self.tex_coords[i * 12:i * 12 + 12] = _values(tex_coords, 'f')
+        self._touch(i)
+
+    def remove(self, i):
+        """Remove quad `i`."""
+        self.vertices[i * 8:i * 8 + 8] = _values((0,) * 8, 'i')
+        self.free.append(i)
+        self._touch(i)
+
+    def flush(self):
+        """Copy the quads changed since the last flush to the vertex
+        list.
+        """
+        if self.lo == self.hi:
+            return
+        lo, hi = self.lo, self.hi
+        vertices = self.vertex_list.vertices
+        tex_coords = self.vertex_list.tex_coords
+        if numpy is not None:
+            as_array(vertices)[lo * 8:hi * 8] = self.vertices[lo * 8:hi * 8]
+            as_array(tex_coords)[lo * 12:hi * 12] = (
+                self.tex_coords[lo * 12:hi * 12])
+        else:
+            vertices[lo * 8:hi * 8] = self.vertices[lo * 8:hi * 8]
+            tex_coords[lo * 12:hi * 12] = self.tex_coords[lo * 12:hi * 12]
+        self.lo = self.hi = 0
+
+    def delete(self):
+        """Delete the vertex list."""
+        self.vertex_list.delete()
+
+
+class BufferedSprite(object):
+    """A quad in a QuadBuffer that can be used in place of a sprite.
+
+    Only the parts of the Sprite interface that rooms use are provided:
+    `image`, `group`, `x`, `y`, `set_position` and `delete`.
+    """
+
+    def __init__(self, buffers, image, group, x=0, y=0):
+        self._buffers = buffers
+        self._image = image
+        self._group = group
+        self._x = x
+        self._y = y
+        self._add()
+
+    def _add(self):
+        texture = self._image.get_texture()
+        self._buffer = self._buffers.buffer(self._group, texture)
+        self._index = self._buffer.add(self._x, self._y, texture.tex_coords)
+
+    def _remove(self):
+        self._buffer.remove(self._index)
+        self._buffers.changed.add(self._buffer)
+
+    def _set_image(self, image):
+        old = self._image.get_texture()
+        new = image.get_texture()
+        self._image = image
+        if new.id == old.id and new.target == old.target:
+            self._buffer.set_tex_coords(self._index, new.tex_coords)
+            self._buffers.changed.add(self._buffer)
+        else:
+            self._remove()
+            self._add()
+
+    image = property(lambda self: self._image, _set_image)
+
+    def _set_group(self, group):
+        if group is not self._group:
+            self._remove()
+            self._group = group
+            self._add()
+
+    group = property(lambda self: self._group, _set_group)
+
+    x = property(lambda self: self._x)
+    y = property(lambda self: self._y)
+
+    def set_position(self, x, y):
+        self._x = x
+        self._y = y
+        self._buffer.set_position(self._index, x, y)
+        self._buffers.changed.add(self._buffer)
+
+    def delete(self):
+        self._remove()
+
+
+class SpriteBuffers(object):
+    """Makes BufferedSprites of size `size` in `batch`, keeping a
+    QuadBuffer for each group and texture.
+
+    Changes to the sprites reach the batch on the next call to `flush`.
+    """
+
+    def __init__(self, batch, size):
+        self.batch = batch
+        self.size = size
+        self.buffers = {} # Maps (group, texture id) to QuadBuffers
+        self.changed = set() # QuadBuffers changed since the last flush
+
+    def buffer(self, group, texture):
+        """Return the QuadBuffer for `group` and `texture`."""
+        key = (group, texture.id)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = QuadBuffer(
+                self.batch, pyglet.sprite.SpriteGroup(
+                    texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, group),
+                self.size)
+        self.changed.add(buffer)
+        return buffer
+
+    def sprite(self, image, group=None):
+        """Return a new BufferedSprite showing `image` in `group`."""
+        return BufferedSprite(self, image, group)
+
+    def flush(self):
+        """Copy all changes to the batch."""
+        for buffer in self.changed:
+            buffer.flush()
+        self.changed.clear()
+
+    def delete(self):
+        """Delete every buffer."""
+        for buffer in self.buffers.values():
+            buffer.delete()
+        self.buffers.clear()
+        self.changed.clear()
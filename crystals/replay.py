@@ -0,0 +1,186 @@
+"""recording of games and headless replay
+
+A Recorder logs the command handled on each tick of a session, along
+with what the game was started from: the world and plot scripts, the
+random seed and any saved game. Replaying feeds the commands back to a
+new session through `Session.command`, on the same ticks, as fast as
+possible and without a display, and times each tick::
+
+    python2 -m crystals.replay res/last.replay -o ticks.json
+
+With `--trace`, loading and replaying are traced (see `crystals.trace`).
+
+Logs are JSON, so they can be kept as workloads for performance
+regression testing, or sent in with reports of slow frames.
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+import time
+from collections import deque
+from timeit import default_timer as clock
+
+from crystals import loader
+from crystals import save
+from crystals import trace
+from crystals.session import Session
+
+__all__ = ['Recorder', 'load_log', 'changed_scripts', 'start', 'replay']
+
+REPLAY_VERSION = 2 # bump when the format of logs changes
+
+
+class Recorder(object):
+    """Records a game started from the world and plot scripts at
+    `world_path` and `plot_path`, with images at `img_path`, and if
+    `save_path` is given, the game saved there. `budget` is the room
+    budget the world is loaded with (see `crystals.world.World`).
+
+    The random module is seeded with `seed`, or a seed taken from the
+    time if None, so the recorder must be made before the world is
+    loaded, just as `start` seeds it before loading when replaying. Give
+    the recorder to the session as its `recorder`.
+
+    Steps cut short by the scheduler's time budget are logged with the
+    number of actions they called, so that replays cut them just as
+    short (see `crystals.schedule.Scheduler`).
+    """
+
+    def __init__(self, world_path, plot_path, img_path, save_path=None,
+                 seed=None, budget=None):
+        if seed is None:
+            seed = int(time.time() * 1000) & 0xffffffff
+        random.seed(seed)
+
+        saved = None
+        if save_path:
+            with open(save_path, 'rb') as f:
+                saved = base64.b64encode(f.read())
+        self.header = dict(
+            version=REPLAY_VERSION, world_path=world_path,
+            plot_path=plot_path, img_path=img_path,
+            world_digest=loader.hash_world_scripts(world_path),
+            plot_digest=loader.hash_world_scripts(plot_path),
+            seed=seed, budget=budget, save=saved)
+        self.start = clock()
+        self.ticks = 0
+        self.inputs = [] # (tick, seconds since start, command)
+        self.cuts = [] # (tick, number of actions called)
+
+    def record(self, tick, command):
+        """Record that `command`, which may be None, was handled on tick
+        number `tick`.
+        """
+        self.ticks = tick
+        if command is not None:
+            self.inputs.append((tick, round(clock() - self.start, 4), command))
+
+    def cut(self, tick, ran):
+        """Record that the scheduler stopped after calling `ran` actions
+        on tick number `tick`.
+        """
+        self.cuts.append((tick, ran))
+
+    def write(self, log_path):
+        """Write the log to `log_path`."""
+        log = dict(self.header, ticks=self.ticks, inputs=self.inputs,
+                   cuts=self.cuts)
+        with open(log_path, 'w') as f:
+            json.dump(log, f)
+
+
+def load_log(log_path):
+    """Return the log written by a Recorder to `log_path`."""
+    with open(log_path) as f:
+        log = json.load(f)
+    if log.get('version') != REPLAY_VERSION:
+        raise ValueError('unsupported replay log version: %r' %
+                         log.get('version'))
+    return log
+
+
+def changed_scripts(log):
+    """Return a list of the scripts, 'world' or 'plot', that have
+    changed since `log` was recorded.
+    """
+    return [name for name in ('world', 'plot')
+            if loader.hash_world_scripts(log[name + '_path']) !=
+            log[name + '_digest']]
+
+
+def start(log):
+    """Return a new Session in the state the game in `log` began in."""
+    random.seed(log['seed'])
+    world, player = loader.load_world(log['world_path'], log['img_path'],
+                                      log['budget'])
+    plot, plot_state = loader.load_plot(log['plot_path'])
+    session = Session(world, player, plot, plot_state)
+    if log['save']:
+        save.restore(session, save.decode_save(base64.b64decode(log['save'])))
+    return session
+
+
+def replay(session, log, timer=clock):
+    """Give `session` the commands in `log` on the ticks they were
+    handled on, running the ticks back to back. Return a list of the
+    seconds each tick took.
+
+    Commands the session doesn't have, such as saving, are left out.
+    """
+    inputs = deque(command for command in log['inputs']
+                   if command[2] in session.commands)
+    cuts = dict(log['cuts'])
+    times = []
+    while session.ticks < log['ticks']:
+        tick = session.ticks + 1
+        while inputs and inputs[0][0] <= tick:
+            session.command(inputs.popleft()[2])
+        session.scheduler.limit = cuts.get(tick)
+        begin = timer()
+        session.tick()
+        times.append(timer() - begin)
+    session.scheduler.limit = None
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='crystals.replay', description=__doc__.split('\n')[0])
+    parser.add_argument('log', help='replay log written by a Recorder')
+    parser.add_argument('-o', '--output',
+                        help='file to write JSON tick times to')
+    parser.add_argument('-t', '--trace',
+                        help='file to write a Chrome trace of the replay to')
+    args = parser.parse_args(argv)
+
+    log = load_log(args.log)
+    for name in changed_scripts(log):
+        sys.stderr.write('warning: the %s scripts have changed since the '
+                         'game was recorded\n' % name)
+    if args.trace:
+        trace.start()
+    session = start(log)
+    times = replay(session, log)
+    if args.trace:
+        trace.write(args.trace, trace.stop())
+
+    total = sum(times)
+    slowest = sorted(xrange(len(times)), key=times.__getitem__)[-5:]
+    print '%d ticks, %d commands in %.3f s (%.0f ticks/s)' % (
+        len(times), len(log['inputs']), total, len(times) / (total or 1))
+    if times:
+        print 'mean %.3f ms, max %.3f ms per tick' % (
+            total / len(times) * 1e3, max(times) * 1e3)
+        print 'slowest ticks: ' + ', '.join(
+            '%d (%.3f ms)' % (i + 1, times[i] * 1e3)
+            for i in reversed(slowest))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(log=args.log, times=times), f)
+
+
+if __name__ == '__main__':
+    main()
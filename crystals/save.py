@@ -0,0 +1,311 @@
+"""saving and loading of games in progress
+
+A saved game records only how the world differs from the one built
+from its scripts: the cells changed in each room, the entities whose
+actions have moved on, and how far the plot has got. Loading builds the
+world afresh and applies those differences, so rooms the player never
+changed cost nothing to save or load.
+"""
+import cPickle
+import os
+import threading
+import zlib
+import Queue
+
+from crystals.api.action import _state
+from crystals.api.plot import Progress
+from crystals.world import Entity, EntityState, Room, RoomSnapshot, Tile
+
+__all__ = ['Autosaver', 'record', 'restore', 'write_save', 'read_save',
+           'decode_save', 'save_game', 'load_game']
+
+SAVE_VERSION = 2 # bump when the format of saved games changes
+AUTOSAVE_INTERVAL = 60 # seconds between autosaves
+
+# Kinds of entity recorded in a changed cell, besides None and Tiles
+PLAYER = 'player' # the player character
+ORIGIN = 'origin' # an entity built from the atlas, by its origin
+NEW = 'new' # an entity added since, by its EntityState
+
+
+def _describe(entity, origin, player):
+    """Return how to record `entity`, with origin `origin`, in a cell."""
+    if entity is None or isinstance(entity, Tile):
+        return entity
+    if entity is player:
+        return (PLAYER,)
+    if origin:
+        return (ORIGIN, origin)
+    state = entity if isinstance(entity, EntityState) else entity.state()
+    return (NEW, state._replace(action=None))
+
+
+def _pickle_action(action):
+    """Return `action` pickled, or None if it can't be, such as if it's a
+    lambda.
+    """
+    try:
+        return cPickle.dumps(action, cPickle.HIGHEST_PROTOCOL)
+    except (cPickle.PicklingError, TypeError):
+        return None
+
+
+def record(session, digest=None, cache=None):
+    """Return a record of how the world, player and plot of `session`
+    differ from when they were loaded, in a form that can be pickled.
+
+    Only the rooms that are loaded or snapshotted, and only their
+    touched cells (see `Room`), are looked at. `digest` is kept with
+    the record, so that it can be checked against the world and plot
+    scripts when loading.
+
+    If `cache` is given, it must be a dict kept between calls. The
+    cells recorded for each room are kept there with the room's version,
+    and reused as long as the room is unchanged.
+
+    The record shares nothing that the game changes later, so it can be
+    written out on another thread while the game carries on. The actions
+    of entities added since the world was loaded are pickled as they
+    are now; those that can't be pickled are left out. The entity
+    actions queued in the session's scheduler are not recorded.
+    """
+    player = session.player
+    rooms = {}
+    entities = {} # Maps origins to (facing, action state)
+    actions = {} # Maps (room, x, y, z) of added entities to their actions
+    for name, room in dict.iteritems(session.world):
+        if isinstance(room, Room):
+            grid = room
+            found = room.coords.items()
+            origin_of = lambda entity, xyz: getattr(entity, 'origin', None)
+        elif isinstance(room, RoomSnapshot):
+            grid = room.grid
+            found = [(grid[y][x][z], (x, y, z))
+                     for x, y, z in room.origins]
+            origin_of = lambda entity, xyz: room.origins.get(xyz)
+        else:
+            continue
+
+        version = getattr(room, 'version', 0)
+        cached = cache.get(name) if cache is not None else None
+        if cached is not None and cached[0] is room and cached[1] == version:
+            cells = cached[2]
+        else:
+            cells = {}
+            for x, y in room.touched:
+                cells[(x, y)] = [
+                    _describe(entity, origin_of(entity, (x, y, z)), player)
+                    for z, entity in enumerate(grid[y][x])]
+            if cache is not None:
+                cache[name] = (room, version, cells)
+        if cells:
+            rooms[name] = cells
+
+        # Actions change without changing the room, so aren't cached
+        for x, y in room.touched:
+            for z, entity in enumerate(grid[y][x]):
+                if (entity is None or isinstance(entity, Tile) or
+                        entity is player or not entity.action or
+                        origin_of(entity, (x, y, z))):
+                    continue
+                action = _pickle_action(entity.action)
+                if action is not None:
+                    actions[(name, x, y, z)] = action
+
+        for entity, (x, y, z) in found:
+            origin = origin_of(entity, (x, y, z))
+            if not origin:
+                continue
+            state = _state(entity.action)
+            if state is not None or (x, y) in room.touched:
+                entities[origin] = (entity.facing, state)
+
+    return dict(version=SAVE_VERSION, digest=digest,
+                focus=session.world.focus.name, facing=player.facing,
+                rooms=rooms, entities=entities, actions=actions,
+                plot=session.plot.send(Progress),
+                updates=list(session.plot_updates))
+
+
+def restore(session, saved):
+    """Apply record `saved`, as returned by `record`, to `session`,
+    whose world and plot must be as they were when loaded, and return
+    True. If the plot can't go back to where it was saved, as when its
+    triggers have changed since, change nothing and return False.
+    """
+    if not session.plot.send(saved['plot']):
+        return False
+    world = session.world
+    budget = world.budget
+    world.budget = None # Keep every room involved loaded until done
+    try:
+        # Find the entities built from the atlas before moving any
+        origins = set(saved['entities'])
+        for cells in saved['rooms'].itervalues():
+            for stack in cells.itervalues():
+                origins.update(entity[1] for entity in stack
+                               if type(entity) is tuple and
+                               entity[0] == ORIGIN)
+        authored = {}
+        for origin in origins:
+            name, x, y, z = origin
+            authored[origin] = world[name][y][x][z]
+
+        def build(entity):
+            if entity is None or isinstance(entity, Tile):
+                return entity
+            if entity[0] == PLAYER:
+                return session.player
+            if entity[0] == ORIGIN:
+                return authored[entity[1]]
+            return Entity(*entity[1])
+
+        for name, cells in saved['rooms'].iteritems():
+            room = world[name]
+            for x, y in cells:
+                room.replace_stack(x, y, [])
+        for name, cells in saved['rooms'].iteritems():
+            room = world[name]
+            for (x, y), stack in cells.iteritems():
+                room.replace_stack(x, y, [build(e) for e in stack])
+        for (name, x, y, z), action in saved['actions'].iteritems():
+            world[name][y][x][z].action = cPickle.loads(action)
+
+        for origin, (facing, state) in saved['entities'].iteritems():
+            entity = authored[origin]
+            entity.facing = facing
+            if state is not None:
+                entity.action.restore(state)
+        session.player.facing = saved['facing']
+        world.set_focus(saved['focus'])
+    finally:
+        world.budget = budget
+    session.update_plot(saved['updates'])
+    return True
+
+
+def write_save(save_path, saved):
+    """Write record `saved`, as returned by `record`, to `save_path`.
+
+    The record is pickled and compressed, then written to a temporary
+    file that replaces any earlier save once complete, so a save is
+    never left half written. This may be called from any thread.
+    """
+    data = zlib.compress(cPickle.dumps(saved, cPickle.HIGHEST_PROTOCOL))
+    tmp_path = save_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, save_path)
+
+
+def save_game(session, save_path, digest=None):
+    """Save `session` at `save_path`, tagged with hex digest `digest`
+    of the world and plot scripts (see `record`).
+    """
+    write_save(save_path, record(session, digest))
+
+
+class Autosaver(object):
+    """Saves a session at `save_path` without holding up the game.
+
+    Each call to `save` records the session (see `record`), which is
+    quick, especially as the records of unchanged rooms are reused.
+    Pickling, compressing and writing the record are left to a worker
+    thread. If saves are queued faster than they can be written, only
+    the latest is written.
+
+    `error` is the last exception raised by a write, if any, such as an
+    IOError or a PicklingError; the worker carries on with later saves
+    until `stop` is called.
+    """
+
+    def __init__(self, session, save_path, digest=None):
+        self.session = session
+        self.save_path = save_path
+        self.digest = digest
+        self.cache = {}
+        self.error = None
+        self.queue = Queue.Queue()
+
+        self.worker = threading.Thread(target=self._write_queued)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _write_queued(self):
+        stopped = False
+        while not stopped:
+            saved = self.queue.get()
+            stopped = saved is None
+            try:
+                while not stopped:
+                    try:
+                        newer = self.queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    self.queue.task_done()
+                    if newer is None:
+                        stopped = True
+                    else:
+                        saved = newer
+                if saved is not None:
+                    write_save(self.save_path, saved)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def save(self, dt=None):
+        """Record the session and queue the record to be written.
+        Suitable for scheduling with `pyglet.clock`.
+        """
+        self.queue.put(record(self.session, self.digest, self.cache))
+
+    def stop(self):
+        """Stop the worker once it has written the saves queued."""
+        self.queue.put(None)
+
+    def flush(self):
+        """Wait until every queued save has been written, or the worker
+        has stopped.
+        """
+        done = self.queue.all_tasks_done
+        with done:
+            while self.queue.unfinished_tasks and self.worker.is_alive():
+                done.wait(0.1)
+
+
+def decode_save(data, digest=None):
+    """Return the record in `data`, the contents of a save file, or None
+    if it's unreadable or was saved from scripts other than those with
+    hex digest `digest`.
+    """
+    try:
+        saved = cPickle.loads(zlib.decompress(data))
+    except (EOFError, ValueError, zlib.error, cPickle.UnpicklingError):
+        return None
+    if (saved.get('version') != SAVE_VERSION or
+            digest and saved['digest'] != digest):
+        return None
+    return saved
+
+
+def read_save(save_path, digest=None):
+    """Return the record saved at `save_path`, or None if there is none
+    (see `decode_save`).
+    """
+    try:
+        with open(save_path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    return decode_save(data, digest)
+
+
+def load_game(session, save_path, digest=None):
+    """Restore the game saved at `save_path` into `session`, freshly
+    loaded. Return True if it was restored, or False if there is no
+    game saved there, it was saved from other scripts or its plot
+    can't be restored (see `restore`).
+    """
+    saved = read_save(save_path, digest)
+    return saved is not None and restore(session, saved)
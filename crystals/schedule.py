@@ -0,0 +1,140 @@
+"""scheduling of entity actions over game ticks"""
+import heapq
+from itertools import count
+from timeit import default_timer as clock
+
+__all__ = ['Scheduler']
+
+BUDGET = 0.004 # Seconds of each tick on screen that actions may take
+
+
+class _Task(object):
+    """An entity action called every `interval` ticks."""
+
+    __slots__ = ('entity', 'action', 'interval', 'room')
+
+    def __init__(self, entity, action, interval, room):
+        self.entity = entity
+        self.action = action
+        self.interval = interval
+        self.room = room
+
+
+class Scheduler(object):
+    """Calls entity actions as the ticks of a session pass, so that
+    entities can act on their own.
+
+    Each action added is called with the session and its entity every
+    `interval` ticks. Tasks wait in a priority queue ordered by the tick
+    they are due, so each step only looks at the tasks that are due.
+
+    If `budget` is given, a step stops calling actions once it has
+    taken that many seconds, and the due tasks left over are called
+    first on the next step. Tasks of entities outside the focused room
+    are low priority: they are set aside until the player enters that
+    room, then called once rather than once per missed interval.
+
+    Tasks keep to their entity across the eviction of its room: when
+    the room is rebuilt, they call the action of the entity rebuilt in
+    its place.
+
+    If `limit` is set, a step stops after calling that many actions, as
+    if the budget had run out; replays use this to cut steps short just
+    where the budget did when they were recorded.
+
+    After each step, `ran` is the number of actions called, `late` the
+    number of due tasks left over by the budget and `asleep` the number
+    of tasks set aside outside the focused room.
+    """
+
+    def __init__(self, session, budget=None):
+        self.session = session
+        self.budget = budget
+        self.limit = None
+        self.ticks = 0
+        self.queue = [] # Heap of (due tick, order added, task)
+        self.rooms = {} # Maps room names to tasks set aside there
+        self.tasks = {} # Maps entities to their tasks
+        self.focus = None # Name of the focused room on the last step
+        self.ran = 0
+        self.late = 0
+        self._order = count()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    @property
+    def asleep(self):
+        """Return the number of tasks set aside outside the focus."""
+        return sum(1 for tasks in self.rooms.itervalues()
+                   for task in tasks if task.action)
+
+    def _push(self, task, due):
+        heapq.heappush(self.queue, (due, next(self._order), task))
+
+    def add(self, entity, action, interval=1, delay=0, room=''):
+        """Call `action` with the session and `entity` every `interval`
+        ticks, starting `delay` ticks from now, in place of any action
+        already scheduled for `entity`.
+
+        `room` is the name of the room the entity is in; if it tests
+        False, the focused room is used.
+        """
+        self.remove(entity)
+        room = room or self.session.world.focus.name
+        task = self.tasks[entity] = _Task(entity, action, interval, room)
+        self._push(task, self.ticks + 1 + delay)
+
+    def _follow_rebuild(self, task, room):
+        """Give `task` the entity that replaced its own when `room` was
+        rebuilt from a snapshot. Return False if there is none.
+        """
+        entity = room.rebuilt.pop(task.entity, None)
+        if entity not in room.coords or entity in self.tasks:
+            return False
+        del self.tasks[task.entity]
+        task.entity = entity
+        self.tasks[entity] = task
+        return True
+
+    def remove(self, entity):
+        """Stop calling the action scheduled for `entity`, if any."""
+        task = self.tasks.pop(entity, None)
+        if task is not None:
+            task.action = None
+
+    def step(self):
+        """Advance one tick, calling the actions that are due."""
+        self.ticks += 1
+        focus = self.session.world.focus
+        if focus.name != self.focus:
+            self.focus = focus.name
+            for task in self.rooms.pop(focus.name, ()):
+                self._push(task, self.ticks)
+
+        if self.budget is not None:
+            deadline = clock() + self.budget
+        queue = self.queue
+        self.ran = self.late = 0
+        while queue and queue[0][0] <= self.ticks:
+            if (self.limit is not None and self.ran >= self.limit or
+                    self.budget is not None and self.ran and
+                    clock() > deadline):
+                self.late = sum(1 for item in queue
+                                if item[0] <= self.ticks and item[2].action)
+                break
+            task = heapq.heappop(queue)[2]
+            if task.action is None:
+                continue
+            if task.entity not in focus.coords:
+                if task.room != focus.name:
+                    self.rooms.setdefault(task.room, []).append(task)
+                    continue
+                if not self._follow_rebuild(task, focus):
+                    # The entity has left the room, so forget it
+                    self.remove(task.entity)
+                    continue
+            task.action(self.session, task.entity)
+            self.ran += 1
+            if task.action is not None:
+                self._push(task, self.ticks + task.interval)
@@ -0,0 +1,223 @@
+"""game logic that runs with or without a display"""
+from crystals import trace
+from crystals.api.plot import EntityUpdate
+from crystals.path import Pathfinder
+from crystals.schedule import Scheduler
+
+__all__ = ['Session', 'TextLog', 'Ticker']
+
+TICK_RATE = 30 # Logic ticks per second of game time
+MAX_CATCHUP = 5 # Most ticks run at once before falling behind is given up
+
+
+class TextLog(list):
+    """Stands in for an infobox when there is no display, keeping each
+    line of text written to it.
+    """
+
+    def write(self, text):
+        self.append(text)
+
+
+class Ticker(object):
+    """Calls `tick` `rate` times per second of time passed to `advance`,
+    however often and irregularly it is called.
+
+    If more than `max_catchup` ticks are due at once, as after a long
+    stall, only that many are run and the rest are dropped, so a slow
+    machine falls behind rather than spiralling into ever longer calls.
+    """
+
+    def __init__(self, tick, rate=TICK_RATE, max_catchup=MAX_CATCHUP):
+        self.tick = tick
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.max_catchup = max_catchup
+        self.lag = 0.0 # Time passed since the last tick was due
+        self.ticks = 0 # Number of ticks run
+        self.dropped = 0 # Number of ticks dropped
+
+    @property
+    def alpha(self):
+        """Return how far it is from the last tick to the next one, from
+        0 to 1, for drawing in between.
+        """
+        return min(self.lag / self.period, 1.0)
+
+    def advance(self, dt):
+        """Pass `dt` seconds, running each tick that falls due and
+        returning the number run. Suitable for scheduling with
+        `pyglet.clock`.
+        """
+        self.lag += dt
+        due = int(self.lag * self.rate + 1e-9) # Allow for rounding error
+        if due > self.max_catchup:
+            self.dropped += due - self.max_catchup
+            self.lag -= (due - self.max_catchup) * self.period
+            due = self.max_catchup
+        for i in xrange(due):
+            self.lag -= self.period
+            self.ticks += 1
+            self.tick()
+        return due
+
+
+class Session(object):
+    """A game in progress: the world, the player and the plot.
+
+    A session is what entity actions and plot triggers act upon. It
+    needs no window, so whole games can be simulated without a display;
+    `crystals.engine.WorldMode` is a session that is also drawn on screen.
+    Text written by actions goes to `infobox`, which is a TextLog unless
+    another is given.
+
+    Game logic runs in ticks, `rate` per second of time passed to
+    `advance` (see Ticker), so it runs at the same pace whatever the
+    frame rate, and headless sessions can be run tick by tick. Each tick,
+    the entity actions added to `scheduler` that are due are called (see
+    `crystals.schedule.Scheduler`, which is given `budget`). Entities
+    find their way around with `paths` (see `crystals.path.Pathfinder`).
+
+    The player acts through the named commands in `commands`. Commands
+    given with `command` are queued and handled one per tick, so a game
+    can be replayed exactly from the ticks its commands were handled on.
+    If the session has a `recorder`, such as a `crystals.replay.Recorder`,
+    it is told of each tick and the command handled on it. If it has an
+    `autosaver` (see `crystals.save.Autosaver`), it saves at the end of
+    each tick on which the player portalled.
+
+    Plot updates are queued with `update_plot` and sent to the plot
+    together by `step_plot`, once per tick, so that trigger functions
+    never run in the middle of the interaction that caused them. Changes
+    to unique entities in the world are sent along with them.
+    """
+
+    def __init__(self, world, player, plot, plot_state, infobox=None,
+                 rate=TICK_RATE, budget=None):
+        self.world = world
+        self.player = player
+        self.plot = plot
+        self.plot_state = plot_state
+        self.plot_updates = []
+        self.ticker = Ticker(self.tick, rate)
+        self.scheduler = Scheduler(self, budget)
+        self.paths = Pathfinder(world)
+        self.infobox = TextLog() if infobox is None else infobox
+        self.ticks = 0 # Number of ticks run
+        self.inputs = [] # Commands given but not yet handled
+        self.recorder = None
+        self.autosaver = None
+        self.save_due = False # True if the player portalled this tick
+
+        # Define the commands the player can give. Values are each a
+        # tuple of a callable followed optionally by arguments.
+        self.commands = {
+            'left': (self.step_player, -1, 0),
+            'right': (self.step_player, 1, 0),
+            'down': (self.step_player, 0, -1),
+            'up': (self.step_player, 0, 1),
+            'interact': (self.interact,),
+        }
+
+        self.world.track_changes()
+        self.plot.send(self)
+
+    def command(self, name):
+        """Queue the command with the given name to be handled on the
+        next tick.
+        """
+        self.inputs.append(name)
+
+    def tick(self):
+        """Run one tick of game logic: handle the next command given, if
+        any, call the entity actions that are due, then send the plot
+        its updates. If the player portalled along the way, autosave
+        once the plot has been sent them.
+        """
+        self.ticks += 1
+        name = self.inputs.pop(0) if self.inputs else None
+        if self.recorder is not None:
+            self.recorder.record(self.ticks, name)
+        if name is not None:
+            command = self.commands[name]
+            command[0](*command[1:])
+        self.scheduler.step()
+        if self.recorder is not None and self.scheduler.late:
+            self.recorder.cut(self.ticks, self.scheduler.ran)
+        self.step_plot()
+        if self.save_due:
+            self.save_due = False
+            if self.autosaver is not None:
+                self.autosaver.save()
+
+    def advance(self, dt):
+        """Pass `dt` seconds of game time, running each tick that falls
+        due. Suitable for scheduling with `pyglet.clock`.
+        """
+        return self.ticker.advance(dt)
+
+    def update_plot(self, updates):
+        """Queue a plot state identifier, or a tuple, set or list of
+        them, to be sent to the plot on the next call to `step_plot`.
+        """
+        if type(updates) in (tuple, set, frozenset, list):
+            self.plot_updates.extend(updates)
+        else:
+            self.plot_updates.append(updates)
+
+    def step_plot(self, dt=None):
+        """Send all queued plot updates to the plot at once, followed by
+        an EntityUpdate for each change to a unique entity in the world.
+
+        Updates queued by the trigger functions this calls are sent in
+        turn, until the queue is empty.
+        """
+        changes = self.world.changes
+        while self.plot_updates or changes:
+            updates = self.plot_updates
+            updates.extend(EntityUpdate(*change) for change in changes)
+            self.plot_updates = []
+            del changes[:]
+            with trace.span('plot.send', 'plot', updates=len(updates)):
+                self.plot.send(updates)
+
+    def step_player(self, xstep, ystep):
+        """Step the player (`xstep`, `ystep`) tiles from her current
+        position.
+
+        If successful and the new position hosts a portal, portal
+        the player.
+        """
+        success = self.world.step_entity(self.player, xstep, ystep)
+        if not success:
+            return
+
+        from_room = self.world.focus.name
+        x, y, z = self.world.focus.get_coords(self.player)
+        if self.world.portals_xy2dest[from_room].get((x, y)):
+            self.portal_player(x, y)
+
+    def portal_player(self, x, y):
+        """Transfer the player to the destination of the portal at
+        (x, y), then set that room as the focus and autosave at the end
+        of the tick.
+
+        The save waits, as the plot may be running: recording a save
+        sends the plot its progress.
+        """
+        self.world.portal_entity(self.player, x, y)
+        from_room = self.world.focus.name
+        dest = self.world.portals_xy2dest[from_room][(x, y)]
+        self.world.set_focus(dest)
+        self.save_due = True
+
+    def interact(self):
+        """If an interactable entity is in front of the player, make
+        her interact with it. Else, do nothing.
+        """
+        x, y, z = self.world.focus.get_coords(self.player)
+        x += self.player.facing[0]
+        y += self.player.facing[1]
+        for entity in self.world.focus[y][x]:
+            if entity and entity.action:
+                entity.action(self, entity)
@@ -0,0 +1,144 @@
+"""timing of frames, game logic and input latency
+
+Nothing here depends on pyglet. Times are kept as rolling histograms of
+the most recent samples, so they show how the game is running now
+rather than on average since it started.
+"""
+import json
+from collections import deque, OrderedDict
+from functools import wraps
+from timeit import default_timer as clock
+
+__all__ = ['Histogram', 'FrameStats']
+
+HISTORY = 600 # Most recent samples kept by each histogram
+BUCKETS = (0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.066) # Seconds
+
+
+class Histogram(object):
+    """The last `size` samples of a duration, in seconds."""
+
+    def __init__(self, size=HISTORY):
+        self.samples = deque(maxlen=size)
+        self.count = 0 # Number of samples ever added
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, p):
+        """Return the sample that `p` percent of the samples are no
+        longer than, or 0 if there are none.
+        """
+        if not self.samples:
+            return 0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100.0), len(ordered) - 1)]
+
+    def counts(self, buckets=BUCKETS):
+        """Return the number of samples no longer than each of the
+        bucket bounds `buckets` but longer than the one before, followed
+        by the number longer than the last.
+        """
+        counts = [0] * (len(buckets) + 1)
+        for sample in self.samples:
+            for i, bound in enumerate(buckets):
+                if sample <= bound:
+                    break
+            else:
+                i = len(buckets)
+            counts[i] += 1
+        return counts
+
+    def summary(self):
+        """Return a dict of the count, mean, median, 95th and 99th
+        percentiles and maximum, in milliseconds, and bucket counts.
+        """
+        n = len(self.samples)
+        return OrderedDict([
+            ('count', self.count),
+            ('mean', sum(self.samples) / n * 1e3 if n else 0),
+            ('p50', self.percentile(50) * 1e3),
+            ('p95', self.percentile(95) * 1e3),
+            ('p99', self.percentile(99) * 1e3),
+            ('max', max(self.samples) * 1e3 if n else 0),
+            ('buckets', self.counts())])
+
+
+class FrameStats(object):
+    """Rolling histograms of named timings, such as 'draw' and 'logic',
+    kept for each frame of a game.
+
+    Key-to-frame latency is measured by calling `press` when a key is
+    pressed, `handle` when the game handles the oldest key pressed, and
+    `frame` when a frame has been drawn: each key handled since the last
+    frame adds the time since it was pressed to 'latency'.
+    """
+
+    def __init__(self, size=HISTORY):
+        self.size = size
+        self.histograms = OrderedDict()
+        self.pressed = deque() # Times of keys pressed but not yet handled
+        self.handled = [] # Times of keys handled but not yet drawn
+
+    def __getitem__(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.size)
+        return histogram
+
+    def add(self, name, seconds):
+        """Add a sample of `seconds` to the histogram named `name`."""
+        self[name].add(seconds)
+
+    def timed(self, name, func):
+        """Return a function that calls `func` and adds the time it took
+        to the histogram named `name`.
+        """
+        histogram = self[name]
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.add(clock() - start)
+        return timed_func
+
+    def press(self):
+        """Record that a key was pressed."""
+        self.pressed.append(clock())
+
+    def handle(self):
+        """Record that the oldest key pressed was handled."""
+        if self.pressed:
+            self.handled.append(self.pressed.popleft())
+
+    def frame(self, now=None):
+        """Record that a frame was drawn, at time `now` if given."""
+        if self.handled:
+            now = clock() if now is None else now
+            latency = self['latency']
+            for pressed in self.handled:
+                latency.add(now - pressed)
+            del self.handled[:]
+
+    def report(self):
+        """Return a list of lines of text summing up each histogram."""
+        lines = []
+        for name, histogram in self.histograms.iteritems():
+            summary = histogram.summary()
+            lines.append('%-9s %6.2f %6.2f %6.2f ms' % (
+                name, summary['mean'], summary['p95'], summary['max']))
+        return ['%-9s %6s %6s %6s' % ('', 'mean', 'p95', 'max')] + lines
+
+    def dump(self, path):
+        """Write a summary of each histogram to `path` as JSON."""
+        with open(path, 'w') as f:
+            json.dump(OrderedDict(
+                (name, histogram.summary())
+                for name, histogram in self.histograms.iteritems()),
+                f, indent=2)
@@ -43,3 +43,152 @@ class TestPlot():
         else:
             assert False
         assert self.dummy is 2
+
+
+def TestPlot_StateMetByInitialState_CallTriggerOnFirstUpdate():
+    called = []
+    plt = plot.plot(set(['State1']), {
+        ('State1',): (called.append, {}),
+        ('State2',): (called.append, {})})
+    app = object()
+    plt.send(app)
+    assert called == []
+    plt.send('Unrelated')
+    assert called == [app]
+
+
+def TestPlot_NestedTriggersAlreadyMet_CallTriggersInSameUpdate():
+    called = []
+    plt = plot.plot(set(), {
+        ('State1',): (lambda app: called.append(1), {
+            ('State2',): (lambda app: called.append(2), {
+                ('State1', 'State2'): (lambda app: called.append(3), {})})}),
+        ('State3',): (lambda app: called.append(4), {})})
+    plt.send(object())
+    plt.send(('State1', 'State2'))
+    assert called == [1, 2, 3]
+
+
+def TestPlot_CountConditionGiven_CallTriggerOnNthUpdate():
+    called = []
+    plt = plot.plot(set(), {
+        (plot.Count('Talk', 3),): (called.append, {}),
+        ('Never',): (None, {})})
+    plt.send(object())
+    plt.send('Talk')
+    plt.send(['Talk', 'Other'])
+    assert called == []
+    plt.send('Talk')
+    assert len(called) == 1
+
+
+def TestPlot_NotConditionGiven_CallTriggerOnlyWhileStateAbsent():
+    called = []
+    plt = plot.plot(set(), {
+        ('State1', plot.Not('Carrying')): (called.append, {}),
+        ('State2', plot.Not('Carrying')): (called.append, {}),
+        ('Never',): (None, {})})
+    plt.send(object())
+    plt.send(['Carrying', 'State1'])
+    assert called == []
+    plt.send('State2')
+    assert called == []
+
+
+def TestPlot_AnyConditionGiven_CallTriggerWhenEntityMatches():
+    class Entity(object):
+        def __init__(self, id, hostile):
+            self.id = id
+            self.hostile = hostile
+    called = []
+    plt = plot.plot(set(), {
+        ('Enter', plot.Any('Cave', lambda e: e.hostile)): (called.append, {}),
+        ('Never',): (None, {})})
+    plt.send(object())
+    imp = Entity('imp', False)
+    plt.send(['Enter', plot.EntityUpdate('Cave', imp, True)])
+    assert called == []
+    imp.hostile = True
+    plt.send(plot.EntityUpdate('Hall', imp, True))
+    assert called == []
+    plt.send(plot.EntityUpdate('Cave', imp, True))
+    assert len(called) == 1
+
+
+class TestTriggerSet(object):
+
+    def setup(self):
+        self.func = lambda app: None
+        self.triggers = plot._TriggerSet(set(['a']), {
+            ('a', 'b'): (self.func, {('c',): (self.func, {})}),
+            ('b', 'c'): (self.func, {}),
+            ('d',): (self.func, {})})
+
+    def TestInit_InternStatesAndIndexTriggersByAtom(self):
+        assert len(self.triggers) == 3
+        assert self.triggers.mask == 1 << self.triggers.atoms['a']
+        b = self.triggers.atoms['b']
+        assert len(self.triggers.index[b]) == 2
+
+    def TestAdd_StatesGiven_ReturnOnlyTriggersMet(self):
+        met = self.triggers.add(['b'])
+        assert [t.atoms for t in met] == [
+            tuple(set(self.triggers.atoms[s] for s in 'ab'))]
+
+    def TestAdd_StateAlreadyAdded_ReturnNothing(self):
+        assert self.triggers.add(['a']) == []
+
+    def TestAdd_EntityLeavesRoom_UnsetAnyCondition(self):
+        entity = type('Entity', (object,), {'id': 'imp'})()
+        condition = plot.Any('Cave', lambda e: True)
+        atom = self.triggers.intern(condition)
+        self.triggers.add((), [plot.EntityUpdate('Cave', entity, True)])
+        assert self.triggers.mask & 1 << atom
+        self.triggers.add((), [plot.EntityUpdate('Cave', entity, False)])
+        assert not self.triggers.mask & 1 << atom
+
+    def TestInit_LambdasInAnyConditions_GiveEachTriggerItsOwnPath(self):
+        triggers = plot._TriggerSet(set(), {
+            ('a', plot.Any('Cave', lambda e: True)): (self.func, {}),
+            ('a', plot.Any('Cave', lambda e: False)): (self.func, {}),
+            (plot.Any('Cave', lambda e: False), 'a'): (self.func, {})})
+        assert len(set(t.path for t in triggers.roots)) == 3
+
+    def TestRetire_TriggerGiven_UnindexTrigger(self):
+        trigger, = self.triggers.add(['b'])
+        self.triggers.retire(trigger)
+        assert len(self.triggers) == 2
+        assert trigger not in self.triggers.index[self.triggers.atoms['a']]
+
+    def TestRestore_ProgressGiven_ActivateSameTriggers(self):
+        for trigger in self.triggers.add(['b']):
+            self.triggers.retire(trigger)
+            for nexttrigger in trigger.branch:
+                self.triggers.activate(nexttrigger)
+        progress = self.triggers.progress()
+        assert progress.counts == {'a': 1, 'b': 1}
+
+        triggers = plot._TriggerSet(set(), {
+            ('d',): (self.func, {}),
+            ('b', 'c'): (self.func, {}),
+            ('a', 'b'): (self.func, {('c',): (self.func, {})})})
+        triggers.restore(progress)
+        assert triggers.progress() == progress
+        assert triggers.mask == self.triggers.mask
+
+
+def TestPlot_ProgressSent_ReplyWithProgressOrRestoreIt():
+    triggers = {('State1',): (lambda app: None, {
+        ('State2',): (lambda app: None, {})})}
+    plt = plot.plot(set(), triggers)
+    plt.send(object())
+    plt.send('State1')
+    progress = plt.send(plot.Progress)
+    assert progress.active == [(('State1',), ('State2',))]
+
+    state = set()
+    plt = plot.plot(state, triggers)
+    plt.send(object())
+    plt.send(progress)
+    assert state == set(['State1'])
+    assert plt.send(plot.Progress) == progress
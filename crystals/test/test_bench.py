@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from crystals import bench
+from crystals import loader
+
+
+class TestWriteWorld(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.scale = bench.Scale(rooms=3, width=8, height=6, layers=3,
+                                 triggers=10)
+        bench.write_world(self.path, self.scale)
+
+    def teardown(self):
+        bench.forget_world_scripts()
+        shutil.rmtree(self.path)
+
+    def TestLoadWorld_WorldWritten_LoadWorldOfGivenScale(self):
+        bench.forget_world_scripts()
+        world, player = loader.load_world(self.path, bench.IMG_PATH)
+        assert len(world) == self.scale.rooms
+        assert len(world.focus) == self.scale.height
+        assert len(world.focus[0]) == self.scale.width
+        assert len(world.focus[0][0]) == self.scale.layers
+        assert world.focus.get_coords(player) == (4, 3, 1)
+
+    def TestLoadWorld_WorldWritten_LinkRoomsInRing(self):
+        bench.forget_world_scripts()
+        world, player = loader.load_world(self.path, bench.IMG_PATH)
+        assert world.portals_dest2xy['Room0'] == {
+            'Room1': (6, 3), 'Room2': (1, 3)}
+
+
+def TestMakeTriggers_ReturnGivenNumberOfTriggersAndOneNeverMet():
+    triggers = bench.make_triggers(10)
+    assert len(triggers) == 6
+    assert sum(len(branch) for func, branch in triggers.values()) == 5
+    assert ('never',) in triggers
+
+
+def TestRun_BenchmarksGiven_ReturnResultForEach():
+    results = bench.run(['tiny'], ['step_entity', 'plot_send'], repeat=2)
+    assert [r['name'] for r in results] == ['step_entity', 'plot_send']
+    for r in results:
+        assert len(r['times']) == 2
+        assert r['per_call'] == min(r['times']) / r['number']
+
+
+def TestCompare_ResultsInBoth_ReturnRatioOfTimePerCall():
+    old = [dict(name='a', scale='tiny', per_call=2.0),
+           dict(name='b', scale='tiny', skipped='no display')]
+    new = [dict(name='a', scale='tiny', per_call=1.0),
+           dict(name='b', scale='tiny', per_call=1.0)]
+    assert bench.compare(old, new) == [('a', 'tiny', 0.5)]
@@ -4,6 +4,8 @@ from pyglet.window import key
 from crystals import engine
 from crystals import gui
 from crystals import world
+from crystals.stats import FrameStats
+from crystals.view import TILE_SIZE
 from crystals.test.test_world import WorldTestCase
 from crystals.test.util import *
 
@@ -89,10 +91,43 @@ class TestWorldMode(WorldTestCase):
     def TestOnKeyPress_MovementKeyPressedAndWalkable_MovePlayer(self):
         x, y, z = self.world_.focus.get_coords(self.wmode.player)
         self.wmode.on_key_press(key.MOTION_UP, 0)
+        self.wmode.tick()
         assert self.room2[y + 1][x][z] == self.player
 
     def TestOnKeyPress_MovementKeyPressedButUnWalkable_DoNothing(self):
         for mvkey in (key.MOTION_LEFT, key.MOTION_DOWN, key.MOTION_RIGHT):
             x, y, z = self.world_.focus.get_coords(self.wmode.player)
             self.wmode.on_key_press(mvkey, 0)
+            self.wmode.tick()
             assert self.room2[y][x][z] == self.player
+
+    def TestOnDraw_WindowRedrawn_ClearInvalid(self):
+        self.wmode.on_draw()
+        assert not self.window.invalid
+
+    def TestOnKeyPress_PlayerMoved_InvalidateWindow(self):
+        self.wmode.on_draw()
+        self.wmode.on_key_press(key.MOTION_UP, 0)
+        self.wmode.tick()
+        assert self.window.invalid
+
+    def TestTick_KeyHandledWithoutRedraw_EndItsLatency(self):
+        self.wmode.stats = FrameStats()
+        self.wmode.on_draw()
+        self.wmode.on_key_press(key.MOTION_LEFT, 0)
+        self.wmode.tick()
+        assert not self.window.invalid
+        assert len(self.wmode.stats['latency']) == 1
+
+    def TestOnKeyPress_KeyPressed_WaitForNextTick(self):
+        x, y, z = self.world_.focus.get_coords(self.wmode.player)
+        self.wmode.on_key_press(key.MOTION_UP, 0)
+        assert self.room2[y][x][z] == self.player
+
+    def TestStep_PlayerMoved_DrawPlayerBetweenCells(self):
+        x, y, z = self.world_.focus.get_coords(self.wmode.player)
+        self.wmode.on_key_press(key.MOTION_UP, 0)
+        self.wmode.step(self.wmode.ticker.period * 1.5)
+        sprite = self.wmode.view.room_view.sprites[self.player]
+        assert y * TILE_SIZE < sprite.y < (y + 1) * TILE_SIZE
+        assert self.wmode.animating
@@ -8,7 +8,7 @@ from nose.tools import *
 
 from crystals.test.util import *
 from crystals import gui
-from crystals.world import TILE_SIZE
+from crystals.view import TILE_SIZE
 
 
 class TestBox(object):
@@ -128,6 +128,20 @@ class TestMenu(PygletTestCase):
         assert isinstance(self.menu.boxes[new_i].box,
                           pyglet.graphics.vertexdomain.VertexList)
 
+    def TestSelectItem_OtherItemGiven_Invalidate(self):
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.menu.invalidate = invalidate
+        self.menu.select_item(1)
+        assert self.invalidated
+
+    def TestSelectItem_SameItemGiven_DontInvalidate(self):
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.menu.invalidate = invalidate
+        self.menu.select_item(self.menu.selection)
+        assert not self.invalidated
+
     def TestSelectNext_ShortOfLastItem_SelectNextItem(self):
         self.menu.select_item(0)
         self.menu.select_next()
@@ -177,6 +191,18 @@ class TestMenu(PygletTestCase):
                                       self.menu.boxes[-1].y * 2, dx, dy)
             assert self.menu.selection == None
 
+    def TestOnMouseMotion_CursorStaysOnSelectedItem_DontInvalidate(self):
+        box = self.menu.boxes[1]
+        self.menu.on_mouse_motion(box.x, box.y, 1, 0)
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.menu.invalidate = invalidate
+        self.menu.on_mouse_motion(box.x + 1, box.y, 1, 0)
+        assert not self.invalidated
+        self.menu.on_mouse_motion(self.menu.boxes[0].x,
+                                  self.menu.boxes[0].y, 0, 1)
+        assert self.invalidated == 1
+
     def TestOnMouseRelelase_ItemSelected_CallItemFunction(self):
         for i in xrange(len(self.functions)):
             self.menu.select_item(i)
@@ -193,3 +219,21 @@ class TestMenu(PygletTestCase):
             self.menu.select_item(0)
             self.menu.on_mouse_release(0, 0, btn, 0)
             assert self.test_number is None
+
+
+class TestInfoBox(object):
+
+    def setup(self):
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.infobox = gui.InfoBox(0, 0, 200, 100, pyglet.graphics.Batch(),
+                                   invalidate=invalidate)
+
+    def TestWrite_TextGiven_Invalidate(self):
+        self.infobox.write('hello')
+        assert self.invalidated
+
+    def TestClear_TextWritten_RemoveIt(self):
+        self.infobox.write('hello')
+        self.infobox.clear()
+        assert 'hello' not in self.infobox.document.text
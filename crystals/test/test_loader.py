@@ -1,26 +1,18 @@
+import cPickle
 import os
+import shutil
 import sys
+import tempfile
+import time
 from functools import partial
 
-import pyglet
 from nose.tools import *
 
 from crystals import loader
-from crystals.world import Room, World, Entity, TILE_SIZE
+from crystals.world import Room, World, Entity, Tile
 from crystals.test.util import *
 
 
-def TestPrepareEntity_ValidParamsGiven_ScaleImage():
-    entity = Entity('cow', False, 'cow.png')
-
-    image = entity.image
-    assert image.width != TILE_SIZE
-    assert image.height != TILE_SIZE
-    loader.prepare_sprite(entity)
-    assert image.width == TILE_SIZE
-    assert image.height == TILE_SIZE
-
-
 def check_room(room, atlas, entities):
     for z in xrange(len(atlas.map)):
         atlas_y_coords = xrange(len(atlas.map[z]))
@@ -104,6 +96,108 @@ def TestLoadRoom_ValidArgsGiven_IgnoreCharInZLevel1_ReturnExpectedRoom():
     check_room(room, atlas, entities)
 
 
+def TestLoadRoom_StaticEntitiesGiven_ShareOneTilePerChar():
+    class atlas:
+        key = {'+': 'floor', 'T': 'troll'}
+        map = [
+            [
+                '+++',
+                '+T+']]
+    class entities:
+        floor = partial(Entity, 
+            name = 'floor',
+            walkable = True,
+            image = 'floor-a-red.png')
+        troll = partial(Entity, 
+            id = 'troll',
+            name = 'troll',
+            walkable = False,
+            image = 'troll.png')
+
+    prototypes = {}
+    room = loader.load_room('TestRoom', atlas, entities, prototypes)
+    assert isinstance(room[0][0][0], Tile)
+    assert room[0][0][0] is room[1][2][0]
+    assert prototypes == {('TestRoom', '+'): room[0][0][0]}
+    assert isinstance(room[0][1][0], Entity)
+    assert room.uniques['troll'] is room[0][1][0]
+
+
+def TestParseRoom_ReturnCharsInGridOrder():
+    class atlas:
+        map = [
+            [
+                'ab',
+                'cd'],
+            [
+                'ef',
+                'gh']]
+    assert loader.parse_room(atlas) == [
+        [['c', 'g'], ['d', 'h']],
+        [['a', 'e'], ['b', 'f']]]
+
+
+class TestRoomBuilder(object):
+
+    def setup(self):
+        class atlas:
+            key = {'+': 'floor'}
+            map = [
+                [
+                    '+++',
+                    '+.+',
+                    '+++']]
+        class entities:
+            floor = partial(Entity, 
+                name = 'floor',
+                walkable = True,
+                image = 'floor-a-red.png')
+        self.builder = loader.RoomBuilder('TestRoom', atlas, entities)
+
+    def TestStep_RowsLeft_BuildGivenRowsAndReturnFalse(self):
+        assert not self.builder.step(2)
+        assert len(self.builder.grid) == 2
+        assert self.builder.room is None
+
+    def TestStep_LastRowsBuilt_MakeRoomAndReturnTrue(self):
+        self.builder.step(2)
+        assert self.builder.step(2)
+        assert isinstance(self.builder.room, Room)
+        assert self.builder.room[1][1][0] is None
+
+    def TestCall_PartlyBuilt_ReturnCompleteRoom(self):
+        self.builder.step()
+        room = self.builder()
+        assert room is self.builder.room
+        assert len(room) == 3
+
+
+def TestPrefetcher_PortalDestNotBuilt_BuildDestInBackground():
+    world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+    builder = world.factory('BlueRoom')
+    prefetcher = loader.Prefetcher(world)
+    prefetcher.prefetch()
+
+    for i in xrange(100):
+        prefetcher.step()
+        if builder.room is not None:
+            break
+        time.sleep(0.01)
+
+    assert builder.room is not None
+    assert not prefetcher.pending
+    assert world.isloaded('BlueRoom')
+    assert world['BlueRoom'] is builder.room
+
+
+def TestPrefetcher_Stopped_EndWorker():
+    world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+    prefetcher = loader.Prefetcher(world)
+    prefetcher.stop()
+    prefetcher.worker.join(1)
+    assert not prefetcher.worker.is_alive()
+
+
 def TestLoadPortals_LoadExpectedPortals():
     class atlas:
         portalkey = {'1': 'Room1', '2': 'Room2'}
@@ -138,6 +232,13 @@ def TestLoadWorld_ReturnExpectedWorld():
     assert len(room[0][0]) == 1
 
 
+def TestLoadWorld_NoCachePath_ParseLayoutsOnlyWhenBuilt():
+    world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+    assert world.factory('BlueRoom').layout is None
+    check_room(world['BlueRoom'], atlas_module().BlueRoom,
+               entities_module().BlueRoom)
+
+
 def TestLoadWorld_ReturnExpectedPlayerAtExpectedCoords():
     world, player = loader.load_world(WORLD_PATH, IMG_PATH)
 
@@ -150,5 +251,58 @@ def TestLoadWorld_ReturnExpectedPlayerAtExpectedCoords():
     assert y == 2
 
 
+class TestLoadWorldWithCache(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmpdir, 'world.cache')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def TestLoadWorld_NoCache_SaveCompiledWorld(self):
+        loader.load_world(WORLD_PATH, IMG_PATH, cache_path=self.cache_path)
+        digest = loader.hash_world_scripts(WORLD_PATH)
+        compiled = loader.load_compiled_world(self.cache_path, digest)
+        assert compiled['rooms'] == ['RedRoom', 'BlueRoom']
+        assert compiled['start'] == ('RedRoom', 1, 2, 2)
+
+    def TestLoadWorld_CacheUpToDate_ReturnSameWorld(self):
+        loader.load_world(WORLD_PATH, IMG_PATH, cache_path=self.cache_path)
+        world, player = loader.load_world(
+            WORLD_PATH, IMG_PATH, cache_path=self.cache_path)
+        assert set(world) == set(['RedRoom', 'BlueRoom'])
+        assert world.focus.get_coords(player)[:2] == (2, 2)
+        check_room(world['RedRoom'], atlas_module().RedRoom,
+                   entities_module().RedRoom)
+
+    def TestLoadWorld_CacheUnwritable_LoadUncached(self):
+        cache_path = os.path.join(self.tmpdir, 'missing', 'world.cache')
+        world, player = loader.load_world(WORLD_PATH, IMG_PATH,
+                                          cache_path=cache_path)
+        assert world.focus.get_coords(player)[:2] == (2, 2)
+        assert not os.path.exists(cache_path)
+
+    def TestLoadCompiledWorld_DigestChanged_ReturnNone(self):
+        loader.save_compiled_world(self.cache_path, 'old digest', {})
+        assert loader.load_compiled_world(self.cache_path, 'new') is None
+
+    def TestLoadCompiledWorld_CacheNotAWorld_ReturnNone(self):
+        with open(self.cache_path, 'wb') as f:
+            f.write(cPickle.dumps(1, cPickle.HIGHEST_PROTOCOL))
+        assert loader.load_compiled_world(self.cache_path, 'digest') is None
+
+    def TestLoadCompiledWorld_NoCacheFile_ReturnNone(self):
+        assert loader.load_compiled_world(self.cache_path, 'digest') is None
+
+
+def atlas_module():
+    return loader.load_script(WORLD_PATH, 'atlas')
+
+
+def entities_module():
+    return loader.load_script(WORLD_PATH, 'entities')
+
+
 def TestLoadPlot():
     loader.load_plot(PLOT_PATH)
@@ -0,0 +1,124 @@
+from nose.tools import *
+
+from crystals import path
+from crystals import world
+from crystals.api import action
+from crystals.session import Session
+from crystals.test.test_world import MockEntity
+from crystals.test.util import *
+
+FLOOR = world.Tile('floor', True, 'cow.png', None)
+WALL = world.Tile('wall', False, 'cow.png', None)
+
+# Map of a room, from the top row down; walls are '#'
+MAP = ['.....',
+       '.###.',
+       '...#.',
+       '##.#.',
+       '.....']
+
+
+def make_room(name='room', map=MAP):
+    """Return a Room laid out as `map`, with an empty layer on top."""
+    return world.Room(name, [
+        [[WALL if char == '#' else FLOOR, None] for char in row]
+        for row in reversed(map)])
+
+
+def TestFindPath_WallInTheWay_GoAroundIt():
+    room = make_room()
+    assert path.find_path(room, (0, 2), (0, 0)) == [
+        (1, 2), (2, 2), (2, 1), (2, 0), (1, 0), (0, 0)]
+
+
+def TestFindPath_GoalOccupied_LeadUpToIt():
+    room = make_room()
+    room.replace_entity(MockEntity(walkable=False), 4, 4, 1)
+    assert path.find_path(room, (4, 2), (4, 4)) == [(4, 3), (4, 4)]
+
+
+def TestFindPath_GoalWalledIn_ReturnNone():
+    room = make_room(map=['.#.', '##.', '...'])
+    assert path.find_path(room, (2, 0), (0, 2)) is None
+
+
+class TestDistanceField(object):
+
+    def setup(self):
+        self.room = make_room()
+        self.field = path.DistanceField(self.room, 4, 4)
+
+    def TestDistance_CountStepsAroundWalls(self):
+        assert self.field.distance(4, 4) == 0
+        assert self.field.distance(4, 0) == 4
+        assert self.field.distance(0, 2) == 6
+        assert self.field.distance(1, 3) is None
+
+    def TestStep_WayClear_StepCloser(self):
+        assert self.field.step(4, 0) == (0, 1)
+        assert self.field.step(4, 4) is None
+
+    def TestStep_EntityInTheWay_WaitForIt(self):
+        self.room.replace_entity(MockEntity(walkable=False), 4, 1, 1)
+        assert self.field.step(4, 0) is None
+
+
+class TestPathfinder(object):
+
+    def setup(self):
+        rooms = [make_room('room%d' % i) for i in xrange(3)]
+        self.world = world.World(
+            dict((room.name, room) for room in rooms),
+            {'room0': {'room1': (4, 2)},
+             'room1': {'room0': (0, 2), 'room2': (4, 0)},
+             'room2': {'room1': (0, 0)}},
+            'room0')
+        self.paths = path.Pathfinder(self.world)
+
+    def TestField_SameTargetTwice_ShareField(self):
+        assert self.paths.field(4, 4) is self.paths.field(4, 4)
+
+    def TestField_WallAddedInReach_MakeNewField(self):
+        field = self.paths.field(4, 4)
+        self.world.focus.replace_entity(WALL, 4, 2, 0)
+        new = self.paths.field(4, 4)
+        assert new is not field
+        assert new.distance(4, 0) == 12
+
+    def TestField_WallAddedOutOfReach_KeepField(self):
+        room = self.world['split'] = make_room('split', ['..#..'] * 3)
+        field = self.paths.field(0, 0, 'split')
+        room.replace_entity(WALL, 4, 1, 0)
+        assert self.paths.field(0, 0, 'split') is field
+
+    def TestRoute_RoomsLinkedInLine_PassThroughEachPortal(self):
+        assert self.paths.route('room0', 'room2') == [
+            ('room0', (4, 2)), ('room1', (4, 0))]
+        assert self.paths.route('room0', 'room0') == []
+
+    def TestRoute_NoWay_ReturnNone(self):
+        self.world['lonely'] = make_room('lonely')
+        assert self.paths.route('room0', 'lonely') is None
+
+
+def TestPursue_TwoEntitiesGiveChase_ShareFieldAndCatchUp():
+    room = make_room()
+    w = world.World({'room': room}, {'room': {}}, 'room')
+    player = MockEntity('player', walkable=False)
+    w.add_entity(player, 4, 4, 1)
+    def plot():
+        while True:
+            yield
+    plt = plot()
+    plt.next()
+    session = Session(w, player, plt, set())
+    chasers = [MockEntity('imp', walkable=False) for i in xrange(2)]
+    w.add_entity(chasers[0], 0, 4, 1)
+    w.add_entity(chasers[1], 4, 0, 1)
+    for chaser in chasers:
+        session.scheduler.add(chaser, action.Pursue())
+    for i in xrange(12):
+        session.tick()
+    assert set(room.get_coords(c)[:2] for c in chasers) == set(
+        [(3, 4), (4, 3)])
+    assert len(session.paths.fields) == 1
@@ -0,0 +1,81 @@
+import pyglet
+from nose.tools import *
+
+from crystals import quads
+from crystals import view
+from crystals.test.util import *
+
+
+class TestQuadBuffer(object):
+
+    def setup(self):
+        self.batch = pyglet.graphics.Batch()
+        self.buffer = quads.QuadBuffer(self.batch, None, 24, capacity=2)
+        self.tex_coords = tuple(float(i) for i in xrange(12))
+
+    def TestAdd_QuadAdded_CopyQuadToVertexListOnFlush(self):
+        i = self.buffer.add(10, 20, self.tex_coords)
+        assert list(self.buffer.vertex_list.vertices[i * 8:i * 8 + 8]) == [
+            0] * 8
+        self.buffer.flush()
+        assert list(self.buffer.vertex_list.vertices[i * 8:i * 8 + 8]) == [
+            10, 20, 34, 20, 34, 44, 10, 44]
+        assert tuple(self.buffer.vertex_list.tex_coords[
+            i * 12:i * 12 + 12]) == self.tex_coords
+
+    def TestAdd_BufferFull_GrowVertexList(self):
+        for n in xrange(3):
+            self.buffer.add(n, n, self.tex_coords)
+        self.buffer.flush()
+        assert len(self.buffer) == 3
+        assert self.buffer.capacity == 4
+        assert list(self.buffer.vertex_list.vertices[16:24]) == [
+            2, 2, 26, 2, 26, 26, 2, 26]
+        assert list(self.buffer.vertex_list.colors) == [255] * 64
+
+    def TestRemove_QuadRemoved_CollapseQuadAndReuseIndex(self):
+        i = self.buffer.add(10, 20, self.tex_coords)
+        self.buffer.flush()
+        self.buffer.remove(i)
+        self.buffer.flush()
+        assert list(self.buffer.vertex_list.vertices[i * 8:i * 8 + 8]) == [
+            0] * 8
+        assert self.buffer.add(0, 0, self.tex_coords) == i
+
+
+class TestSpriteBuffers(object):
+
+    def setup(self):
+        self.batch = pyglet.graphics.Batch()
+        self.buffers = quads.SpriteBuffers(self.batch, 24)
+        self.image = view.tiles.image('cow.png')
+
+    def TestSprite_SameGroupAndTexture_ShareOneBuffer(self):
+        group = view.layer_group(0)
+        sprites = [self.buffers.sprite(self.image, group) for i in xrange(3)]
+        assert len(self.buffers.buffers) == 1
+        buffer, = self.buffers.buffers.values()
+        assert len(buffer) == 3
+        assert buffer.group.parent is group
+
+    def TestSetPosition_FlushCalled_MoveQuad(self):
+        sprite = self.buffers.sprite(self.image)
+        sprite.set_position(48, 72)
+        self.buffers.flush()
+        buffer, = self.buffers.buffers.values()
+        assert (sprite.x, sprite.y) == (48, 72)
+        assert list(buffer.vertex_list.vertices[:8]) == [
+            48, 72, 72, 72, 72, 96, 48, 96]
+
+    def TestSetGroup_OtherGroupGiven_MoveQuadToItsBuffer(self):
+        sprite = self.buffers.sprite(self.image, view.layer_group(0))
+        sprite.group = view.layer_group(1)
+        assert len(self.buffers.buffers) == 2
+        assert [len(b) for b in self.buffers.buffers.values()] in (
+            [0, 1], [1, 0])
+
+    def TestDelete_RemoveQuad(self):
+        sprite = self.buffers.sprite(self.image)
+        sprite.delete()
+        buffer, = self.buffers.buffers.values()
+        assert len(buffer) == 0
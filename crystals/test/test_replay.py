@@ -0,0 +1,69 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from nose.tools import *
+
+from crystals import replay
+from crystals import save
+from crystals.api import action
+from crystals.world import Entity
+from crystals.test.util import *
+
+
+class TestReplay(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.path, 'log')
+        self.recorder = replay.Recorder(WORLD_PATH, PLOT_PATH, IMG_PATH,
+                                        seed=1, budget=1)
+        self.session = replay.start(self.recorder.header)
+        self.session.recorder = self.recorder
+
+    def teardown(self):
+        # Reload the world scripts, so that entity actions start afresh
+        for name in ('atlas', 'entities', 'actions', 'plot'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.path)
+
+    def _play(self, commands):
+        for command in commands:
+            self.session.command(command)
+            self.session.tick()
+            self.session.tick()
+        self.recorder.write(self.log_path)
+        for name in ('atlas', 'entities', 'actions', 'plot'):
+            sys.modules.pop(name, None)
+        return replay.load_log(self.log_path)
+
+    def TestReplay_GameRecorded_EndInSameState(self):
+        log = self._play(['interact', 'interact', 'right', 'down'])
+        assert not replay.changed_scripts(log)
+        session = replay.start(log)
+        times = replay.replay(session, log)
+        assert len(times) == 8
+        assert session.world.focus.name == 'BlueRoom'
+        assert save.record(session) == save.record(self.session)
+
+    def TestStart_BudgetRecorded_LoadWorldWithIt(self):
+        assert self.recorder.header['budget'] == 1
+        assert self.session.world.budget == 1
+
+    def _add_imps(self, session):
+        for x in (1, 3):
+            imp = Entity('imp', False, 'imp.png')
+            session.world.add_entity(imp, x, 3, 1)
+            session.scheduler.add(imp, action.Talk('imp%d' % x))
+
+    def TestReplay_StepCutShortByBudget_CutItAtSamePlace(self):
+        self._add_imps(self.session)
+        self.session.scheduler.budget = -1
+        log = self._play([None])
+        assert log['cuts'] == [[1, 1], [2, 1]]
+
+        session = replay.start(log)
+        self._add_imps(session)
+        replay.replay(session, log)
+        assert session.infobox == self.session.infobox == ['imp1', 'imp3']
@@ -0,0 +1,186 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import Queue
+
+from nose.tools import *
+
+from crystals import loader
+from crystals import save
+from crystals.api import action
+from crystals.api import plot
+from crystals.session import Session
+from crystals.world import Entity
+from crystals.test.util import *
+
+
+def TestActionIter_StateRestored_CarryOnFromThere():
+    calls = []
+    talk = lambda text: lambda session, entity: calls.append(text)
+    actions = [action.ActionIter(talk('a'), action.ActionLoop(
+        talk('b'), talk('c'))) for i in xrange(2)]
+    for i in xrange(3):
+        actions[0](None, None)
+    actions[1].restore(actions[0].state())
+    del calls[:]
+    actions[0](None, None)
+    actions[1](None, None)
+    assert calls == ['b', 'b']
+
+
+def TestResetAction_PlainFunctionGiven_HaveNoState():
+    reset = action.ResetAction(lambda session, entity: None)
+    assert reset.state() is None
+    reset.restore(reset.state())
+
+
+class TestSave(object):
+
+    def setup(self):
+        self.save_path = os.path.join(tempfile.mkdtemp(), 'save')
+        self.session = self._session()
+
+    def teardown(self):
+        shutil.rmtree(os.path.dirname(self.save_path))
+
+    def _session(self):
+        # Reload the world scripts, so that entity actions start afresh
+        for name in ('atlas', 'entities', 'actions', 'plot'):
+            sys.modules.pop(name, None)
+        world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+        plot, plot_state = loader.load_plot(PLOT_PATH)
+        return Session(world, player, plot, plot_state)
+
+    def TestRecord_NothingChanged_RecordOnlyThePlayersCell(self):
+        saved = save.record(self.session)
+        assert saved['rooms'].keys() == ['RedRoom']
+        assert saved['rooms']['RedRoom'].keys() == [(2, 2)]
+        assert not saved['entities']
+
+    def TestRecord_CacheGiven_ReuseCellsOfUnchangedRooms(self):
+        cache = {}
+        first = save.record(self.session, cache=cache)
+        second = save.record(self.session, cache=cache)
+        assert second['rooms']['RedRoom'] is first['rooms']['RedRoom']
+        self.session.step_player(0, 1)
+        third = save.record(self.session, cache=cache)
+        assert third['rooms']['RedRoom'] is not first['rooms']['RedRoom']
+        assert third == save.record(self.session)
+
+    def TestAutosaver_SavesQueued_WriteInBackground(self):
+        autosaver = save.Autosaver(self.session, self.save_path)
+        autosaver.save()
+        self.session.step_player(0, 1)
+        autosaver.save()
+        autosaver.flush()
+        assert not autosaver.error
+        session = self._session()
+        assert save.load_game(session, self.save_path)
+        assert save.record(session) == save.record(self.session)
+
+    def TestAutosaver_WriteFails_KeepErrorAndCarryOn(self):
+        autosaver = save.Autosaver(self.session, self.save_path)
+        self.session.plot_updates.append(lambda: None)
+        autosaver.save()
+        autosaver.flush()
+        assert autosaver.error
+        assert not os.path.exists(self.save_path)
+        self.session.plot_updates = []
+        autosaver.save()
+        autosaver.flush()
+        assert os.path.exists(self.save_path)
+
+    def TestAutosaver_Stopped_WriteQueuedSavesAndEnd(self):
+        autosaver = save.Autosaver(self.session, self.save_path)
+        autosaver.save()
+        autosaver.stop()
+        autosaver.worker.join(1)
+        assert not autosaver.worker.is_alive()
+        assert save.read_save(self.save_path)
+
+    def TestAutosaver_WorkerStopped_FlushWithoutWaiting(self):
+        autosaver = save.Autosaver(self.session, self.save_path)
+        autosaver.worker = threading.Thread()
+        autosaver.queue = Queue.Queue()
+        autosaver.queue.put(None)
+        autosaver.flush()
+        assert autosaver.queue.unfinished_tasks
+
+    def TestTick_TriggerPortalsPlayer_AutosaveAfterThePlot(self):
+        called = []
+        def trigger(session):
+            session.step_player(1, 0)
+            session.update_plot('Portalled')
+        self.session.plot = plot.plot(set(), {
+            ('Go',): (trigger, {}),
+            ('Portalled',): (called.append, {}),
+            ('Never',): (None, {})})
+        self.session.plot.send(self.session)
+        self.session.autosaver = save.Autosaver(
+            self.session, self.save_path)
+        self.session.update_plot('Go')
+        self.session.tick()
+        self.session.autosaver.flush()
+        assert self.session.world.focus.name == 'BlueRoom'
+        assert called == [self.session]
+        assert not self.session.autosaver.error
+        assert save.read_save(self.save_path)
+
+    def TestLoadGame_GameSaved_RestoreWorldAndPlot(self):
+        self.session.interact()
+        self.session.interact()
+        self.session.tick()
+        self.session.step_player(1, 0)
+        save.save_game(self.session, self.save_path, 'digest')
+
+        session = self._session()
+        assert not save.load_game(session, self.save_path, 'other')
+        assert save.load_game(session, self.save_path, 'digest')
+        room = session.world.focus
+        assert room.get_coords(session.player)[:2] == (3, 3)
+        assert room.get_coords(room.uniques['troll'])[:2] == (2, 2)
+        assert 'CheckTroll' in session.plot_state
+        assert save.record(session) == save.record(self.session)
+
+    def TestLoadGame_TriggersChanged_ChangeNothing(self):
+        self.session.interact()
+        self.session.step_player(1, 0)
+        save.save_game(self.session, self.save_path)
+
+        session = self._session()
+        session.plot = plot.plot(set(), {('Other',): (None, {})})
+        session.plot.send(session)
+        fresh = save.record(session)
+        assert not save.load_game(session, self.save_path)
+        assert session.world.focus.name == 'RedRoom'
+        assert save.record(session) == fresh
+
+    def TestLoadGame_EntityAdded_RestoreItsAction(self):
+        act = action.ActionIter(action.Move(0, 1), action.ActionLoop(
+            action.Alert('a'), action.Alert('b')))
+        act.restore((1, (None, (1, ()))))
+        imp = Entity('imp', True, 'cow.png', act)
+        self.session.world.add_entity(imp, 1, 1)
+        x, y, z = self.session.world.focus.get_coords(imp)
+        save.save_game(self.session, self.save_path)
+
+        session = self._session()
+        assert save.load_game(session, self.save_path)
+        imp = session.world.focus[y][x][z]
+        assert imp.name == 'imp'
+        assert imp.action.state() == (1, (None, (1, (None, None))))
+
+    def TestLoadGame_RoomEvicted_RestoreItFromSnapshot(self):
+        self.session.world.budget = 1
+        self.session.interact()
+        self.session.step_player(1, 0)
+        assert not self.session.world.isloaded('RedRoom')
+        save.save_game(self.session, self.save_path)
+
+        session = self._session()
+        assert save.load_game(session, self.save_path)
+        assert session.world.focus.name == 'BlueRoom'
+        troll = session.world['RedRoom'].uniques['troll']
+        assert troll.action.state() == (1, (None, None, None))
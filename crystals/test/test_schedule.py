@@ -0,0 +1,119 @@
+from nose.tools import *
+
+from crystals import world
+from crystals.api import action
+from crystals.schedule import Scheduler
+from crystals.session import Session
+from crystals.test.test_world import MockEntity, WorldTestCase
+from crystals.test.util import *
+
+
+class TestScheduler(WorldTestCase):
+
+    def setup(self):
+        WorldTestCase.setup(self)
+        self.rooms = [self.roomgen.next() for i in xrange(2)]
+        self.world = world.World(
+            dict((room.name, room) for room in self.rooms),
+            {'room0': {'room1': (1, 2)}, 'room1': {'room0': (1, 1)}},
+            'room0')
+        self.session = Session(self.world, None, self._plot(), set())
+        self.scheduler = self.session.scheduler
+        self.calls = []
+
+    def _plot(self):
+        def plot():
+            while True:
+                yield
+        plot = plot()
+        plot.next()
+        return plot
+
+    def _act(self, session, entity):
+        self.calls.append((self.scheduler.ticks, entity))
+
+    def _entity(self, room='room0'):
+        entity = MockEntity()
+        self.world.add_entity(entity, 1, 1, 1, room)
+        return entity
+
+    def TestStep_ActionAdded_CallItEveryInterval(self):
+        entity = self._entity()
+        self.scheduler.add(entity, self._act, interval=3)
+        for i in xrange(7):
+            self.session.tick()
+        assert self.calls == [(1, entity), (4, entity), (7, entity)]
+
+    def TestStep_OverBudget_CallLeftoverActionsOnNextStep(self):
+        self.scheduler.budget = -1
+        entities = [self._entity() for i in xrange(3)]
+        for entity in entities:
+            self.scheduler.add(entity, self._act, interval=10)
+        self.scheduler.step()
+        assert self.scheduler.ran == 1
+        assert self.scheduler.late == 2
+        self.scheduler.step()
+        self.scheduler.step()
+        assert [e for tick, e in self.calls] == entities
+        assert self.scheduler.late == 0
+
+    def TestStep_LimitSet_StopAfterThatManyActions(self):
+        for i in xrange(3):
+            self.scheduler.add(self._entity(), self._act)
+        self.scheduler.limit = 2
+        self.scheduler.step()
+        assert self.scheduler.ran == 2
+        assert self.scheduler.late == 1
+
+    def TestStep_EntityOutsideFocus_SetAsideUntilFocusIsItsRoom(self):
+        entity = self._entity('room1')
+        self.scheduler.add(entity, self._act, room='room1')
+        for i in xrange(5):
+            self.scheduler.step()
+        assert not self.calls
+        assert self.scheduler.asleep == 1
+        self.world.set_focus('room1')
+        self.scheduler.step()
+        assert self.calls == [(6, entity)]
+        assert self.scheduler.asleep == 0
+
+    def TestStep_EntityLeftItsRoom_ForgetIt(self):
+        entity = self._entity()
+        self.scheduler.add(entity, self._act)
+        self.world.pop_entity(1, 1, 1)
+        self.scheduler.step()
+        assert not self.calls
+        assert not len(self.scheduler)
+
+    def TestStep_RoomEvictedAndReentered_CallRebuiltEntitysAction(self):
+        entity = self._entity('room1')
+        self.scheduler.add(entity, self._act, room='room1')
+        self.world.budget = 1
+        self.world['room0']
+        assert not self.world.isloaded('room1')
+        self.scheduler.step()
+        self.world.set_focus('room1')
+        self.scheduler.step()
+        rebuilt = self.world.focus[1][1][1]
+        assert rebuilt is not entity
+        assert self.calls == [(2, rebuilt)]
+        self.scheduler.remove(rebuilt)
+        assert not len(self.scheduler)
+
+    def TestRemove_ActionAdded_StopCallingIt(self):
+        entity = self._entity()
+        self.scheduler.add(entity, self._act)
+        self.scheduler.step()
+        self.scheduler.remove(entity)
+        self.scheduler.step()
+        assert self.calls == [(1, entity)]
+
+    def TestScheduleAction_EntityGiven_MoveItOnItsOwn(self):
+        entity = self._entity()
+        action.Schedule(action.ActionLoop(
+            action.Move(0, 1), action.Move(0, -1)), 2)(self.session, entity)
+        self.session.tick()
+        assert self.world.focus.get_coords(entity)[:2] == (1, 2)
+        self.session.tick()
+        self.session.tick()
+        assert self.world.focus.get_coords(entity)[:2] == (1, 1)
@@ -0,0 +1,170 @@
+import sys
+
+from nose.tools import *
+
+from crystals import loader
+from crystals import world
+from crystals.api import plot
+from crystals.session import Session, TextLog, Ticker
+from crystals.test.test_world import MockEntity, WorldTestCase
+from crystals.test.util import *
+
+
+def TestTextLog_TextWritten_KeepText():
+    log = TextLog()
+    log.write('hello')
+    log.write('world')
+    assert log == ['hello', 'world']
+
+
+class TestTicker(object):
+
+    def setup(self):
+        self.ticks = []
+        self.ticker = Ticker(lambda: self.ticks.append(None), 10, 5)
+
+    def TestAdvance_TicksDue_RunThemAndKeepTheRemainder(self):
+        assert self.ticker.advance(0.25) == 2
+        assert len(self.ticks) == 2
+        assert_almost_equal(self.ticker.alpha, 0.5)
+
+    def TestAdvance_LessThanATick_WaitForMore(self):
+        for i in xrange(3):
+            assert self.ticker.advance(0.05) == i % 2
+        assert len(self.ticks) == 1
+
+    def TestAdvance_TooManyTicksDue_DropAllButMaxCatchup(self):
+        assert self.ticker.advance(2.0) == 5
+        assert self.ticker.dropped == 15
+        assert self.ticker.advance(0.1) == 1
+
+
+class TestSession(WorldTestCase):
+
+    def setup(self):
+        WorldTestCase.setup(self)
+
+        self.room1 = self.roomgen.next()
+        self.room2 = self.roomgen.next()
+        self.rooms = {self.room1.name: self.room1, self.room2.name: self.room2}
+        self.portals = {
+            self.room1.name: {
+                self.room2.name: (1, 2)},
+            self.room2.name: {
+                self.room1.name: (1, 1)}}
+
+        self.world = world.World(self.rooms, self.portals, self.room2.name)
+        self.player = world.Entity(
+            'player', False, 'cow.png', facing=(0, -1))
+        self.world.add_entity(self.player, 1, 1, 1)
+
+        self.sent = []
+        def mockplot():
+            while True:
+                self.sent.append((yield))
+        plot = mockplot()
+        plot.next()
+        self.session = Session(self.world, self.player, plot, set())
+
+    def TestInit_NoInfoBoxGiven_WriteToTextLog(self):
+        assert isinstance(self.session.infobox, TextLog)
+
+    def TestInit_SendSessionToPlot(self):
+        assert self.sent == [self.session]
+
+    def TestStepPlayer_NoPortalAtDest_MovePlayerGivenDistance(self):
+        self.session.step_player(0, 1)
+        assert self.room2[2][1][1] is self.player
+
+    def TestStepPlayer_PortalAtDest_MovePlayerToPortalDest(self):
+        self.session.step_player(0, 1)
+        self.session.step_player(0, -1)
+        assert self.room2[1][1][1] is not self.player
+        assert self.room1[2][1][1] is self.player
+        assert self.world.focus is self.room1
+
+    def TestUpdatePlot_UpdatesGiven_QueueWithoutSending(self):
+        self.session.update_plot('State1')
+        self.session.update_plot(('State2', 'State3'))
+        assert self.sent == [self.session]
+        assert self.session.plot_updates == ['State1', 'State2', 'State3']
+
+    def TestStepPlot_UpdatesQueued_SendAllAtOnce(self):
+        self.session.update_plot('State1')
+        self.session.update_plot(('State2', 'State3'))
+        self.session.step_plot()
+        updates, = self.sent[1:]
+        assert [u for u in updates if not isinstance(u, plot.EntityUpdate)
+                ] == ['State1', 'State2', 'State3']
+        assert self.session.plot_updates == []
+
+    def TestStepPlot_UniqueEntityMoved_SendEntityUpdates(self):
+        self.session.step_plot()
+        entity = MockEntity()
+        self.world.add_entity(entity, 1, 1, 0)
+        self.world.step_entity(entity, 0, 1)
+        self.session.step_plot()
+        updates = [u for u in self.sent[2] if u.entity is entity]
+        assert updates == [
+            plot.EntityUpdate(self.room2.name, entity, True),
+            plot.EntityUpdate(self.room2.name, entity, False),
+            plot.EntityUpdate(self.room2.name, entity, True)]
+
+    def TestStepPlot_TriggerQueuesUpdates_SendThemInSameStep(self):
+        called = []
+        self.session.plot = plot.plot(set(), {
+            ('State1',): (lambda app: app.update_plot('State2'), {}),
+            ('State2',): (called.append, {}),
+            ('Never',): (None, {})})
+        self.session.plot.send(self.session)
+        self.session.update_plot('State1')
+        self.session.step_plot()
+        assert called == [self.session]
+
+    def TestAdvance_TickDue_SendQueuedPlotUpdates(self):
+        self.session.update_plot('State1')
+        self.session.advance(self.session.ticker.period)
+        assert 'State1' in self.sent[1]
+
+    def TestCommand_CommandsGiven_HandleOnePerTick(self):
+        self.session.command('up')
+        self.session.command('left')
+        assert self.room2[1][1][1] is self.player
+        self.session.tick()
+        assert self.room2[2][1][1] is self.player
+        assert self.session.inputs == ['left']
+        self.session.tick()
+        assert self.session.inputs == []
+        assert self.session.ticks == 2
+
+    def TestInteract_EntityWithActionInFront_RunAction(self):
+        def action(session, entity):
+            session.infobox.write(entity.name)
+        self.room2.replace_entity(MockEntity('sign', action=action), 1, 0, 1)
+        self.session.interact()
+        assert self.session.infobox == ['sign']
+
+
+class TestSession_TestWorld(object):
+
+    def setup(self):
+        # Reload the world scripts, so that entity actions start afresh
+        for name in ('atlas', 'entities', 'actions', 'plot'):
+            sys.modules.pop(name, None)
+        world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+        plot, plot_state = loader.load_plot(PLOT_PATH)
+        self.session = Session(world, player, plot, plot_state)
+
+    def TestInteract_PlotUpdatedByAction_CallTriggerOnStepPlot(self):
+        world = self.session.world
+        self.session.interact()
+        self.session.interact()
+        assert self.session.infobox == ['I like shorts.',
+                                        "Don't you, punk?!"]
+        assert world.focus.get_coords(self.session.player)[:2] == (2, 2)
+
+        self.session.step_plot()
+        assert 'CheckTroll' in self.session.plot_state
+        assert world.focus.get_coords(self.session.player)[:2] == (2, 3)
+        assert world.focus.get_coords(world.get_entity('troll'))[:2] == (
+            2, 2)
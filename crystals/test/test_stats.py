@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from crystals.stats import FrameStats, Histogram
+
+
+class TestHistogram(object):
+
+    def setup(self):
+        self.histogram = Histogram(size=4)
+
+    def TestAdd_MoreThanSizeAdded_KeepOnlyLatest(self):
+        for ms in (50, 1, 2, 3, 4):
+            self.histogram.add(ms / 1000.0)
+        assert len(self.histogram) == 4
+        assert self.histogram.count == 5
+        assert_almost_equal(self.histogram.summary()['max'], 4)
+
+    def TestPercentile_SamplesAdded_ReturnSampleAtPercentile(self):
+        for ms in (4, 1, 3, 2):
+            self.histogram.add(ms / 1000.0)
+        assert self.histogram.percentile(50) == 0.003
+        assert self.histogram.percentile(100) == 0.004
+        assert Histogram().percentile(50) == 0
+
+    def TestCounts_SamplesAdded_CountSamplesInEachBucket(self):
+        for seconds in (0.0005, 0.001, 0.003, 1):
+            self.histogram.add(seconds)
+        assert self.histogram.counts((0.001, 0.002, 0.004)) == [2, 0, 1, 1]
+
+
+class TestFrameStats(object):
+
+    def setup(self):
+        self.stats = FrameStats()
+
+    def TestTimed_FunctionCalled_AddTimeTaken(self):
+        func = self.stats.timed('func', lambda x: x * 2)
+        assert func(2) == 4
+        assert len(self.stats['func']) == 1
+
+    def TestFrame_KeyHandled_AddLatencyFromPress(self):
+        self.stats.press()
+        self.stats.press()
+        self.stats.handle()
+        pressed = self.stats.handled[0]
+        self.stats.frame(pressed + 0.05)
+        assert_almost_equal(self.stats['latency'].samples[0], 0.05)
+        assert len(self.stats.pressed) == 1
+        assert not self.stats.handled
+
+    def TestDump_PathGiven_WriteSummaryAsJson(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.stats.add('draw', 0.002)
+            self.stats.dump(os.path.join(path, 'stats.json'))
+            with open(os.path.join(path, 'stats.json')) as f:
+                summary = json.load(f)
+        finally:
+            shutil.rmtree(path)
+        assert summary['draw']['count'] == 1
+        assert_almost_equal(summary['draw']['mean'], 2)
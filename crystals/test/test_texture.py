@@ -0,0 +1,27 @@
+import pyglet
+from nose.tools import *
+
+from crystals import texture
+from crystals.view import TILE_SIZE
+from crystals.test.util import *
+
+
+class TestTileAtlas(object):
+
+    def setup(self):
+        self.tiles = texture.TileAtlas(TILE_SIZE)
+
+    def TestImage_NameNotInAtlas_AddScaledImage(self):
+        image = self.tiles.image('cow.png')
+        assert 'cow.png' in self.tiles
+        assert image.width == TILE_SIZE
+        assert image.height == TILE_SIZE
+
+    def TestImage_NameInAtlas_ReturnSameImage(self):
+        assert self.tiles.image('cow.png') is self.tiles.image('cow.png')
+
+    def TestPack_ManyNamesGiven_ShareOneTexture(self):
+        names = ['cow.png', 'troll.png', 'sack.png', 'floor-a-red.png']
+        self.tiles.pack(names)
+        assert len(set(self.tiles.image(name).id for name in names)) == 1
+        assert len(self.tiles.textures) == 1
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from nose.tools import *
+
+from crystals import loader
+from crystals import trace
+from crystals.test.util import *
+
+
+class TestTrace(object):
+
+    def teardown(self):
+        trace.stop()
+
+    def TestSpan_NotTracing_RecordNothing(self):
+        with trace.span('idle'):
+            pass
+        trace.start()
+        assert trace.stop() == []
+        assert not trace.tracing()
+
+    def TestSpan_SpansNested_InnerWithinOuter(self):
+        trace.start()
+        with trace.span('outer', room='room'):
+            with trace.span('inner', 'test'):
+                pass
+        inner, outer = trace.stop()
+        assert (outer['name'], outer['ph'], outer['cat']) == (
+            'outer', 'X', trace.CATEGORY)
+        assert outer['args'] == {'room': 'room'}
+        assert inner['cat'] == 'test'
+        assert outer['ts'] <= inner['ts']
+        assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+    def TestTraced_FunctionRaises_RecordSpanAndRaise(self):
+        @trace.traced()
+        def fail():
+            raise ValueError
+        trace.start()
+        assert_raises(ValueError, fail)
+        assert [e['name'] for e in trace.stop()] == ['fail']
+
+    def TestTraced_CalledOnAnotherThread_RecordThread(self):
+        func = trace.traced('work')(lambda: None)
+        trace.start()
+        worker = threading.Thread(target=func)
+        worker.start()
+        worker.join()
+        func()
+        events = trace.stop()
+        assert events[0]['tid'] == worker.ident
+        assert events[1]['tid'] == threading.current_thread().ident
+
+    def TestWrite_EventsRecorded_WriteChromeTraceJSON(self):
+        path = tempfile.mkdtemp()
+        try:
+            trace.start()
+            with trace.span('span'):
+                pass
+            trace.write(os.path.join(path, 'trace.json'), trace.stop())
+            with open(os.path.join(path, 'trace.json')) as f:
+                written = json.load(f)
+            assert [e['name'] for e in written['traceEvents']] == ['span']
+        finally:
+            shutil.rmtree(path)
+
+
+def TestLoadWorld_Tracing_RecordLoadingAndRoomBuilds():
+    trace.start()
+    try:
+        world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+        world.set_focus()
+    finally:
+        events = trace.stop()
+        for name in ('atlas', 'entities'):
+            sys.modules.pop(name, None)
+    names = [e['name'] for e in events]
+    assert 'load_world' in names
+    assert 'build_room' in names
+    assert 'World.set_focus' in names
+    load = events[names.index('load_world')]
+    assert all(load['ts'] <= e['ts'] for e in events
+               if e['name'] == 'build_room')
@@ -0,0 +1,280 @@
+import pyglet
+from nose.tools import *
+
+from crystals import quads
+from crystals import view
+from crystals import world
+from crystals.view import TILE_SIZE, CHUNK_SIZE
+from crystals.test.test_world import MockEntity, WorldTestCase
+from crystals.test.util import *
+
+
+def TestPrepareSprite_ValidParamsGiven_ScaleImage():
+    image = pyglet.image.load('cow.png', file=pyglet.resource.file('cow.png'))
+    sprite = pyglet.sprite.Sprite(image.get_texture())
+
+    image = sprite.image
+    assert image.width != TILE_SIZE
+    assert image.height != TILE_SIZE
+    view.prepare_sprite(sprite)
+    assert image.width == TILE_SIZE
+    assert image.height == TILE_SIZE
+
+
+def TestLayerGroup_SameZ_ReturnSameGroup():
+    assert view.layer_group(1) is view.layer_group(1)
+    assert view.layer_group(1).order == 1
+
+
+def TestLayerGroup_ParentGiven_ReturnGroupPerParent():
+    camera = view.Camera()
+    assert view.layer_group(1, camera) is view.layer_group(1, camera)
+    assert view.layer_group(1, camera) is not view.layer_group(1)
+    assert view.layer_group(1, camera).parent is camera
+
+
+class TestCamera(object):
+
+    def setup(self):
+        self.camera = view.Camera(0, 0, 10 * TILE_SIZE, 6 * TILE_SIZE)
+        self.room = world.Room('room', [[[None]] * 100] * 50)
+
+    def TestCenter_TileInMiddleOfRoom_ScrollToPutTileInMiddle(self):
+        self.camera.center(50, 25, self.room)
+        assert self.camera.scroll_x == 50 * TILE_SIZE - 4.5 * TILE_SIZE
+        assert self.camera.scroll_y == 25 * TILE_SIZE - 2.5 * TILE_SIZE
+
+    def TestCenter_TileNearEdgeOfRoom_DontScrollPastEdge(self):
+        self.camera.center(1, 49, self.room)
+        assert self.camera.scroll_x == 0
+        assert self.camera.scroll_y == 44 * TILE_SIZE
+
+    def TestChunks_ReturnChunksInViewportAndMargin(self):
+        self.camera.center(50, 25, self.room)
+        x, y = 45 // CHUNK_SIZE, 22 // CHUNK_SIZE
+        assert self.camera.chunks(self.room, margin=0) == set(
+            (cx, cy) for cx in xrange(x, 55 // CHUNK_SIZE + 1)
+            for cy in xrange(y, 28 // CHUNK_SIZE + 1))
+        assert (x - 1, y - 1) in self.camera.chunks(self.room, margin=1)
+
+
+class TestRoomView(WorldTestCase):
+
+    def setup(self):
+        WorldTestCase.setup(self)
+        self.room = self.roomgen.next()
+        self.batch = pyglet.graphics.Batch()
+        self.view = view.RoomView(self.room, self.batch)
+
+    def _sprite_matches_coords(self, sprite, x, y, z):
+        return (sprite.x == x * TILE_SIZE and
+                sprite.y == y * TILE_SIZE and
+                sprite.group is view.layer_group(z, self.view.camera) and
+                sprite.batch is self.batch)
+
+    def TestInit_DrawEveryEntityAtItsCoords(self):
+        assert self.room.view is self.view
+        for entity, x, y, z in self.room._iter_entities():
+            sprite = self.view.sprites[entity]
+            assert self._sprite_matches_coords(sprite, x, y, z)
+
+    def TestInit_TilesInRoom_BakeTilesIntoVertexListPerLayer(self):
+        tile = world.Tile('floor', True, 'cow.png', None)
+        self.room.replace_entity(tile, 1, 1, 0)
+        self.room.replace_entity(tile, 2, 1, 0)
+        self.room.replace_entity(tile, 2, 1, 1)
+        self.view.delete()
+        self.view = view.RoomView(self.room, self.batch)
+        baked = self.view.baked[(0, 0)]
+        assert len(baked) == 2
+        group = view.layer_group(0, self.view.camera)
+        vertex_list, = [vl for vl in baked if vl.group.parent is group]
+        assert list(vertex_list.vertices) == [
+            24, 24, 48, 24, 48, 48, 24, 48, 48, 24, 72, 24, 72, 48, 48, 48]
+        assert vertex_list.group.texture.id == view.tiles.image('cow.png').id
+
+    def TestUpdate_EntityMoved_MoveItsSprite(self):
+        entity = self.room.remove_entity(1, 1, 0)
+        self.room.replace_entity(entity, 2, 1, 1)
+        self.room.update()
+        assert self._sprite_matches_coords(self.view.sprites[entity], 2, 1, 1)
+
+    def TestUpdate_EntityRemoved_DeleteItsSprite(self):
+        entity = self.room.remove_entity(1, 1, 0)
+        self.room.update()
+        assert entity not in self.view.sprites
+
+    def TestUpdate_CellsNotChanged_DontTouchTheirSprites(self):
+        sprite = self.view.sprites[self.room[0][0][0]]
+        sprite.set_position(-1, -1)
+        self.room.replace_entity(MockEntity(), 2, 1, 0)
+        self.room.update()
+        assert sprite.x == -1
+
+    def TestUpdate_TileReplacedByEntity_BakeChunkAgain(self):
+        tile = world.Tile('floor', True, 'cow.png', None)
+        self.room.replace_entity(tile, 1, 1, 0)
+        self.room.replace_entity(tile, 2, 1, 0)
+        self.room.update()
+        old, = self.view.baked[(0, 0)]
+        self.room.replace_entity(MockEntity(), 1, 1, 0)
+        self.room.update()
+        new, = self.view.baked[(0, 0)]
+        assert new is not old
+        assert list(new.vertices) == [48, 24, 72, 24, 72, 48, 48, 48]
+
+    def TestUpdate_NoTilesChanged_DontBakeChunkAgain(self):
+        tile = world.Tile('floor', True, 'cow.png', None)
+        self.room.replace_entity(tile, 1, 1, 0)
+        self.room.update()
+        baked = self.view.baked[(0, 0)]
+        self.room.replace_entity(MockEntity(), 2, 1, 0)
+        self.room.update()
+        assert self.view.baked[(0, 0)] is baked
+
+    def TestInterpolate_EntityStepped_DrawItBetweenCells(self):
+        entity = self.room.remove_entity(1, 1, 0)
+        self.room.replace_entity(entity, 2, 1, 0)
+        self.room.update()
+        assert self.view.moving
+        self.view.interpolate(0.5)
+        sprite = self.view.sprites[entity]
+        assert (sprite.x, sprite.y) == (TILE_SIZE * 3 // 2, TILE_SIZE)
+
+    def TestSettle_EntityStepped_PutItInItsCell(self):
+        entity = self.room.remove_entity(1, 1, 0)
+        self.room.replace_entity(entity, 2, 1, 0)
+        self.room.update()
+        self.view.interpolate(0.5)
+        self.view.settle()
+        assert not self.view.moving
+        assert self._sprite_matches_coords(self.view.sprites[entity], 2, 1, 0)
+
+    def TestUpdate_EntityMovedFar_DontGlide(self):
+        entity = self.room.remove_entity(0, 0, 0)
+        self.room.replace_entity(entity, 2, 2, 1)
+        self.room.update()
+        assert not self.view.moving
+
+    def TestUpdate_CellsChanged_Invalidate(self):
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.view.invalidate = invalidate
+        self.room.replace_entity(MockEntity(), 2, 1, 0)
+        self.room.update()
+        assert self.invalidated
+
+    def TestUpdate_NothingChanged_DontInvalidate(self):
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.view.invalidate = invalidate
+        self.room.update()
+        assert not self.invalidated
+
+    def TestDelete_DeleteSpritesAndDetachFromRoom(self):
+        self.view.delete()
+        assert not self.view.sprites
+        assert self.room.view is None
+
+
+class TestRoomView_LargeRoom(object):
+
+    def setup(self):
+        self.room = world.Room('room', [
+            [[MockEntity()] for x in xrange(100)] for y in xrange(100)])
+        self.camera = view.Camera(0, 0, 10 * TILE_SIZE, 10 * TILE_SIZE)
+        self.view = view.RoomView(self.room, pyglet.graphics.Batch(),
+                                  self.camera)
+
+    def TestInit_DrawOnlyChunksNearViewport(self):
+        assert self.view.chunks == self.camera.chunks(self.room)
+        for (x, y, z), entity in self.view.cells.iteritems():
+            assert (x // CHUNK_SIZE, y // CHUNK_SIZE) in self.view.chunks
+        assert len(self.view.sprites) < 100 * 100 / 4
+
+    def TestUpdate_TargetMoved_ScrollAndDrawChunksNowNearViewport(self):
+        target = self.room[0][0][0]
+        self.camera.target = target
+        self.room.remove_entity(0, 0, 0)
+        self.room.replace_entity(target, 90, 90, 0)
+        self.room.update()
+        assert self.view.chunks == self.camera.chunks(self.room)
+        assert (90 // CHUNK_SIZE, 90 // CHUNK_SIZE) in self.view.chunks
+        assert (0, 0) not in self.view.chunks
+        assert self.room[1][1][0] not in self.view.sprites
+        assert self.view.sprites[self.room[89][89][0]].x == 89 * TILE_SIZE
+
+    def TestUpdate_EntityMovedOutOfView_DeleteItsSprite(self):
+        entity = self.room.remove_entity(1, 1, 0)
+        self.room.replace_entity(entity, 90, 90, 0)
+        self.room.update()
+        assert entity not in self.view.sprites
+
+
+class TestWorldView(WorldTestCase):
+
+    def setup(self):
+        WorldTestCase.setup(self)
+        self.rooms = [self.roomgen.next() for i in xrange(2)]
+        self.world = world.World(
+            dict((room.name, room) for room in self.rooms),
+            {'room0': {'room1': (1, 2)}, 'room1': {'room0': (1, 1)}},
+            'room0')
+        self.batch = pyglet.graphics.Batch()
+        self.view = view.WorldView(self.world, self.batch)
+
+    def TestInit_DrawFocusedRoom(self):
+        assert self.world.view is self.view
+        assert self.rooms[0].view is self.view.room_view
+
+    def TestFollow_EntityGiven_CenterCameraOnEntity(self):
+        room = world.Room('big', [[[None] for x in xrange(100)]
+                                  for y in xrange(100)])
+        self.world['big'] = room
+        self.world.set_focus('big')
+        entity = MockEntity()
+        self.world.add_entity(entity, 50, 50, 0)
+        self.view.follow(entity)
+        camera = self.view.camera
+        assert camera.scroll_x == (50 * TILE_SIZE + TILE_SIZE // 2 -
+                                   camera.width // 2)
+
+    def TestInit_BufferedGiven_DrawEntitiesFromBuffers(self):
+        self.view.room_view.delete()
+        self.view = view.WorldView(self.world, self.batch, buffered=True)
+        sprites = self.view.room_view.sprites.values()
+        assert sprites
+        for sprite in sprites:
+            assert isinstance(sprite, quads.BufferedSprite)
+
+    def TestStepEntity_EntityStepped_GlideItsSprite(self):
+        entity = self.rooms[0][1][1][2]
+        sprite = self.view.room_view.sprites[entity]
+        assert self.world.step_entity(entity, 0, 1)
+        assert self.view.room_view.sprites[entity] is sprite
+        assert self.view.moving
+        assert (sprite.x, sprite.y) == (TILE_SIZE, 2 * TILE_SIZE)
+
+    def TestStepEntity_BufferedEntityStepped_MoveItsQuadInPlace(self):
+        self.view.room_view.delete()
+        self.view = view.WorldView(self.world, self.batch, buffered=True)
+        entity = self.rooms[0][1][1][2]
+        sprite = self.view.room_view.sprites[entity]
+        assert self.world.step_entity(entity, 0, 1)
+        assert self.view.room_view.sprites[entity] is sprite
+        assert self.view.moving
+
+    def TestSetFocus_InvalidateGiven_InvalidateOnFocusChange(self):
+        self.view.room_view.delete()
+        self.invalidated = 0
+        def invalidate(): self.invalidated += 1
+        self.view = view.WorldView(self.world, self.batch,
+                                   invalidate=invalidate)
+        self.invalidated = 0
+        self.world.set_focus('room1')
+        assert self.invalidated
+
+    def TestSetFocus_OtherRoomGiven_DrawOnlyThatRoom(self):
+        self.world.set_focus('room1')
+        assert self.rooms[0].view is None
+        assert self.rooms[1].view is self.view.room_view
@@ -1,7 +1,6 @@
 from itertools import count
 from functools import partial
 
-import pyglet
 from nose.tools import *
 
 from crystals import world
@@ -13,15 +12,10 @@ def TestEntity():
                             action=[])
 
 
-class MockEntity(pyglet.sprite.Sprite):
+class MockEntity(world.Entity):
 
     def __init__(self, name='entity', walkable=True, action=None):
-        pyglet.sprite.Sprite.__init__(
-            self, pyglet.resource.image('cow.png'),
-            batch=pyglet.graphics.Batch())
-        self.name = name
-        self.walkable = walkable
-        self.action = action
+        world.Entity.__init__(self, name, walkable, 'cow.png', action)
         self.id = id(self)
 
 
@@ -51,12 +45,8 @@ class WorldTestCase(object):
             self.grid = [
                 [list(row) for row in zip(*rows)]
                  for rows in zip(*self.rm_layers)]
-            self.batch = pyglet.graphics.Batch()
 
-            room = world.Room(self.rm_name, self.grid)
-            room.batch = self.batch
-            room.update()
-            yield room
+            yield world.Room(self.rm_name, self.grid)
 
 
 class TestRoom(WorldTestCase):
@@ -66,19 +56,6 @@ class TestRoom(WorldTestCase):
         assert len(room.uniques) == len([
             0 for row in self.grid for col in row for cell in col if cell])
 
-    def TestUpdateEntity_ValidInputs_UpdateSpriteCoords(self):
-        room = self.roomgen.next()
-        wall = self.Wall()
-        room._update_entity(wall, 2, 1, 0)
-        assert wall.x == world.ORIGIN_X + (2 * world.TILE_SIZE)
-        assert wall.y == world.ORIGIN_Y + world.TILE_SIZE
-
-    def TestUpdateEntity_ValidInputs_UpdateOrderedGroup(self):
-        room = self.roomgen.next()
-        wall = self.Wall()
-        room._update_entity(wall, 2, 1, 0)
-        assert wall.group.order == 0
-
     def TestIsWalkable_GivenWalkableCoords_ReturnTrue(self):
         room = self.roomgen.next()
         assert room.iswalkable(1, 1)
@@ -91,18 +68,31 @@ class TestRoom(WorldTestCase):
         room = self.roomgen.next()
         assert not room.iswalkable(len(room[0]), len(room))
 
-    def TestFocus_UpdateEntitySpritePositionsAndBatches(self):
+    def TestIsWalkable_UnwalkableEntityReplaced_ReturnTrue(self):
         room = self.roomgen.next()
-        room.update()
-        for y in xrange(len(room)):
-            for x in xrange(len(room[y])):
-                for z in xrange(len(room[y][x])):
-                    ent = room[y][x][z]
-                    if ent is None:
-                        continue
-                    assert ent.x == x * world.TILE_SIZE + world.ORIGIN_X
-                    assert ent.y == y * world.TILE_SIZE + world.ORIGIN_Y
-                    assert ent.batch is room.batch
+        room.replace_entity(self.Floor(), 0, 0, 0)
+        assert room.iswalkable(0, 0)
+
+    def TestIsWalkable_UnwalkableEntityAdded_ReturnFalse(self):
+        room = self.roomgen.next()
+        room.replace_entity(self.Wall(), 1, 1, 1)
+        assert not room.iswalkable(1, 1)
+
+    def TestIsWalkable_UnwalkableEntityRemoved_ReturnTrue(self):
+        room = self.roomgen.next()
+        room.remove_entity(2, 2, 1)
+        room.remove_entity(2, 2, 2)
+        assert room.iswalkable(2, 2)
+
+    def TestReplaceEntity_WallTileAddedAndRemoved_RecordWallChanges(self):
+        room = self.roomgen.next()
+        room.wall_changes = []
+        wall = world.Tile('wall', False, 'cow.png', None)
+        room.replace_entity(wall, 1, 1, 1)
+        room.replace_entity(self.Wall(), 1, 1, 1)
+        room.replace_entity(self.Wall(), 2, 1, 1)
+        assert room.wall_changes == [(1, 1), (1, 1)]
+        assert not room.walls[1 * room.width + 1]
 
     def TestGetCoords_GivenValidEntity_ReturnEntityCoords(self):
         room = self.roomgen.next()
@@ -111,11 +101,17 @@ class TestRoom(WorldTestCase):
 
         assert (x, y, z) == (0, 0, 0)
 
-    def _group_order_matches_z(self, room, x, y):
-        for z, entity in enumerate(room[y][x]):
-            if entity and entity.group.order != z:
-                return False
-        return True
+    def TestGetCoords_EntityReplacedButNotRendered_ReturnNewCoords(self):
+        room = self.roomgen.next()
+        dummy = MockEntity()
+        room.replace_entity(dummy, 2, 1, 0)
+        assert room.get_coords(dummy) == (2, 1, 0)
+
+    @raises(KeyError)
+    def TestGetCoords_EntityRemoved_RaiseKeyError(self):
+        room = self.roomgen.next()
+        entity_ = room.remove_entity(0, 0, 0)
+        room.get_coords(entity_)
 
     def TestReplaceEntity_EntityAtDest_ReplaceWithNewEntity(self):
         room = self.roomgen.next()
@@ -123,6 +119,55 @@ class TestRoom(WorldTestCase):
         room.replace_entity(dummy, 0, 0, 0)
         assert room[0][0][0] == dummy
 
+    def TestReplaceEntity_UniqueEntityGiven_IndexEntity(self):
+        room = self.roomgen.next()
+        dummy = MockEntity()
+        room.replace_entity(dummy, 0, 0, 0)
+        assert room.uniques[dummy.id] is dummy
+
+    def TestReplaceEntity_UniqueEntityReplaced_UnindexEntity(self):
+        room = self.roomgen.next()
+        old = room[0][0][0]
+        room.replace_entity(MockEntity(), 0, 0, 0)
+        assert old.id not in room.uniques
+        assert old not in room.coords
+
+    def TestSnapshot_SnapshotCalled_RebuildEquivalentRoom(self):
+        room = self.roomgen.next()
+        snapshot = room.snapshot()
+        rebuilt = snapshot()
+        assert rebuilt.name == room.name
+        assert rebuilt is not room
+        for entity, x, y, z in room._iter_entities():
+            assert rebuilt[y][x][z].name == entity.name
+            assert rebuilt[y][x][z].id == entity.id
+        assert set(rebuilt.uniques) == set(room.uniques)
+
+    def TestReplaceEntity_UpdateNotCalled_MarkCellDirty(self):
+        room = self.roomgen.next()
+        room.replace_entity(MockEntity(), 2, 1, 0)
+        assert (2, 1, 0) in room.dirty
+
+    def TestRemoveEntity_TileAtCoords_RemoveTileAndMarkCellDirty(self):
+        room = self.roomgen.next()
+        tile = world.Tile('floor', True, 'cow.png', None)
+        room.replace_entity(tile, 1, 1, 0)
+        room.update()
+        assert room.remove_entity(1, 1, 0) is tile
+        assert room[1][1][0] is None
+        assert (1, 1, 0) in room.dirty
+
+    def TestUpdate_ViewAttached_PassDirtyCellsToView(self):
+        room = self.roomgen.next()
+        updates = []
+        class view:
+            update = staticmethod(lambda cells: updates.append(set(cells)))
+        room.view = view
+        room.replace_entity(MockEntity(), 2, 1, 0)
+        room.update()
+        assert updates == [set([(2, 1, 0)])]
+        assert not room.dirty
+
 
 class TestWorld(WorldTestCase):
 
@@ -152,6 +197,49 @@ class TestWorld(WorldTestCase):
         assert self.world == self.roomdict
         assert self.world.focus == self.rooms[1]
 
+    def TestInit_PortalsGiven_KeepEachRoomsPortalsApart(self):
+        assert self.world.portals_dest2xy == {
+            'room0': {'room1': (1, 2)}, 'room1': {'room0': (1, 1)}}
+        assert self.world.portals_xy2dest == {
+            'room0': {(1, 2): 'room1'}, 'room1': {(1, 1): 'room0'}}
+
+    def TestGetItem_RoomFactoryGiven_BuildRoomOnFirstLookup(self):
+        room = self.roomgen.next()
+        rooms = dict(self.roomdict)
+        rooms[room.name] = lambda: room
+        world_ = world.World(rooms, self.portals, 'room1')
+        assert not world_.isloaded(room.name)
+        assert world_[room.name] is room
+        assert world_.isloaded(room.name)
+
+    def TestTrackChanges_UniqueEntityMoved_RecordChanges(self):
+        entity_ = self.rooms[1][0][0][0]
+        self.world.track_changes()
+        assert ('room1', entity_, True) in self.world.changes
+        del self.world.changes[:]
+        self.world.step_entity(entity_, 1, 2)
+        assert self.world.changes[0] == ('room1', entity_, False)
+        assert self.world.changes[-1] == ('room1', entity_, True)
+
+    def TestGetItem_BudgetExceeded_EvictLeastRecentlyUsedRoom(self):
+        room = self.roomgen.next()
+        rooms = dict(self.roomdict)
+        rooms[room.name] = lambda: room
+        world_ = world.World(rooms, self.portals, 'room1', budget=2)
+        world_[room.name]
+        assert not world_.isloaded('room0')
+        assert world_.isloaded('room1')
+        assert isinstance(dict.__getitem__(world_, 'room0'),
+                          world.RoomSnapshot)
+        assert world_['room0'].name == 'room0'
+
+    def TestSetFocus_BudgetExceeded_EvictRoomLeft(self):
+        world_ = world.World(self.roomdict, self.portals, 'room1',
+                             budget=1)
+        world_.set_focus('room0')
+        assert world_.isloaded('room0')
+        assert not world_.isloaded('room1')
+
     def TestAddEntity_ZIsNone_AddLayerToTopAndPlaceThere(self):
         wall = self.walls[0]()
         x = y = 1
@@ -180,7 +268,7 @@ class TestWorld(WorldTestCase):
         assert len(cell) == depth + 1
         assert cell[1] == floor
 
-    def TestAddEntity_ZInRangeAndEntityAtXYZ_UpdateAboveEntityGroups(self):
+    def TestAddEntity_ZInRangeAndEntityAtXYZ_UpdateAboveEntityCoords(self):
         floor = self.floors[0]()
         x = y = 1
         z = 0
@@ -189,7 +277,20 @@ class TestWorld(WorldTestCase):
 
         for ent in cell:
             if ent:
-                assert ent.group.order == cell.index(ent)
+                assert self.world.focus.get_coords(ent)[2] == cell.index(ent)
+
+    def TestAddEntity_ZInRangeAndEntityAtXYZ_RecordOnlyTheEntityAdded(self):
+        floor = self.floors[0]()
+        x = y = 1
+        room = self.world.focus
+        room.replace_entity(world.Tile('wall', False, 'cow.png', None),
+                            x, y, 1)
+        self.world.track_changes()
+        del self.world.changes[:]
+        room.wall_changes = []
+        self.world.add_entity(floor, x, y, 0)
+        assert self.world.changes == [(room.name, floor, True)]
+        assert room.wall_changes == []
 
     def TestPopEntity_EntityCoordsGiven_RemoveEntity(self):
         self.world.pop_entity(0, 0, 0)
@@ -239,3 +340,9 @@ class TestWorld(WorldTestCase):
 
         x, y, z = self.rooms[0].get_coords(entity_)
         assert self.rooms[0][y][x][z] == entity_
+
+    def TestPortalEntity_UniqueEntityGiven_MoveEntityBetweenUniques(self):
+        entity_ = self.rooms[1][1][1][0]
+        self.world.portal_entity(entity_, 1, 1)
+        assert entity_.id not in self.rooms[1].uniques
+        assert self.rooms[0].uniques[entity_.id] is entity_
@@ -0,0 +1,55 @@
+"""packing of tile images into shared textures"""
+import pyglet
+from pyglet.gl import *
+from pyglet.image.atlas import TextureBin
+
+TEXTURE_SIZE = 1024 # Width and height of each atlas texture, in pixels
+
+
+class TileAtlas(object):
+    """A collection of tile images packed into a few shared textures.
+
+    Each image is loaded from `pyglet.resource` only once, no matter how
+    many entities use it, and texture filtering is set once per texture
+    rather than once per image.
+    """
+
+    def __init__(self, tile_size, texture_size=TEXTURE_SIZE):
+        self.tile_size = tile_size
+        self.bin = TextureBin(texture_size, texture_size)
+        self.images = {}
+        self.textures = set()
+
+    def __contains__(self, name):
+        return name in self.images
+
+    def image(self, name):
+        """Return the image with filename `name`, packing it into the
+        atlas first if it isn't already there.
+        """
+        if name in self.images:
+            return self.images[name]
+
+        file = pyglet.resource.file(name)
+        image = self.bin.add(pyglet.image.load(name, file=file))
+        self.prepare(image)
+        self.images[name] = image
+        return image
+
+    def pack(self, names):
+        """Pack each image with a filename in `names` into the atlas."""
+        for name in names:
+            self.image(name)
+
+    def prepare(self, image):
+        """Scale `image` to the tile size and, if its texture hasn't
+        been seen before, set the texture's filtering.
+        """
+        image.width = self.tile_size
+        image.height = self.tile_size
+        if image.id in self.textures:
+            return
+
+        glBindTexture(image.target, image.id)
+        glTexParameteri(image.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        self.textures.add(image.id)
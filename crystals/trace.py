@@ -0,0 +1,124 @@
+"""tracing of nested spans of time, for profiling without a profiler
+
+Spans are recorded with `span`, a context manager, or `traced`, a
+decorator, but only between calls to `start` and `stop`; the rest of
+the time they cost a global lookup. Traces are written in the Chrome
+trace event format, which chrome://tracing and ui.perfetto.dev open::
+
+    trace.start()
+    world, player = loader.load_world(WORLD_PATH, IMG_PATH)
+    trace.write('load.json', trace.stop())
+
+Spans on each thread nest by time, so a span recorded during another
+shows up beneath it. Nothing here depends on pyglet.
+"""
+import json
+import os
+import threading
+from functools import wraps
+from timeit import default_timer as clock
+
+__all__ = ['start', 'stop', 'tracing', 'span', 'traced', 'write']
+
+CATEGORY = 'crystals' # category of spans not given one
+
+_events = None # Trace events recorded, or None if not tracing
+_origin = 0.0 # Time tracing started
+
+
+def start():
+    """Start recording spans, discarding any recorded so far."""
+    global _events, _origin
+    _origin = clock()
+    _events = []
+
+
+def stop():
+    """Stop recording spans and return the list of trace events
+    recorded.
+    """
+    global _events
+    events, _events = _events, None
+    return events or []
+
+
+def tracing():
+    """Return True if spans are being recorded."""
+    return _events is not None
+
+
+class _Span(object):
+    """A span being recorded, as a context manager."""
+
+    __slots__ = ('name', 'cat', 'args', 'begin')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.begin = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = clock()
+        events = _events
+        if events is not None:
+            event = dict(
+                name=self.name, cat=self.cat, ph='X', pid=os.getpid(),
+                tid=threading.current_thread().ident,
+                ts=(self.begin - _origin) * 1e6,
+                dur=(end - self.begin) * 1e6)
+            if self.args:
+                event['args'] = self.args
+            events.append(event)
+        return False
+
+
+class _NoSpan(object):
+    """Stands in for a span when not tracing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_span = _NoSpan()
+
+
+def span(name, cat=CATEGORY, **args):
+    """Return a context manager that records a span named `name` in
+    category `cat` for as long as it's entered. Keyword arguments are
+    kept with the span, and shown alongside it.
+    """
+    if _events is None:
+        return _no_span
+    return _Span(name, cat, args)
+
+
+def traced(name=None, cat=CATEGORY):
+    """Return a decorator that records a span for each call to the
+    function it decorates, named `name` or after the function.
+    """
+    def decorate(func):
+        span_name = name or func.__name__
+        @wraps(func)
+        def traced_func(*args, **kwargs):
+            if _events is None:
+                return func(*args, **kwargs)
+            with _Span(span_name, cat, None):
+                return func(*args, **kwargs)
+        return traced_func
+    return decorate
+
+
+def write(path, events):
+    """Write the list of trace events `events` to `path` as Chrome trace
+    event JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
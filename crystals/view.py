@@ -0,0 +1,427 @@
+"""rendering of the game world with pyglet"""
+import pyglet
+from pyglet.gl import *
+from pyglet.graphics import OrderedGroup
+
+from crystals import trace
+from crystals.quads import SpriteBuffers
+from crystals.texture import TileAtlas
+from crystals.world import Tile
+
+__all__ = ['Camera', 'RoomView', 'WorldView']
+
+TILE_SIZE = 24 # Width and height of each tile, in pixels
+ORIGIN_X = 10  # X and Y coordinates of the bottom left corner
+ORIGIN_Y = 124 # of room display, in pixels
+VIEW_WIDTH = 380  # Width and height of the room display,
+VIEW_HEIGHT = 266 # in pixels
+CHUNK_SIZE = 8 # Width and height of each chunk of a room, in tiles
+CHUNK_MARGIN = 1 # Chunks drawn beyond each edge of the room display
+
+tiles = TileAtlas(TILE_SIZE) # Shared textures for all entity images
+
+_layer_groups = {}
+
+
+def layer_group(z, parent=None):
+    """Return the OrderedGroup shared by all entities at layer `z` with
+    the given parent group.
+    """
+    if (z, parent) not in _layer_groups:
+        _layer_groups[(z, parent)] = OrderedGroup(z, parent)
+    return _layer_groups[(z, parent)]
+
+
+def entity_image(entity):
+    """Return the image of an entity or tile. If its `image` attribute
+    is a filename, the image is taken from the shared tile atlas.
+    """
+    if isinstance(entity.image, basestring):
+        return tiles.image(entity.image)
+    return entity.image
+
+
+def prepare_sprite(sprite):
+    """Prepare a sprite for the game.
+
+    Images from the shared tile atlas are prepared already; this is only
+    needed for sprites with images loaded elsewhere.
+    """
+    tiles.prepare(sprite.image)
+
+
+class Camera(pyglet.graphics.Group):
+    """A group that shows part of a room through a viewport.
+
+    The viewport is a `width` by `height` rectangle at (x, y) in the
+    window. Sprites in the group are positioned in room pixels, and room
+    pixel (`scroll_x`, `scroll_y`) is drawn at the viewport's bottom left
+    corner. Anything outside the viewport is clipped.
+
+    If the camera has a `target` entity, rooms drawn through it scroll
+    to keep the target in the middle of the viewport.
+    """
+
+    def __init__(self, x=ORIGIN_X, y=ORIGIN_Y, width=VIEW_WIDTH,
+                 height=VIEW_HEIGHT, parent=None):
+        super(Camera, self).__init__(parent)
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.scroll_x = 0
+        self.scroll_y = 0
+        self.target = None
+
+    def set_state(self):
+        glEnable(GL_SCISSOR_TEST)
+        glScissor(self.x, self.y, self.width, self.height)
+        glPushMatrix()
+        glTranslatef(self.x - self.scroll_x, self.y - self.scroll_y, 0)
+
+    def unset_state(self):
+        glPopMatrix()
+        glDisable(GL_SCISSOR_TEST)
+
+    def center(self, x, y, room):
+        """Scroll to put tile (x, y) of `room` in the middle of the
+        viewport, without scrolling past the edges of the room.
+        """
+        max_x = room.width * TILE_SIZE - self.width
+        max_y = room.height * TILE_SIZE - self.height
+        cx = x * TILE_SIZE + (TILE_SIZE - self.width) // 2
+        cy = y * TILE_SIZE + (TILE_SIZE - self.height) // 2
+        self.scroll_x = max(0, min(cx, max_x))
+        self.scroll_y = max(0, min(cy, max_y))
+
+    def chunks(self, room, margin=CHUNK_MARGIN):
+        """Return the set of (x, y) chunks of `room` that are in the
+        viewport or within `margin` chunks of it.
+        """
+        size = CHUNK_SIZE * TILE_SIZE
+        left = max(0, self.scroll_x // size - margin)
+        bottom = max(0, self.scroll_y // size - margin)
+        right = min((room.width - 1) // CHUNK_SIZE,
+                    (self.scroll_x + self.width) // size + margin)
+        top = min((room.height - 1) // CHUNK_SIZE,
+                  (self.scroll_y + self.height) // size + margin)
+        return set((cx, cy) for cx in xrange(left, right + 1)
+                   for cy in xrange(bottom, top + 1))
+
+
+class RoomView(object):
+    """Draws a Room in a pyglet batch, through a Camera.
+
+    Each entity gets a sprite that follows it around the room. Shared
+    tiles never move, so they are baked instead: the tiles on each layer
+    of a chunk are drawn with one vertex list per texture, which is only
+    rebuilt when a tile in that chunk is added or removed. Only the cells
+    that the room reports as changed are redrawn.
+
+    The room is divided into chunks of CHUNK_SIZE by CHUNK_SIZE tiles,
+    and only the chunks near the camera's viewport are drawn, so the
+    cost of drawing a room doesn't grow with its size.
+
+    Entities that step to a neighbouring cell, and the camera following
+    them, glide there rather than jumping: `interpolate` draws them part
+    of the way between where they were before the last logic tick and
+    where they are now, and `settle` finishes their moves.
+
+    If `buffers` is given, it is a `crystals.quads.SpriteBuffers` that
+    entities are drawn from instead of Sprites. If `invalidate` is given,
+    it is called whenever the room changes on screen.
+    """
+
+    def __init__(self, room, batch, camera=None, buffers=None,
+                 invalidate=None):
+        self.room = room
+        self.batch = batch
+        self.camera = Camera() if camera is None else camera
+        self.buffers = buffers
+        if invalidate is not None:
+            self.invalidate = invalidate
+        self.cells = {} # Maps (x, y, z) to the entity drawn there
+        self.sprites = {} # Maps entities to their sprites
+        self.baked = {} # Maps chunks to vertex lists of their tiles
+        self.stale = set() # Chunks whose tiles need baking again
+        self.chunks = set() # (x, y) of chunks being drawn
+        self.scrolled = None # Camera scroll when chunks were last found
+        self.moves = {} # Maps moving sprites to (x, y) from and (x, y) to
+        self.camera_move = None # Camera scroll from and to, if moving
+
+        room.view = self
+        self.scroll()
+
+    def _visible(self, x, y):
+        return (x // CHUNK_SIZE, y // CHUNK_SIZE) in self.chunks
+
+    def _delete_sprite(self, entity):
+        sprite = self.sprites.pop(entity)
+        self.moves.pop(sprite, None)
+        sprite.delete()
+
+    def _update_cell(self, x, y, z):
+        """Redraw cell (x, y, z) to match its entity in the room."""
+        entity = self.room[y][x][z]
+        old = self.cells.pop((x, y, z), None)
+        if isinstance(old, Tile):
+            self.stale.add((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        elif old is not None and old is not entity:
+            # Keep the sprite if the entity moved to another drawn cell
+            coords = self.room.coords.get(old)
+            if coords is None or not self._visible(coords[0], coords[1]):
+                self._delete_sprite(old)
+        if entity is None or not self._visible(x, y):
+            return
+
+        self.cells[(x, y, z)] = entity
+        if isinstance(entity, Tile):
+            self.stale.add((x // CHUNK_SIZE, y // CHUNK_SIZE))
+            return
+
+        image = entity_image(entity)
+        group = layer_group(z, self.camera)
+        sprite = self.sprites.get(entity)
+        if sprite is None and self.buffers is not None:
+            sprite = self.sprites[entity] = self.buffers.sprite(image, group)
+        elif sprite is None:
+            sprite = self.sprites[entity] = pyglet.sprite.Sprite(
+                image, batch=self.batch, group=group)
+        else:
+            if sprite.image is not image:
+                sprite.image = image
+            sprite.group = group
+            self._move(sprite, x * TILE_SIZE, y * TILE_SIZE)
+            return
+        sprite.set_position(x * TILE_SIZE, y * TILE_SIZE)
+
+    def _move(self, sprite, x, y):
+        """Move `sprite` to (x, y), gliding if it's one cell away."""
+        if sprite in self.moves:
+            x0, y0 = self.moves[sprite][:2]
+        else:
+            x0, y0 = sprite.x, sprite.y
+        if (x, y) == (x0, y0):
+            return
+        if abs(x - x0) <= TILE_SIZE and abs(y - y0) <= TILE_SIZE:
+            self.moves[sprite] = (x0, y0, x, y)
+        else:
+            self.moves.pop(sprite, None)
+        sprite.set_position(x, y)
+
+    def _chunk_cells(self, chunk):
+        cx, cy = chunk
+        for y in xrange(cy * CHUNK_SIZE,
+                        min((cy + 1) * CHUNK_SIZE, self.room.height)):
+            row = self.room[y]
+            for x in xrange(cx * CHUNK_SIZE,
+                            min((cx + 1) * CHUNK_SIZE, self.room.width)):
+                for z in xrange(len(row[x])):
+                    yield x, y, z
+
+    @trace.traced('RoomView._bake_chunk', 'view')
+    def _bake_chunk(self, chunk):
+        """Replace the vertex lists of the tiles in `chunk`."""
+        for vertex_list in self.baked.pop(chunk, ()):
+            vertex_list.delete()
+
+        # Gather the quads of each layer and texture
+        quads = {}
+        for x, y, z in self._chunk_cells(chunk):
+            entity = self.cells.get((x, y, z))
+            if not isinstance(entity, Tile):
+                continue
+            texture = entity_image(entity).get_texture()
+            key = (z, texture.id)
+            if key not in quads:
+                quads[key] = (texture, [], [])
+            vertices, tex_coords = quads[key][1:]
+            x1 = x * TILE_SIZE
+            y1 = y * TILE_SIZE
+            x2 = x1 + TILE_SIZE
+            y2 = y1 + TILE_SIZE
+            vertices.extend((x1, y1, x2, y1, x2, y2, x1, y2))
+            tex_coords.extend(texture.tex_coords)
+
+        baked = self.baked[chunk] = []
+        for (z, texture_id), (texture, vertices, tex_coords) in quads.items():
+            group = pyglet.sprite.SpriteGroup(
+                texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA,
+                layer_group(z, self.camera))
+            n = len(vertices) // 2
+            baked.append(self.batch.add(
+                n, GL_QUADS, group, ('v2i/static', vertices),
+                ('c4B/static', (255,) * (n * 4)),
+                ('t3f/static', tex_coords)))
+
+    def _hide_chunk(self, chunk):
+        for cell in self._chunk_cells(chunk):
+            entity = self.cells.pop(cell, None)
+            if entity is not None and not isinstance(entity, Tile):
+                self._delete_sprite(entity)
+        for vertex_list in self.baked.pop(chunk, ()):
+            vertex_list.delete()
+        self.stale.discard(chunk)
+
+    def scroll(self):
+        """Center the camera on its target, if it's in the room, then
+        draw the chunks that came into view and delete the sprites and
+        vertex lists of those that went out of it.
+        """
+        target = self.camera.target
+        if self.camera_move is not None:
+            start = self.camera_move[:2]
+        else:
+            start = (self.camera.scroll_x, self.camera.scroll_y)
+        if target is not None and target in self.room.coords:
+            x, y, z = self.room.coords[target]
+            self.camera.center(x, y, self.room)
+        scroll = (self.camera.scroll_x, self.camera.scroll_y)
+
+        # Glide if the camera scrolled by up to a tile since it was drawn
+        if (self.scrolled is not None and scroll != start and
+                abs(scroll[0] - start[0]) <= TILE_SIZE and
+                abs(scroll[1] - start[1]) <= TILE_SIZE):
+            self.camera_move = start + scroll
+        else:
+            self.camera_move = None
+        if scroll != self.scrolled or self.stale:
+            self.invalidate()
+        if scroll != self.scrolled:
+            self.scrolled = scroll
+            chunks = self.camera.chunks(self.room)
+            hidden = self.chunks - chunks
+            shown = chunks - self.chunks
+            for chunk in hidden:
+                self._hide_chunk(chunk)
+            self.chunks = chunks
+            for chunk in shown:
+                for x, y, z in self._chunk_cells(chunk):
+                    if self.room[y][x][z] is not None:
+                        self._update_cell(x, y, z)
+
+        for chunk in self.stale:
+            if chunk in self.chunks:
+                self._bake_chunk(chunk)
+        self.stale.clear()
+        if self.buffers is not None:
+            self.buffers.flush()
+
+    def update(self, cells):
+        """Redraw each (x, y, z) cell in `cells`, then scroll to follow
+        the camera's target.
+        """
+        for x, y, z in cells:
+            self._update_cell(x, y, z)
+        if cells:
+            self.invalidate()
+        self.scroll()
+
+    @property
+    def moving(self):
+        """Return True if any sprite or the camera is gliding."""
+        return bool(self.moves) or self.camera_move is not None
+
+    def interpolate(self, alpha):
+        """Draw each gliding sprite and the camera `alpha` of the way,
+        from 0 to 1, from where they were to where they are going.
+        """
+        if not self.moving:
+            return
+        for sprite, (x0, y0, x1, y1) in self.moves.iteritems():
+            sprite.set_position(int(x0 + (x1 - x0) * alpha),
+                                int(y0 + (y1 - y0) * alpha))
+        if self.camera_move is not None:
+            x0, y0, x1, y1 = self.camera_move
+            self.camera.scroll_x = int(x0 + (x1 - x0) * alpha)
+            self.camera.scroll_y = int(y0 + (y1 - y0) * alpha)
+        if self.buffers is not None:
+            self.buffers.flush()
+        self.invalidate()
+
+    def settle(self):
+        """Finish every glide, putting sprites and the camera where they
+        are going.
+        """
+        self.interpolate(1)
+        self.moves.clear()
+        self.camera_move = None
+
+    def invalidate(self):
+        """Called when the room changes on screen. Does nothing unless
+        replaced by the `invalidate` argument.
+        """
+
+    def delete(self):
+        """Delete every sprite and vertex list and detach the view from
+        its room.
+        """
+        for sprite in self.sprites.values():
+            sprite.delete()
+        self.moves.clear()
+        self.camera_move = None
+        for baked in self.baked.values():
+            for vertex_list in baked:
+                vertex_list.delete()
+        self.sprites.clear()
+        self.baked.clear()
+        self.stale.clear()
+        self.cells.clear()
+        self.chunks.clear()
+        self.scrolled = None
+        self.room.view = None
+        if self.buffers is not None:
+            self.buffers.flush()
+        self.invalidate()
+
+
+class WorldView(object):
+    """Draws the focused room of a World in a pyglet batch, through a
+    Camera that scrolls to follow `follow`ed entities.
+
+    If `buffered` is True, entities are drawn from shared vertex lists
+    rather than Sprites (see `crystals.quads`). If `invalidate` is given,
+    it is called whenever the focused room changes on screen.
+    """
+
+    def __init__(self, world, batch, camera=None, buffered=False,
+                 invalidate=None):
+        self.world = world
+        self.batch = batch
+        self.camera = Camera() if camera is None else camera
+        self.buffers = SpriteBuffers(batch, TILE_SIZE) if buffered else None
+        self.invalidate = invalidate
+        self.room_view = None
+
+        world.view = self
+        self.set_focus(world.focus)
+
+    def follow(self, entity):
+        """Keep the camera centered on `entity`."""
+        self.camera.target = entity
+        self.room_view.scroll()
+
+    @property
+    def moving(self):
+        """Return True if anything in the focused room is gliding."""
+        return self.room_view.moving
+
+    def interpolate(self, alpha):
+        """Draw gliding entities `alpha` of the way to where they are
+        going (see `RoomView.interpolate`).
+        """
+        self.room_view.interpolate(alpha)
+
+    def settle(self):
+        """Finish every glide in the focused room."""
+        self.room_view.settle()
+
+    @trace.traced('WorldView.set_focus', 'view')
+    def set_focus(self, room):
+        """Draw `room` in place of the previously focused room."""
+        if self.room_view is not None:
+            if self.room_view.room is room:
+                return
+            self.room_view.delete()
+        self.room_view = RoomView(room, self.batch, self.camera,
+                                  self.buffers, self.invalidate)
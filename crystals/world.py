@@ -1,27 +1,41 @@
-"""creation and mutation of the game world"""
-import pyglet
-from pyglet.graphics import OrderedGroup
+"""creation and mutation of the game world
 
-__all__ = ['Room', 'World', 'Entity', 'action']
+Nothing here depends on pyglet, so the world can be run without a
+display. Rooms and worlds are drawn by views from `crystals.view`.
+"""
+from array import array
+from collections import namedtuple, OrderedDict
+from weakref import WeakKeyDictionary
 
-TILE_SIZE = 24 # Width and height of each tile, in pixels
-ORIGIN_X = 10  # X and Y coordinates of the bottom left corner
-ORIGIN_Y = 124 # of room display, in pixels
+from crystals import trace
 
+__all__ = ['Room', 'RoomSnapshot', 'World', 'Entity', 'EntityState', 'Tile',
+           'action']
 
-class Entity(pyglet.sprite.Sprite):
-    """A tangible thing in the game world."""
+
+class EntityState(namedtuple('EntityState', [
+        'name', 'walkable', 'image', 'action', 'facing', 'id'])):
+    """The arguments needed to rebuild an `Entity`, in argument order."""
+    __slots__ = ()
+
+
+class Entity(object):
+    """A tangible thing in the game world.
+
+    `image` is the filename of the entity's image, or an image object.
+    An entity built from a room's atlas has the (room name, x, y, z) it
+    was built at as its `origin`; other entities have None.
+    """
 
     def __init__(self, name, walkable, image, action=None, facing=(0, -1),  
                  id=None):
-        image = pyglet.resource.image(image)
-        super(Entity, self).__init__(image)
-
         self.name = name
+        self.image = image
         self.walkable = walkable
         self._facing = facing
         self.action = action
         self.id = id
+        self.origin = None
 
     @property
     def facing(self):
@@ -32,88 +46,365 @@ class Entity(pyglet.sprite.Sprite):
         x, y = xy
         self._facing = (x, y)
 
+    def state(self):
+        """Return an EntityState from which the entity can be rebuilt."""
+        return EntityState(self.name, self.walkable, self.image, self.action,
+                           self.facing, self.id)
+
+
+class Tile(namedtuple('Tile', ['name', 'walkable', 'image', 'action'])):
+    """An immutable static entity, shared between every cell of a room
+    that it occupies.
+
+    Tiles are never moved, so they have no coordinates of their own.
+    """
+    __slots__ = ()
+
+    id = None
+
+    @classmethod
+    def from_entity(cls, entity):
+        """Return a Tile with the same attributes as `entity`."""
+        return cls(entity.name, entity.walkable, entity.image, entity.action)
+
 
 class Room(list):
+    """A [y][x][z] grid of entities.
+
+    If the room has a `view`, the view is told which cells have changed
+    on each call to `update`.
+
+    Unwalkable shared tiles, such as walls, are the room's fixed
+    obstacles and are counted separately in `walls`. While
+    `wall_changes` is a list, the (x, y) of each cell that gains its
+    first fixed obstacle or loses its last is appended to it.
+
+    The (x, y) of every cell changed since the room was built is kept in
+    `touched`, so that saved games need only record those cells, and
+    `version` counts the changes, so that records can be reused until
+    the room changes again.
+
+    A room rebuilt from a RoomSnapshot maps the entities of the room
+    snapshotted, those still referenced elsewhere, to the entities that
+    took their place in `rebuilt`.
+    """
 
     def __init__(self, name, grid):
         super(Room, self).__init__(grid)
         self.name = name
-        self.batch = None
-
-        # Index unique entities by instance attribute `id`
+        self.view = None
+        self.dirty = set() # (x, y, z) of cells changed since last update
+        self.touched = set() # (x, y) of cells changed since built
+        self.version = 0 # Number of changes since built
+        self.changes = None # List to record unique entity changes in
+        self.rebuilt = {} # Maps snapshotted entities to their rebuilds
+        self.height = len(self)
+        self.width = len(self[0]) if self.height else 0
+
+        # Count unwalkable entities, and unwalkable tiles among them, in
+        # each cell, indexed by y*width + x
+        self.blocked = array('H', [0]) * (self.width * self.height)
+        self.walls = array('H', [0]) * (self.width * self.height)
+        self.wall_changes = None
+
+        # Index unique entities by instance attribute `id`, and the
+        # coordinates of every entity that isn't a shared Tile
         self.uniques = {}
+        self.coords = {}
         for entity, x, y, z in self._iter_entities():
             if entity.id:
                 self.uniques[entity.id] = entity
+            if not isinstance(entity, Tile):
+                self.coords[entity] = (x, y, z)
+            if not entity.walkable:
+                self.blocked[y * self.width + x] += 1
+                if isinstance(entity, Tile):
+                    self.walls[y * self.width + x] += 1
 
     def _iter_entities(self):
-        for y in xrange(len(self)):
-            for x in xrange(len(self[y])):
-                for z, entity in enumerate(self[y][x]):
+        for y, row in enumerate(self):
+            for x, cell in enumerate(row):
+                for z, entity in enumerate(cell):
                     if entity:
                         yield entity, x, y, z
 
-    def _update_entity(self, entity, x, y, z):
-        """Update the entity's rendered position to reflect (x, y, z),
-        and set the entity's batch to self.batch.
+    def _set_cell(self, entity, x, y, z):
+        """Put `entity` at (x, y, z), keeping self.blocked, self.coords
+        and self.uniques in sync.
         """
-        newx = x * TILE_SIZE + ORIGIN_X
-        newy = y * TILE_SIZE + ORIGIN_Y
-        entity.set_position(newx, newy)
-        entity.group = OrderedGroup(z)
-        entity.batch = self.batch
+        i = y * self.width + x
+        old = self[y][x][z]
+        if old is not None:
+            if not old.walkable:
+                self.blocked[i] -= 1
+                if isinstance(old, Tile):
+                    self.walls[i] -= 1
+                    if not self.walls[i] and self.wall_changes is not None:
+                        self.wall_changes.append((x, y))
+            if (not isinstance(old, Tile) and
+                    self.coords.get(old) == (x, y, z)):
+                del self.coords[old]
+                if old.id and self.uniques.get(old.id) is old:
+                    del self.uniques[old.id]
+                    if self.changes is not None:
+                        self.changes.append((self.name, old, False))
+        if entity is not None:
+            if not entity.walkable:
+                self.blocked[i] += 1
+                if isinstance(entity, Tile):
+                    self.walls[i] += 1
+                    if self.walls[i] == 1 and self.wall_changes is not None:
+                        self.wall_changes.append((x, y))
+            if not isinstance(entity, Tile):
+                self.coords[entity] = (x, y, z)
+            if entity.id:
+                self.uniques[entity.id] = entity
+                if self.changes is not None:
+                    self.changes.append((self.name, entity, True))
+        self[y][x][z] = entity
+        self.touched.add((x, y))
+        self.version += 1
 
+    @trace.traced('Room.update', 'world')
     def update(self):
-        """Update the room, preparing it for rendering."""
-        for entity, x, y, z in self._iter_entities():
-            self._update_entity(entity, x, y, z)
+        """Pass the cells changed since the last update to the room's
+        view, if any.
+        """
+        if self.view is not None:
+            self.view.update(self.dirty)
+        self.dirty.clear()
 
     def iswalkable(self, x, y):
         """Return True if, for every layer, (x, y) is in bounds and is
         either None or a walkable entity, else return False.
+
+        Only changes made through Room methods are seen here; an entity
+        whose `walkable` attribute changes in place must be replaced.
         """
-        if (x < 0 or x >= len(self[0])) or (y < 0 or y >= len(self)):
+        if (x < 0 or x >= self.width) or (y < 0 or y >= self.height):
             return False
-        for e in self[y][x]:
-            if e != None and not e.walkable:
-                return False
-        return True
+        return not self.blocked[y * self.width + x]
 
     def get_coords(self, entity):
-        """Return x, y, and z coordinates of the given entity in the room."""
-        x = (entity.x - ORIGIN_X) / TILE_SIZE
-        y = (entity.y - ORIGIN_Y) / TILE_SIZE
-        if entity.group is None:
-            z = None
-        else:
-            z = entity.group.order
-        return x, y, z
+        """Return x, y, and z coordinates of the given entity in the room.
+
+        Raise KeyError if the entity is not in the room. Shared tiles
+        have no coordinates of their own, so they are never found.
+        """
+        return self.coords[entity]
 
     def replace_entity(self, entity, x, y, z):
         """Place 'entity' at (x, y, z), replacing an existing entity if
         neccessary.
+
+        The room's view isn't told of the change until the next call to
+        `update`.
         """
-        self[y][x][z] = entity
-        self._update_entity(entity, x, y, z)
+        self._set_cell(entity, x, y, z)
+        self.dirty.add((x, y, z))
+
+    def insert_entity(self, entity, x, y, z):
+        """Insert `entity` at (x, y, z), moving the entities at and
+        above z up a layer.
+
+        Only `entity` is recorded as a change; the entities moved up
+        stay in the cell, so neither they nor its obstacles change.
+        """
+        cell = self[y][x]
+        cell.insert(z, None)
+        for above in xrange(z + 1, len(cell)):
+            moved = cell[above]
+            if (moved is not None and not isinstance(moved, Tile) and
+                    self.coords.get(moved) == (x, y, above - 1)):
+                self.coords[moved] = (x, y, above)
+            self.dirty.add((x, y, above))
+        self.replace_entity(entity, x, y, z)
+
+    def remove_entity(self, x, y, z):
+        """Remove and return the entity at (x, y, z)."""
+        entity = self[y][x][z]
+        self._set_cell(None, x, y, z)
+        self.dirty.add((x, y, z))
+        return entity
+
+    def replace_stack(self, x, y, entities):
+        """Put the entities in list `entities` at (x, y), bottom first,
+        in place of every entity there now.
+
+        The stack keeps its height if `entities` is shorter, so that
+        the room's view never has to drop layers.
+        """
+        cell = self[y][x]
+        for z, entity in enumerate(cell):
+            if entity is not None:
+                self.remove_entity(x, y, z)
+        cell.extend([None] * (len(entities) - len(cell)))
+        for z, entity in enumerate(entities):
+            if entity is not None:
+                self.replace_entity(entity, x, y, z)
+
+    def snapshot(self):
+        """Return a RoomSnapshot of the room's current state."""
+        return RoomSnapshot(self)
+
+
+class RoomSnapshot(object):
+    """A compact, immutable record of a room's state.
+
+    Shared tiles are kept as they are, while other entities are reduced
+    to their EntityState. Calling the snapshot rebuilds the room, with
+    each entity rebuilt as a plain `Entity`. The room's touched cells
+    and the origins of its entities are kept too.
+
+    Where each entity was is kept without keeping the entity alive, so
+    that the entities still referenced elsewhere, such as by scheduled
+    actions, can be matched to their rebuilds (see `Room`).
+    """
+
+    def __init__(self, room):
+        self.name = room.name
+        self.grid = tuple(
+            tuple(tuple(self._freeze(entity) for entity in cell)
+                  for cell in row)
+            for row in room)
+        self.touched = frozenset(room.touched)
+        self.origins = dict(
+            (xyz, entity.origin) for entity, xyz in room.coords.iteritems()
+            if getattr(entity, 'origin', None))
+        self.coords = WeakKeyDictionary(room.coords)
+        for entity, rebuilt in room.rebuilt.items():
+            if rebuilt in room.coords:
+                self.coords[entity] = room.coords[rebuilt]
+
+    @staticmethod
+    def _freeze(entity):
+        if entity is None or isinstance(entity, Tile):
+            return entity
+        return entity.state()
+
+    @staticmethod
+    def _thaw(entity):
+        if isinstance(entity, EntityState):
+            return Entity(*entity)
+        return entity
+
+    def __call__(self):
+        """Return a new Room with the recorded state."""
+        grid = [[[self._thaw(entity) for entity in cell] for cell in row]
+                for row in self.grid]
+        room = Room(self.name, grid)
+        room.touched.update(self.touched)
+        for (x, y, z), origin in self.origins.iteritems():
+            room[y][x][z].origin = origin
+        room.rebuilt = WeakKeyDictionary(
+            (entity, room[y][x][z])
+            for entity, (x, y, z) in self.coords.items())
+        return room
 
 
 class World(dict):
-    """A collection of rooms linked by portals."""
+    """A collection of rooms linked by portals.
 
-    def __init__(self, rooms, portals, start):
+    Rooms are mapped to their names. Instead of a Room, a name may be
+    mapped to a room factory: a callable that returns the Room, which is
+    called the first time the room is looked up with `world[name]`. Other
+    dict methods, such as `values` and `get`, return factories as-is.
+
+    If `budget` is given, at most that many rooms are kept loaded. When
+    a lookup or a change of focus exceeds the budget, the least recently
+    used room other than the focus is evicted, leaving a RoomSnapshot as
+    its factory.
+
+    If the world has a `view`, the view is told whenever the focus is set.
+
+    After a call to `track_changes`, each unique entity that is put in or
+    removed from a loaded room is recorded in `changes` as a tuple of
+    (room name, entity, True if put in the room).
+    """
+
+    def __init__(self, rooms, portals, start, budget=None):
         dict.__init__(self, rooms)
+        self.budget = budget
 
-        self._portals_dest2xy = dict.fromkeys(portals, {})
-        self._portals_xy2dest = dict.fromkeys(portals, {})
+        # Names of loaded rooms, from least to most recently used
+        self._loaded = OrderedDict(
+            (name, None) for name, room in rooms.iteritems()
+            if isinstance(room, Room))
+
+        self._portals_dest2xy = dict((name, {}) for name in portals)
+        self._portals_xy2dest = dict((name, {}) for name in portals)
         for from_room, portal in portals.iteritems():
             for dest, xy in portal.iteritems():
                 self._portals_dest2xy[from_room][dest] = xy
                 self._portals_xy2dest[from_room][xy] = dest
 
         self._focus = None
-        self.batch = None
+        self.view = None
+        self.changes = None
         self.set_focus(start)
 
+    def __getitem__(self, name):
+        room = dict.__getitem__(self, name)
+        if not isinstance(room, Room):
+            room = room()
+            dict.__setitem__(self, name, room)
+        if self.changes is not None and room.changes is not self.changes:
+            self._track(room)
+
+        self._loaded.pop(name, None)
+        self._loaded[name] = None
+        if self.budget is not None:
+            self._evict(self.budget, name)
+        return room
+
+    def _evict(self, budget, keep):
+        """Evict least recently used rooms other than the focus and the
+        room named `keep` until no more than `budget` rooms are loaded.
+        """
+        for name in list(self._loaded):
+            if len(self._loaded) <= budget:
+                break
+            room = dict.__getitem__(self, name)
+            if name == keep or room is self.focus:
+                continue
+            dict.__setitem__(self, name, room.snapshot())
+            del self._loaded[name]
+
+    def _track(self, room):
+        room.changes = self.changes
+        self.changes.extend(
+            (room.name, entity, True) for entity in room.uniques.values())
+
+    def track_changes(self):
+        """Start recording changes to unique entities in `changes`,
+        beginning with every unique entity in the loaded rooms.
+        """
+        if self.changes is not None:
+            return
+        self.changes = []
+        for name in self._loaded:
+            self._track(dict.__getitem__(self, name))
+
+    def notify(self, entity, room=''):
+        """Record a change to unique entity `entity` in the room with
+        the given name, such as a change to one of its attributes.
+        If `room` tests False, use the focused room.
+        """
+        room = self[room] if room else self.focus
+        if self.changes is not None:
+            self.changes.append((room.name, entity, True))
+
+    def isloaded(self, name):
+        """Return True if the room with the given name is loaded."""
+        return name in self._loaded
+
+    def factory(self, name):
+        """Return the factory of the room with the given name, or None if
+        the room is loaded.
+        """
+        room = dict.__getitem__(self, name)
+        return None if isinstance(room, Room) else room
+
     @property
     def focus(self):
         return self._focus
@@ -126,18 +417,20 @@ class World(dict):
     def portals_xy2dest(self):
         return self._portals_xy2dest
 
+    @trace.traced('World.set_focus', 'world')
     def set_focus(self, room=''):
-        """Set the focus to room with name `room`, setting its batch to
-        self.batch and updating its entities.
-        """
-        if self.focus:
-            self.focus.batch = None
-            self.focus.update()
+        """Set the focus to room with name `room`, then tell the world's
+        view, if any. If `room` tests False, keep the current focus.
 
+        The room left is no longer kept loaded, so it may be evicted.
+        """
         room = self[room] if room else self.focus
-        room.batch = self.batch
         room.update()
         self._focus = room
+        if self.budget is not None:
+            self._evict(self.budget, room.name)
+        if self.view is not None:
+            self.view.set_focus(room)
 
     def get_entity(self, id, room=''):
         """Return a unique entity from room with the given name, given
@@ -165,24 +458,20 @@ class World(dict):
         else:
             z = min(depth - 1, z)
 
-        if room[y][x][z]:
-            z += 1
-            if z == depth:
-                room[y][x].append(None)
-            else:
-                room[y][x].insert(z, None)
-                for i, ent in enumerate(room[y][x][z + 1:]):
-                    if ent:
-                        room.replace_entity(ent, x, y, z + 1 + i)
-
-        room.replace_entity(entity, x, y, z)
+        if not room[y][x][z]:
+            room.replace_entity(entity, x, y, z)
+        elif z + 1 == depth:
+            room[y][x].append(None)
+            room.replace_entity(entity, x, y, z + 1)
+        else:
+            room.insert_entity(entity, x, y, z + 1)
+        room.update()
 
     def pop_entity(self, x, y, z, room=''):
         """Remove and return the entity at (x, y, z)."""
         room = self[room] if room else self.focus
-        
-        entity = room[y][x][z]
-        room[y][x][z] = None
+        entity = room.remove_entity(x, y, z)
+        room.update()
         return entity
     
     def step_entity(self, entity, xstep, ystep):
@@ -205,7 +494,9 @@ class World(dict):
         if not self.focus.iswalkable(newx, newy):
             return False
 
-        self.pop_entity(x, y, z)
+        # Update the room only once the entity has arrived, so that its
+        # view sees a move rather than a removal
+        self.focus.remove_entity(x, y, z)
         self.add_entity(entity, newx, newy, z)
         return True
 
@@ -213,8 +504,10 @@ class World(dict):
         """If a portal exists at (x, y), transfer entity from its
         current room to the destination room of the portal.
         """
-        destname = self.portals_xy2dest[self.focus.name][(x, y)]
-        z = self.focus.get_coords(entity)[2]
-        self.pop_entity(x, y, z)
-        x, y = self.portals_dest2xy[destname][self.focus.name]
+        room = self.focus
+        destname = self.portals_xy2dest[room.name][(x, y)]
+        z = room.get_coords(entity)[2]
+        room.remove_entity(x, y, z)
+        x, y = self.portals_dest2xy[destname][room.name]
         self.add_entity(entity, x, y, z, destname)
+        room.update()
@@ -13,6 +13,14 @@ if __name__ == '__main__':
         if sys.argv[1] == 'test':
             # Run the test suite with the given args
             subprocess.call(['nosetests2'] + sys.argv[2:] + TEST_PKGS)
+        elif sys.argv[1] == 'bench':
+            # Run the benchmarks with the given args
+            subprocess.call(
+                ['python2', '-m', 'crystals.bench'] + sys.argv[2:])
+        elif sys.argv[1] == 'replay':
+            # Replay a recorded game with the given args
+            subprocess.call(
+                ['python2', '-m', 'crystals.replay'] + sys.argv[2:])
         else:
             # Call python2 with all args given to ./run.py
             subprocess.call(['python2'] + sys.argv[1:] + ['run.py'])